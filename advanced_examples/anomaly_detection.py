@@ -7,29 +7,54 @@ pip install scikit-learn
 
 This module includes the following components:
 
-generate_history_data: Generates historical sales data for training the anomaly detector.
-AnomalyDetector: A wrapper class around the IsolationForest algorithm that initializes, trains, and predicts anomalies.
+generate_history_data: Generates historical sales data for training the anomaly detector. The data is drawn from a seeded random generator, so the same number of records and seed always give the same training data.
+AnomalyDetector: A wrapper class around the IsolationForest algorithm that initializes, trains, and predicts anomalies, either one data point at a time (predict) or for a whole batch in a single vectorized call (predict_many).
 calculate_transaction_amount: Calculates the transaction amount from a sales record.
 init_anomaly_detector: Initializes and trains the anomaly detector with historical data.
+detect_anomalies: Scores a batch of payloads with one vectorized call and sets the is_anomaly field on each of them.
+label_anomalies: The columnar version of detect_anomalies. It scores an array of transaction amounts and returns the array of is_anomaly values ("true" or "false") with the scores.
+save_anomaly_detector: Writes a trained anomaly detector to disk together with the model format version, the scikit-learn version and a fingerprint of its training data.
+load_anomaly_detector: Loads a stored anomaly detector, memory-mapping its arrays, or returns None if no compatible artifact exists. Given the fingerprint of the expected training data, it also rejects a model trained on other data.
+load_or_train_anomaly_detector: Generates the training data, loads the stored anomaly detector if it was trained on that data, and only falls back to training (and storing) a new one when no compatible artifact exists.
+ReservoirSample: A bounded reservoir sample of the transaction amounts, biased towards recent ones. Once it is full, every new amount replaces a random slot, so an amount is still in the sample after n more amounts with probability about exp(-n / capacity): a refit sees mostly the last few capacity amounts and tracks drift, while a uniform reservoir would give new amounts a shrinking share of the sample.
+OnlineAnomalyDetector: Wraps an AnomalyDetector, keeps a reservoir sample of the transaction amounts it scores and refits the model on a background thread, either on a schedule or after a number of records. The refitted model is swapped in atomically, so scoring never waits for training. Its metrics method reports the reservoir memory limits and refit latency.
+
+The model path can be set with the ANOMALY_MODEL_PATH environment variable, and defaults to models/anomaly_detector.joblib in the app directory, wherever the app is started from. Run scripts/train_anomaly_model.py once to train and store the model, and to compare cold-start time with and without it.
 
 The main purpose of this module is to detect anomalies in the sales transactions to identify potentially fraudulent activities or data entry errors.
 """
 
-from sklearn.ensemble import IsolationForest
-import numpy as np
+import hashlib
+import os
 import random
+import threading
+import time
+
+import joblib
+import numpy as np
+import sklearn
+from sklearn.ensemble import IsolationForest
+
+# Bump whenever the stored artifact layout or the model definition changes
+MODEL_FORMAT_VERSION = 1
+ANOMALY_MODEL_PATH = os.getenv("ANOMALY_MODEL_PATH") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models", "anomaly_detector.joblib"
+)
 
-def generate_history_data(num_records):
+def generate_history_data(num_records, seed=0):
+    rng = random.Random(seed)
     history_data = []
     for _ in range(num_records):
-        price = random.uniform(1, 50)  # Random price between 1 and 50
-        quantity = random.randint(1, 10)  # Random quantity between 1 and 10
+        price = rng.uniform(1, 50)  # Random price between 1 and 50
+        quantity = rng.randint(1, 10)  # Random quantity between 1 and 10
         history_data.append({"price": price, "quantity": quantity})
     return history_data
 
 class AnomalyDetector:
     def __init__(self, contamination=0.1):
+        self.contamination = contamination
         self.detector = IsolationForest(contamination=contamination)
+        self.training_fingerprint = None
 
     def fit(self, data):
         self.detector.fit(data)
@@ -38,6 +63,16 @@ class AnomalyDetector:
         reshaped_data = np.array(data_point).reshape(1, -1)
         return self.detector.predict(reshaped_data)[0]
 
+    def predict_many(self, data_points):
+        # Same decision rule as IsolationForest.predict (negative decision
+        # function means outlier), but the raw scores are returned as well
+        reshaped_data = np.asarray(data_points, dtype=float).reshape(-1, 1)
+        if reshaped_data.shape[0] == 0:
+            return np.empty(0, dtype=int), np.empty(0, dtype=float)
+        scores = self.detector.decision_function(reshaped_data)
+        predictions = np.where(scores < 0, -1, 1)
+        return predictions, scores
+
 def calculate_transaction_amount(payload):
     return payload['price'] * payload['quantity']
 
@@ -47,4 +82,199 @@ def init_anomaly_detector(history_data):
 
     anomaly_detector = AnomalyDetector()
     anomaly_detector.fit(transaction_amounts)
+    anomaly_detector.training_fingerprint = fingerprint_training_data(transaction_amounts)
+    return anomaly_detector
+
+def detect_anomalies(anomaly_detector, payloads):
+    transaction_amounts = [calculate_transaction_amount(payload) for payload in payloads]
+    predictions, scores = anomaly_detector.predict_many(transaction_amounts)
+
+    for payload, prediction in zip(payloads, predictions):
+        payload["is_anomaly"] = "true" if prediction == -1 else "false"
+    return scores
+
+def label_anomalies(anomaly_detector, transaction_amounts):
+    predictions, scores = anomaly_detector.predict_many(transaction_amounts)
+    return np.where(predictions == -1, "true", "false"), scores
+
+def fingerprint_training_data(transaction_amounts):
+    data = np.ascontiguousarray(transaction_amounts, dtype=np.float64)
+    return hashlib.sha256(data.tobytes()).hexdigest()
+
+def save_anomaly_detector(anomaly_detector, path=ANOMALY_MODEL_PATH):
+    artifact = {
+        "format_version": MODEL_FORMAT_VERSION,
+        "sklearn_version": sklearn.__version__,
+        "contamination": anomaly_detector.contamination,
+        "training_fingerprint": anomaly_detector.training_fingerprint,
+        "detector": anomaly_detector.detector,
+    }
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Write to a temporary file first so concurrent workers never load a partial artifact
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(artifact, tmp_path)
+    os.replace(tmp_path, path)
+
+def load_anomaly_detector(path=ANOMALY_MODEL_PATH, contamination=0.1, mmap_mode="r", training_fingerprint=None):
+    if not os.path.exists(path):
+        return None
+
+    try:
+        artifact = joblib.load(path, mmap_mode=mmap_mode)
+    except Exception as e:
+        print(f"Error loading anomaly model from {path}: {e}")
+        return None
+
+    if (
+        not isinstance(artifact, dict)
+        or artifact.get("format_version") != MODEL_FORMAT_VERSION
+        or artifact.get("sklearn_version") != sklearn.__version__
+        or artifact.get("contamination") != contamination
+    ):
+        return None
+    if training_fingerprint is not None and artifact.get("training_fingerprint") != training_fingerprint:
+        print(f"Anomaly model at {path} was trained on other data, retraining it")
+        return None
+
+    anomaly_detector = AnomalyDetector(contamination=contamination)
+    anomaly_detector.detector = artifact["detector"]
+    anomaly_detector.training_fingerprint = artifact["training_fingerprint"]
     return anomaly_detector
+
+def load_or_train_anomaly_detector(path=ANOMALY_MODEL_PATH, num_records=1000):
+    # Generating the training data is cheap, training on it isn't
+    history_data = generate_history_data(num_records)
+    training_fingerprint = fingerprint_training_data([calculate_transaction_amount(data) for data in history_data])
+    anomaly_detector = load_anomaly_detector(path, training_fingerprint=training_fingerprint)
+    if anomaly_detector is not None:
+        return anomaly_detector
+
+    anomaly_detector = init_anomaly_detector(history_data)
+    try:
+        save_anomaly_detector(anomaly_detector, path)
+    except OSError as e:
+        print(f"Error saving anomaly model to {path}: {e}")
+    return anomaly_detector
+
+class ReservoirSample:
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+        self.seen = 0
+        self._rng = np.random.default_rng()
+        self._lock = threading.Lock()
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        with self._lock:
+            # Fill the free slots first, then replace a random slot (exponentially biased towards recent values)
+            free = min(self.capacity - self.size, len(values))
+            self.values[self.size:self.size + free] = values[:free]
+            self.size += free
+            self.seen += free
+
+            remaining = values[free:]
+            if len(remaining):
+                slots = self._rng.integers(0, self.capacity, len(remaining))
+                self.values[slots] = remaining
+                self.seen += len(remaining)
+
+    def snapshot(self):
+        with self._lock:
+            return self.values[:self.size].copy()
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+class OnlineAnomalyDetector:
+    def __init__(self, anomaly_detector, reservoir_size=10000, refit_every=5000, refit_interval=300.0, min_samples=100):
+        self.anomaly_detector = anomaly_detector
+        self.reservoir = ReservoirSample(reservoir_size)
+        self.refit_every = refit_every
+        self.refit_interval = refit_interval
+        self.min_samples = min_samples
+
+        self.refit_count = 0
+        self.refit_errors = 0
+        self.last_refit_seconds = None
+        self.last_refit_at = None
+        self._records_since_refit = 0
+        self._lock = threading.Lock()
+        self._refit_requested = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="anomaly-refit", daemon=True)
+        self._thread.start()
+
+    def predict(self, data_point):
+        prediction = self.anomaly_detector.predict(data_point)
+        self.observe([data_point])
+        return prediction
+
+    def predict_many(self, data_points):
+        predictions, scores = self.anomaly_detector.predict_many(data_points)
+        self.observe(data_points)
+        return predictions, scores
+
+    def observe(self, transaction_amounts):
+        transaction_amounts = np.asarray(transaction_amounts, dtype=np.float64).ravel()
+        with self._lock:
+            self.reservoir.add_many(transaction_amounts)
+            self._records_since_refit += len(transaction_amounts)
+            if self.refit_every and self._records_since_refit >= self.refit_every:
+                self._refit_requested.set()
+
+    def refit(self):
+        # Every amount observed is either in this snapshot or counted towards the next refit
+        with self._lock:
+            samples = self.reservoir.snapshot()
+            if len(samples) < self.min_samples:
+                return False
+            self._records_since_refit = 0
+
+        start = time.perf_counter()
+        anomaly_detector = AnomalyDetector(contamination=self.anomaly_detector.contamination)
+        anomaly_detector.fit(samples.reshape(-1, 1))
+        anomaly_detector.training_fingerprint = fingerprint_training_data(samples)
+
+        # Rebinding the attribute is atomic, in-flight predictions keep using the previous model
+        self.anomaly_detector = anomaly_detector
+        self.last_refit_seconds = time.perf_counter() - start
+        self.last_refit_at = time.time()
+        self.refit_count += 1
+        return True
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._refit_requested.set()
+        self._thread.join(timeout)
+
+    def metrics(self):
+        return {
+            "reservoir_capacity": self.reservoir.capacity,
+            "reservoir_size": self.reservoir.size,
+            "reservoir_bytes": self.reservoir.nbytes,
+            "records_seen": self.reservoir.seen,
+            "records_since_refit": self._records_since_refit,
+            "refit_count": self.refit_count,
+            "refit_errors": self.refit_errors,
+            "last_refit_seconds": self.last_refit_seconds,
+            "last_refit_at": self.last_refit_at,
+        }
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._refit_requested.wait(self.refit_interval)
+            if self._stopped.is_set():
+                break
+            # Cleared before refitting, a request made while it runs triggers the next refit
+            self._refit_requested.clear()
+            try:
+                self.refit()
+            except Exception as e:
+                self.refit_errors += 1
+                print(f"Error refitting anomaly detector: {e}")
@@ -11,17 +11,36 @@ This module includes the following functions:
 
 create_redis_client: Creates a Redis client instance using the provided host, port, and password.
 is_duplicate: Checks if a deduplication key exists in Redis, and if not, sets it with an expiration time.
+find_duplicates: The batch version of is_duplicate. It checks and sets all the deduplication keys of a batch in one pipelined round trip to Redis and returns a duplicate flag per key. The first occurrence of a key wins, including when the same key appears more than once in the batch. Like is_duplicate, it treats every key as new if Redis can't be reached.
+RotatingBloomFilter: A memory-bounded, time-rotating Bloom filter. It keeps a few generations of bit arrays and drops the oldest one on rotation, so it remembers every key added within the expiration window without growing.
+DedupPreFilter: An in-process pre-filter in front of Redis. Keys the Bloom filter has definitely not seen are answered as new locally and registered in Redis later, in bulk. Only possible duplicates are sent to Redis for confirmation. Keys answered locally are registered by a background thread once the oldest of them has waited max_pending_seconds, even if no other batch arrives, or with the next round trip if that comes first. Registrations that fail are retried with the next one, and close registers the pending keys, which main.py does when the app shuts down. Its stats method reports the memory footprint, the configured and observed false-positive rates and the Redis confirmations saved.
+
+The pre-filter only knows the keys its own process has seen, so enable it (REDIS_DEDUP_PREFILTER=true) only when a given order is always routed to the same worker. Keys seen before a restart are not in the filter, so on startup it is seeded with the dedup keys still in Redis (a SCAN of the keys matching DEDUP_KEY_PATTERN), which takes about a second per few hundred thousand keys. If Redis can't be scanned, it sends every key to Redis for the first expiration window instead. Its capacity (keys per expiration window) and false-positive rate can be set with REDIS_DEDUP_PREFILTER_CAPACITY and REDIS_DEDUP_PREFILTER_ERROR_RATE.
 
 The main purpose of this module is to prevent duplicate sales records from being processed and to maintain data consistency within the dataset.
 """
 
+import hashlib
+import math
 import os
+import threading
+import time
+from collections import deque
+
 import redis
 
+from pipeline.structured_logging import rate_limited_print
+
 REDIS_HOST = os.getenv("REDIS_HOST")
 REDIS_PORT = os.getenv("REDIS_PORT")
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
 
+REDIS_DEDUP_PREFILTER_CAPACITY = int(os.getenv("REDIS_DEDUP_PREFILTER_CAPACITY", "100000"))
+REDIS_DEDUP_PREFILTER_ERROR_RATE = float(os.getenv("REDIS_DEDUP_PREFILTER_ERROR_RATE", "0.01"))
+
+# Dedup keys are "<customer_id>_<order_id>"
+DEDUP_KEY_PATTERN = "*_*"
+
 def create_redis_client():
     redis_client = redis.Redis(
         host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=0
@@ -36,6 +55,235 @@ def is_duplicate(redis_client, dedup_key, expiration_time=3600):
         )
         return result is None
     except redis.RedisError as e:
-        print(f"Error interacting with Redis: {e}")
+        rate_limited_print("redis_error", lambda: f"Error interacting with Redis: {e}")
         return False
 
+def find_duplicates(redis_client, dedup_keys, expiration_time=3600):
+    duplicates = [False] * len(dedup_keys)
+
+    # Later occurrences of a key within the batch are duplicates of the first one
+    first_positions = {}
+    for position, dedup_key in enumerate(dedup_keys):
+        if dedup_key in first_positions:
+            duplicates[position] = True
+        else:
+            first_positions[dedup_key] = position
+
+    if not first_positions:
+        return duplicates
+
+    try:
+        pipeline = redis_client.pipeline(transaction=False)
+        for dedup_key in first_positions:
+            pipeline.set(dedup_key, "placeholder", ex=expiration_time, nx=True)
+        results = pipeline.execute()
+    except redis.RedisError as e:
+        rate_limited_print("redis_error", lambda: f"Error interacting with Redis: {e}")
+        return [False] * len(dedup_keys)
+
+    for position, result in zip(first_positions.values(), results):
+        duplicates[position] = result is None
+    return duplicates
+
+class RotatingBloomFilter:
+    def __init__(self, capacity=100000, error_rate=0.01, window=3600, generations=2):
+        # Standard sizing for `capacity` keys per generation at the given false-positive rate
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.generations = max(2, generations)
+        # A key stays in the filter for at least (generations - 1) spans, i.e. the whole window
+        self.generation_span = window / (self.generations - 1)
+
+        self._generations = deque([bytearray(self._generation_bytes)])
+        self._generation_started = time.monotonic()
+
+    def add(self, key):
+        # Returns whether the key might have been added before
+        self._rotate()
+        positions = self._positions(key)
+        seen = any(
+            all(bits[position >> 3] & (1 << (position & 7)) for position in positions)
+            for bits in self._generations
+        )
+        bits = self._generations[-1]
+        for position in positions:
+            bits[position >> 3] |= 1 << (position & 7)
+        return seen
+
+    @property
+    def memory_bytes(self):
+        return self.generations * self._generation_bytes
+
+    @property
+    def _generation_bytes(self):
+        return (self.num_bits + 7) // 8
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.num_bits for i in range(self.num_hashes)]
+
+    def _rotate(self):
+        now = time.monotonic()
+        elapsed = now - self._generation_started
+        if elapsed < self.generation_span:
+            return
+
+        if elapsed >= self.generation_span * self.generations:
+            # Idle for longer than the window, nothing in the filter is still relevant
+            self._generations.clear()
+            self._generations.append(bytearray(self._generation_bytes))
+            self._generation_started = now
+            return
+
+        while now - self._generation_started >= self.generation_span:
+            self._generation_started += self.generation_span
+            self._generations.append(bytearray(self._generation_bytes))
+        while len(self._generations) > self.generations:
+            self._generations.popleft()
+
+class DedupPreFilter:
+    def __init__(self, capacity=100000, error_rate=0.01, expiration_time=3600, max_pending=1000, max_pending_seconds=1.0):
+        self.bloom = RotatingBloomFilter(capacity, error_rate, window=expiration_time)
+        self.expiration_time = expiration_time
+        self.max_pending = max_pending
+        self.max_pending_seconds = max_pending_seconds
+        # Until the filter has seen a full window, or is seeded from Redis, it can't tell that a key is new
+        self._warm_after = time.monotonic() + expiration_time
+        # (dedup key, first seen) pairs answered as new locally and not yet registered in Redis
+        self._pending = []
+        # The client of the last batch, for the background registrations
+        self._redis_client = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        # Registers the pending keys when no batch arrives to carry them
+        self._thread = threading.Thread(target=self._run, name="dedup-prefilter", daemon=True)
+        self._thread.start()
+
+        self.keys_checked = 0
+        self.answered_locally = 0
+        self.redis_confirmations = 0
+        self.confirmed_duplicates = 0
+        self.false_positives = 0
+        self.redis_round_trips = 0
+        self.keys_seeded = 0
+
+    def seed(self, redis_client, pattern=DEDUP_KEY_PATTERN, count=1000):
+        # Adds the keys still in Redis, which are the keys of the last expiration window, so that the filter is warm
+        # right away. Returns whether it succeeded
+        with self._lock:
+            try:
+                for dedup_key in redis_client.scan_iter(match=pattern, count=count):
+                    self.bloom.add(dedup_key.decode("utf-8") if isinstance(dedup_key, bytes) else dedup_key)
+                    self.keys_seeded += 1
+            except redis.RedisError as e:
+                rate_limited_print("redis_error", lambda: f"Error interacting with Redis: {e}")
+                return False
+            self._warm_after = time.monotonic()
+            return True
+
+    def find_duplicates(self, redis_client, dedup_keys):
+        with self._lock:
+            self._redis_client = redis_client
+            return self._find_duplicates(redis_client, dedup_keys)
+
+    def _find_duplicates(self, redis_client, dedup_keys):
+        duplicates = [False] * len(dedup_keys)
+        warming_up = time.monotonic() < self._warm_after
+
+        first_positions = {}
+        for position, dedup_key in enumerate(dedup_keys):
+            if dedup_key in first_positions:
+                duplicates[position] = True
+            else:
+                first_positions[dedup_key] = position
+
+        to_confirm = []
+        for dedup_key in first_positions:
+            self.keys_checked += 1
+            possibly_seen = self.bloom.add(dedup_key)
+            if warming_up or possibly_seen:
+                to_confirm.append(dedup_key)
+            else:
+                self.answered_locally += 1
+                self._pending.append((dedup_key, time.monotonic()))
+
+        if to_confirm or self._should_flush():
+            results = self._round_trip(redis_client, to_confirm)
+            for dedup_key, result in zip(to_confirm, results):
+                duplicate = result is None
+                duplicates[first_positions[dedup_key]] = duplicate
+                self.redis_confirmations += 1
+                if duplicate:
+                    self.confirmed_duplicates += 1
+                elif not warming_up:
+                    self.false_positives += 1
+        return duplicates
+
+    def flush(self, redis_client):
+        with self._lock:
+            if self._pending:
+                self._round_trip(redis_client, [])
+
+    def close(self, redis_client):
+        self._stopped.set()
+        self._thread.join()
+        self.flush(redis_client)
+
+    def stats(self):
+        checked_by_filter = self.false_positives + self.answered_locally
+        return {
+            "memory_bytes": self.bloom.memory_bytes,
+            "capacity": self.bloom.capacity,
+            "num_hashes": self.bloom.num_hashes,
+            "configured_error_rate": self.bloom.error_rate,
+            "observed_error_rate": self.false_positives / checked_by_filter if checked_by_filter else 0.0,
+            "warming_up": time.monotonic() < self._warm_after,
+            "keys_checked": self.keys_checked,
+            "redis_confirmations": self.redis_confirmations,
+            "redis_confirmations_saved": self.answered_locally,
+            "confirmed_duplicates": self.confirmed_duplicates,
+            "false_positives": self.false_positives,
+            "redis_round_trips": self.redis_round_trips,
+            "pending_registrations": len(self._pending),
+            "keys_seeded": self.keys_seeded,
+        }
+
+    def _run(self):
+        while not self._stopped.wait(self.max_pending_seconds):
+            with self._lock:
+                if self._redis_client is not None and self._should_flush():
+                    self._round_trip(self._redis_client, [])
+
+    def _should_flush(self):
+        if not self._pending:
+            return False
+        return (
+            len(self._pending) >= self.max_pending
+            or time.monotonic() - self._pending[0][1] >= self.max_pending_seconds
+        )
+
+    def _round_trip(self, redis_client, to_confirm):
+        # Pending registrations go first, so a key answered locally earlier in
+        # this batch is already set when its confirmation runs
+        pending, self._pending = self._pending, []
+        now = time.monotonic()
+        try:
+            pipeline = redis_client.pipeline(transaction=False)
+            for dedup_key, first_seen in pending:
+                remaining = max(1, math.ceil(self.expiration_time - (now - first_seen)))
+                pipeline.set(dedup_key, "placeholder", ex=remaining, nx=True)
+            for dedup_key in to_confirm:
+                pipeline.set(dedup_key, "placeholder", ex=self.expiration_time, nx=True)
+            self.redis_round_trips += 1
+            results = pipeline.execute()
+        except redis.RedisError as e:
+            rate_limited_print("redis_error", lambda: f"Error interacting with Redis: {e}")
+            # Registered with the next round trip instead, unless they would have expired by then
+            self._pending = [(dedup_key, first_seen) for dedup_key, first_seen in pending if now - first_seen < self.expiration_time] + self._pending
+            # Fail open, a successful SET NX reply means the key is new
+            return [True] * len(to_confirm)
+        return results[len(pending):]
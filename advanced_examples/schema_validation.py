@@ -9,12 +9,17 @@ This module includes the following components:
 
 SalesRecordSchema: A Pydantic BaseModel class that defines the schema for the sales records, specifying the field names, types, and other constraints.
 validate_payload: A function that validates a given payload (dictionary) against the SalesRecordSchema. It returns True if the payload is valid, and False otherwise.
+validate_payloads: Validates a whole batch of payloads at once. It returns a valid/invalid mask and, for each invalid payload, the list of (field, error code) pairs, using Pydantic's error codes (for example value_error.missing or type_error.integer).
+
+Both functions first run precomputed field checks generated from SalesRecordSchema, which accept a payload whose fields all already have the exact type the schema declares without building a model instance. Any other payload is validated by Pydantic itself, so exactly the same payloads are accepted and rejected as with the model alone.
 
 The main purpose of this module is to ensure that only records with valid schema are processed by the Meroxa data streaming app, thus preventing potential issues caused by incorrect or missing data fields.
 """
 
 from pydantic import BaseModel, ValidationError
 
+from pipeline.structured_logging import rate_limited_print
+
 class SalesRecordSchema(BaseModel):
     customer_id: int
     customer_email: str
@@ -28,10 +33,65 @@ class SalesRecordSchema(BaseModel):
     extra_id: int
     order_id: int
 
+# Types whose values Pydantic accepts unchanged. Values of any other type may
+# still be coerced (e.g. "1" for an int field), so those go through the model.
+FAST_PATH_TYPES = {
+    int: (int,),
+    float: (float, int),
+    str: (str,),
+}
+
+def compile_field_checks(model):
+    checks = []
+    for name, field in model.__fields__.items():
+        accepted_types = FAST_PATH_TYPES.get(field.outer_type_)
+        if accepted_types is None:
+            return None
+        checks.append((name, accepted_types, field.required))
+    return checks
+
+SALES_RECORD_FIELD_CHECKS = compile_field_checks(SalesRecordSchema)
+
+def passes_field_checks(payload, checks=SALES_RECORD_FIELD_CHECKS) -> bool:
+    if checks is None or type(payload) is not dict:
+        return False
+    for name, accepted_types, required in checks:
+        if name in payload:
+            if type(payload[name]) not in accepted_types:
+                return False
+        elif required:
+            return False
+    return True
+
 def validate_payload(payload: dict) -> bool:
+    if passes_field_checks(payload):
+        return True
     try:
         SalesRecordSchema(**payload)
         return True
     except ValidationError as e:
-        print(f"Validation Error: {e}")
+        rate_limited_print("validation_error", lambda: f"Validation Error: {e}")
         return False
+
+def validate_payloads(payloads):
+    valid = []
+    errors = []
+    for payload in payloads:
+        if passes_field_checks(payload):
+            valid.append(True)
+            errors.append(None)
+            continue
+
+        try:
+            if not isinstance(payload, dict):
+                raise TypeError(f"payload must be a dict, not {type(payload).__name__}")
+            SalesRecordSchema(**payload)
+            valid.append(True)
+            errors.append(None)
+        except ValidationError as e:
+            valid.append(False)
+            errors.append([(".".join(str(loc) for loc in error["loc"]), error["type"]) for error in e.errors()])
+        except TypeError:
+            valid.append(False)
+            errors.append([("__root__", "type_error.dict")])
+    return valid, errors
@@ -9,19 +9,145 @@ Additionally, you might need to download the required NLTK corpora if it's not a
 
 python -m textblob.download_corpora
 
-This module includes the following function:
+This module includes the following components:
 
+score_review: Calculates the TextBlob polarity of a single review.
+SentimentEngine: Scores reviews with three optimizations. An LRU cache keyed by a hash of the review text means repeated or templated reviews are only scored once. Batches of uncached reviews are scored across a pool of worker processes, so scoring scales across cores. An optional length cap truncates very long reviews before scoring. Without a length cap, its scores are exactly the TextBlob polarity values.
 enrich_with_sentiment_score: Calculates the sentiment score for the customer_review field in the payload using TextBlob, and adds the calculated sentiment score to the payload.
+enrich_records_with_sentiment_score: The batch version of enrich_with_sentiment_score. It scores all the reviews of a list of payloads through the SentimentEngine and returns the scoring error for each payload (None if scoring succeeded).
+
+The engine can be configured with the following environment variables: SENTIMENT_CACHE_SIZE (number of cached scores), SENTIMENT_WORKERS (number of worker processes, 0 scores in-process) and SENTIMENT_MAX_REVIEW_CHARS (length cap, unset by default).
 
 The main purpose of this module is to add additional insights to the sales data by analyzing customer reviews, allowing the Meroxa data streaming app to generate more valuable information for further processing and analytics.
 """
 
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
 from textblob import TextBlob
 
+SENTIMENT_CACHE_SIZE = int(os.getenv("SENTIMENT_CACHE_SIZE", "10000"))
+SENTIMENT_WORKERS = int(os.getenv("SENTIMENT_WORKERS", "0"))
+SENTIMENT_MAX_REVIEW_CHARS = int(os.getenv("SENTIMENT_MAX_REVIEW_CHARS", "0")) or None
+
+def score_review(review):
+    return TextBlob(review).sentiment.polarity
+
+def _score_review_or_error(review):
+    # Lets one bad review fail on its own instead of failing the whole batch
+    try:
+        return score_review(review), None
+    except Exception as e:
+        return None, e
+
+class SentimentEngine:
+    def __init__(self, cache_size=10000, workers=0, max_review_chars=None, min_parallel_batch=64):
+        self.cache_size = cache_size
+        self.workers = workers
+        self.max_review_chars = max_review_chars
+        self.min_parallel_batch = min_parallel_batch
+        self.hits = 0
+        self.misses = 0
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def score(self, review):
+        score, error = self.score_many([review])[0]
+        if error is not None:
+            raise error
+        return score
+
+    def score_many(self, reviews):
+        if self.max_review_chars:
+            reviews = [review[:self.max_review_chars] for review in reviews]
+        keys = [hashlib.blake2b(review.encode("utf-8"), digest_size=16).digest() for review in reviews]
+
+        results = {}
+        to_score = {}
+        with self._lock:
+            for key, review in zip(keys, reviews):
+                if key in results or key in to_score:
+                    # Repeated within the batch, scored only once
+                    self.hits += 1
+                    continue
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    results[key] = (self._cache[key], None)
+                    self.hits += 1
+                else:
+                    to_score[key] = review
+                    self.misses += 1
+
+        if to_score:
+            scored = self._score_uncached(list(to_score.values()))
+            with self._lock:
+                for key, (score, error) in zip(to_score, scored):
+                    results[key] = (score, error)
+                    if error is None and self.cache_size:
+                        self._cache[key] = score
+                        self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return [results[key] for key in keys]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "cache_size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "workers": self.workers,
+        }
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _score_uncached(self, reviews):
+        if self.workers and len(reviews) >= self.min_parallel_batch:
+            if self._pool is None:
+                # Spawned workers don't inherit the locks held by this process's threads
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            chunksize = max(1, len(reviews) // (self.workers * 4))
+            return list(self._pool.map(_score_review_or_error, reviews, chunksize=chunksize))
+        return [_score_review_or_error(review) for review in reviews]
+
+sentiment_engine = SentimentEngine(
+    cache_size=SENTIMENT_CACHE_SIZE,
+    workers=SENTIMENT_WORKERS,
+    max_review_chars=SENTIMENT_MAX_REVIEW_CHARS,
+)
+
 def enrich_with_sentiment_score(payload):
     if "customer_review" in payload and payload["customer_review"] is not None:
         review = payload["customer_review"]
-        sentiment = TextBlob(review).sentiment.polarity
+        sentiment = sentiment_engine.score(review)
         payload["sentiment_score"] = sentiment
     else:
         payload["sentiment_score"] = None
+
+def enrich_records_with_sentiment_score(payloads):
+    errors = [None] * len(payloads)
+    reviewed = []
+    for position, payload in enumerate(payloads):
+        if "customer_review" in payload and payload["customer_review"] is not None:
+            reviewed.append(position)
+        else:
+            payload["sentiment_score"] = None
+
+    scores = sentiment_engine.score_many([payloads[position]["customer_review"] for position in reviewed])
+    for position, (score, error) in zip(reviewed, scores):
+        if error is not None:
+            errors[position] = error
+        else:
+            payloads[position]["sentiment_score"] = score
+    return errors
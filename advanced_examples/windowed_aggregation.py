@@ -0,0 +1,256 @@
+"""
+This module aggregates the sales records in the pipeline into tumbling time windows, so that InfluxDB receives a few compact points per window instead of one point per sale. The per-record points are tagged with the customer id and email, which gives InfluxDB a new series for almost every customer. The aggregate points are only tagged with the state and the product id, and carry the running sums, counts, quantiles and anomaly rate of the sales of the window.
+
+No additional setup is required for this file. Set INFLUXDB_WRITE_MODE to aggregates (or both) in main.py to write the aggregate points, see the README. Windows are aligned on multiples of AGGREGATION_WINDOW seconds of processing time, and a window is closed and written out as soon as a batch arrives after its end, or by a background thread at the latest about a second later if no batch does. Each order is counted once, as a sale, in the window in which it is created: only inserts and snapshot reads (CDC operations "c" and "r", or records without an operation) are aggregated, with the values they were created with. Updates and deletes are ignored, as the aggregates of the window the order was counted in may already be written out, and a quantile sketch can't take a value back. This way the aggregates don't depend on which updates the incremental mode of the pipeline skips. Every worker aggregates the records it processes, so the aggregate points are also tagged with AGGREGATION_WORKER (the hostname by default), and the partial aggregates of a window written by different workers are summed at query time instead of overwriting each other. Set it to a distinct value for every worker process when several run on the same host. Memory stays bounded whatever the number of states and products: a window keeps at most AGGREGATION_MAX_KEYS aggregates, the sales of any further key are added to a single overflow aggregate tagged "other", and each quantile sketch keeps at most AGGREGATION_MAX_BINS bins.
+
+This module includes the following components:
+
+QuantileSketch: A quantile sketch with relative error guarantees (in the manner of DDSketch). Values are counted in logarithmically sized bins, so every quantile is estimated within AGGREGATION_RELATIVE_ACCURACY of the true value. When it holds more than max_bins bins, the lowest bins are merged, which only affects the accuracy of the lowest quantiles.
+SalesAggregate: The running aggregate of the sales of one state and product in a window: the number of sales, the quantity sold, the revenue, the number of anomalous sales, and a quantile sketch of the transaction amounts.
+WindowedAggregator: Adds batches of payloads, with their CDC operations, to the aggregates of the current window and hands the fields of every aggregate to a sink when the window closes. It reports the records aggregated, the updates and deletes ignored, the windows closed, the points emitted and the records that went to the overflow aggregate.
+create_windowed_aggregator: Builds the aggregator from the environment, and closes it when the app shuts down so that the last window is written out.
+"""
+
+import atexit
+import math
+import os
+import socket
+import threading
+import time
+
+AGGREGATION_WINDOW = float(os.getenv("AGGREGATION_WINDOW", "60"))
+AGGREGATION_MAX_KEYS = int(os.getenv("AGGREGATION_MAX_KEYS", "10000"))
+AGGREGATION_RELATIVE_ACCURACY = float(os.getenv("AGGREGATION_RELATIVE_ACCURACY", "0.01"))
+AGGREGATION_MAX_BINS = int(os.getenv("AGGREGATION_MAX_BINS", "128"))
+AGGREGATION_WORKER = os.getenv("AGGREGATION_WORKER") or socket.gethostname()
+
+QUANTILES = (0.5, 0.9, 0.99)
+# The CDC operations that create an order, None for records that aren't CDC events
+AGGREGATED_OPERATIONS = ("c", "r", None)
+OVERFLOW_KEY = ("other", "other")
+
+class QuantileSketch:
+    __slots__ = ("log_gamma", "max_bins", "bins", "zero_count", "count", "min", "max")
+
+    def __init__(self, relative_accuracy=0.01, max_bins=128):
+        self.log_gamma = math.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        self.max_bins = max_bins
+        # bin index -> count, the bin i holds the values in (gamma^(i-1), gamma^i]
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if value <= 0:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.bins[index] = self.bins.get(index, 0) + 1
+        if len(self.bins) > self.max_bins:
+            # Fold the lowest bin into the next one
+            lowest = min(self.bins)
+            count = self.bins.pop(lowest)
+            following = min(self.bins)
+            self.bins[following] += count
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return max(self.min, 0.0)
+        cumulative = self.zero_count
+        for index in sorted(self.bins):
+            cumulative += self.bins[index]
+            if cumulative > rank:
+                # The middle of the bin, in relative terms
+                value = 2 * math.exp(index * self.log_gamma) / (1 + math.exp(self.log_gamma))
+                return min(max(value, self.min), self.max)
+        return self.max
+
+class SalesAggregate:
+    __slots__ = ("count", "quantity", "revenue", "anomalies", "amounts")
+
+    def __init__(self, relative_accuracy=0.01, max_bins=128):
+        self.count = 0
+        self.quantity = 0
+        self.revenue = 0.0
+        self.anomalies = 0
+        self.amounts = QuantileSketch(relative_accuracy, max_bins)
+
+    def add(self, quantity, amount, anomaly):
+        self.count += 1
+        self.quantity += quantity
+        self.revenue += amount
+        self.anomalies += anomaly
+        self.amounts.add(amount)
+
+    def fields(self):
+        fields = {
+            "count": self.count,
+            "quantity": self.quantity,
+            "revenue": float(self.revenue),
+            "anomalies": self.anomalies,
+            "anomaly_rate": self.anomalies / self.count,
+            "amount_min": float(self.amounts.min),
+            "amount_max": float(self.amounts.max),
+        }
+        for q in QUANTILES:
+            fields[f"amount_p{round(q * 100)}"] = float(self.amounts.quantile(q))
+        return fields
+
+class WindowedAggregator:
+    def __init__(
+        self,
+        sink,
+        window_seconds=60.0,
+        max_keys=10000,
+        relative_accuracy=0.01,
+        max_bins=128,
+        clock=time.time,
+        tick_interval=1.0,
+    ):
+        # sink is called with the start of a closed window and (state, product_id) -> fields
+        self.sink = sink
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.clock = clock
+
+        self.records = 0
+        self.changes_ignored = 0
+        self.overflow_records = 0
+        self.windows_closed = 0
+        self.points_emitted = 0
+        self.sink_errors = 0
+
+        self._window_start = None
+        self._aggregates = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        if tick_interval:
+            # Closes the current window when no batch arrives after its end
+            self._thread = threading.Thread(
+                target=self._run, args=(tick_interval,), name="windowed-aggregator", daemon=True
+            )
+            self._thread.start()
+
+    def add_many(self, payloads, operations=None):
+        # One result per payload, the error for a payload that couldn't be aggregated, so that the
+        # pipeline never retries the batch and counts the other payloads twice
+        if operations is None:
+            operations = [None] * len(payloads)
+        now = self.clock()
+        window_start = now - now % self.window_seconds
+        results = []
+        with self._lock:
+            closed = None
+            if self._window_start is not None and window_start > self._window_start:
+                closed = self._take()
+            self._window_start = window_start
+
+            for payload, operation in zip(payloads, operations):
+                if operation not in AGGREGATED_OPERATIONS:
+                    # An update or delete of an order already counted
+                    self.changes_ignored += 1
+                    results.append(None)
+                    continue
+                try:
+                    key = (str(payload["state"]), str(payload["product_id"]))
+                    quantity = payload["quantity"]
+                    amount = payload["price"] * quantity
+                    anomaly = payload.get("is_anomaly") == "true"
+                except Exception as e:
+                    results.append(e)
+                    continue
+
+                aggregate = self._aggregates.get(key)
+                if aggregate is None:
+                    if len(self._aggregates) >= self.max_keys:
+                        key = OVERFLOW_KEY
+                        self.overflow_records += 1
+                        aggregate = self._aggregates.get(key)
+                    if aggregate is None:
+                        aggregate = self._aggregates[key] = SalesAggregate(self.relative_accuracy, self.max_bins)
+                aggregate.add(quantity, amount, anomaly)
+                self.records += 1
+                results.append(None)
+
+        if closed is not None:
+            self._emit(*closed)
+        return results
+
+    def close_expired(self):
+        now = self.clock()
+        with self._lock:
+            if self._window_start is None or now < self._window_start + self.window_seconds:
+                return
+            closed = self._take()
+        self._emit(*closed)
+
+    def flush(self):
+        # Writes out the current window, even if it hasn't ended yet
+        with self._lock:
+            if self._window_start is None:
+                return
+            closed = self._take()
+        self._emit(*closed)
+
+    def close(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def stats(self):
+        return {
+            "records": self.records,
+            "changes_ignored": self.changes_ignored,
+            "overflow_records": self.overflow_records,
+            "open_keys": len(self._aggregates),
+            "windows_closed": self.windows_closed,
+            "points_emitted": self.points_emitted,
+            "sink_errors": self.sink_errors,
+        }
+
+    def _take(self):
+        closed = (self._window_start, self._aggregates)
+        self._window_start = None
+        self._aggregates = {}
+        return closed
+
+    def _emit(self, window_start, aggregates):
+        self.windows_closed += 1
+        if not aggregates:
+            return
+        try:
+            self.sink(window_start, {key: aggregate.fields() for key, aggregate in aggregates.items()})
+            self.points_emitted += len(aggregates)
+        except Exception as e:
+            self.sink_errors += 1
+            print(f"Error writing {len(aggregates)} aggregate(s) for the window starting at {window_start}: {e}")
+
+    def _run(self, tick_interval):
+        while not self._stopped.wait(min(tick_interval, self.window_seconds)):
+            self.close_expired()
+
+def create_windowed_aggregator(
+    sink,
+    window_seconds=AGGREGATION_WINDOW,
+    max_keys=AGGREGATION_MAX_KEYS,
+    relative_accuracy=AGGREGATION_RELATIVE_ACCURACY,
+    max_bins=AGGREGATION_MAX_BINS,
+):
+    aggregator = WindowedAggregator(
+        sink, window_seconds=window_seconds, max_keys=max_keys, relative_accuracy=relative_accuracy, max_bins=max_bins
+    )
+    # Write out the last window when the app shuts down
+    atexit.register(aggregator.close)
+    return aggregator
@@ -1,84 +1,354 @@
+import atexit
+import functools
 import logging
+import os
 import sys
-import sentry_sdk
 
 from turbine.runtime import RecordList
 from turbine.runtime import Runtime
 
-# Import enrichment and utility functions
-from simple_examples.geolocation_enrichment import enrich_with_geolocation
-from simple_examples.tax_enrichment import enrich_with_tax_rate
-from simple_examples.email_hashing import enrich_with_hashed_email
+from pipeline.components import ComponentRegistry, parse_warm_up
+from pipeline.dead_letter import create_dead_letter_listener
+from pipeline.engine import BATCH, CPU, IO, Pipeline, PipelineItem, PipelineListener, Stage
+from pipeline.incremental import DELETE, PIPELINE_INCREMENTAL, PIPELINE_INCREMENTAL_CACHE_SIZE, IncrementalProcessor
+from pipeline.instrumentation import create_metrics_listeners
+from pipeline.structured_logging import create_log_listener, rate_limited_print
+
+# Import enrichment and utility functions that only need the standard library
+from simple_examples.email_hashing import email_pseudonymizer, enrich_records_with_hashed_email
 from simple_examples.filtering import remove_unnecessary_fields
-from simple_examples.influxdb_analytics import write_data_to_influxdb
-from simple_examples.sentry_monitoring import init_sentry
 
-# Import advanced examples
-from advanced_examples.anomaly_detection import init_anomaly_detector, calculate_transaction_amount, generate_history_data
-from advanced_examples.sentiment_analysis import enrich_with_sentiment_score
-from advanced_examples.schema_validation import validate_payload
-from advanced_examples.redis_deduplication import create_redis_client, is_duplicate
+# The other enrichments, their clients and models are built on first use, or warmed up in the background
+components = ComponentRegistry()
+components.module("schema_validation", "advanced_examples.schema_validation")
+components.module("redis_deduplication", "advanced_examples.redis_deduplication")
+components.module("geolocation", "simple_examples.geolocation_enrichment")
+components.module("tax", "simple_examples.tax_enrichment")
+components.module("influxdb", "simple_examples.influxdb_analytics")
+components.module("sentiment", "advanced_examples.sentiment_analysis")
+components.module("anomaly_detection", "advanced_examples.anomaly_detection")
+components.module("columnar", "pipeline.columnar")
+components.module("windowed_aggregation", "advanced_examples.windowed_aggregation")
+
+# Sales are written to InfluxDB one point per record (records), as aggregates per state, product and time window
+# (aggregates), or both
+INFLUXDB_WRITE_MODE = os.getenv("INFLUXDB_WRITE_MODE", "records")
+if INFLUXDB_WRITE_MODE not in ("records", "aggregates", "both"):
+    raise ValueError(f"Unknown INFLUXDB_WRITE_MODE {INFLUXDB_WRITE_MODE!r}, expected records, aggregates or both")
+
+# Keep refitting the anomaly detector on live transaction amounts in the background
+ANOMALY_ONLINE_MODE = os.getenv("ANOMALY_ONLINE_MODE") == "true"
+
+def create_sentry():
+    import sentry_sdk
+    from simple_examples.sentry_monitoring import init_sentry
+
+    # Initialize Sentry for error monitoring
+    init_sentry()
+    return sentry_sdk
+
+def create_redis_client():
+    # Create a Redis client for deduplication
+    return components.get("redis_deduplication").create_redis_client()
+
+def create_dedup_prefilter():
+    # Answer keys that are definitely new locally and only ask Redis about possible duplicates
+    if os.getenv("REDIS_DEDUP_PREFILTER") != "true":
+        return None
+    redis_deduplication = components.get("redis_deduplication")
+    dedup_prefilter = redis_deduplication.DedupPreFilter(
+        capacity=redis_deduplication.REDIS_DEDUP_PREFILTER_CAPACITY,
+        error_rate=redis_deduplication.REDIS_DEDUP_PREFILTER_ERROR_RATE,
+    )
+    # Seed the filter with the keys already in Redis, instead of sending every key to Redis for the first hour
+    dedup_prefilter.seed(components.get("redis"))
+    # Register the keys still pending in Redis when the app shuts down
+    atexit.register(lambda: dedup_prefilter.close(components.get("redis")))
+    return dedup_prefilter
+
+def create_anomaly_detector():
+    anomaly_detection = components.get("anomaly_detection")
+    # Load the stored anomaly detector, training it on historical data only if no compatible model exists
+    anomaly_detector = anomaly_detection.load_or_train_anomaly_detector()
+    if ANOMALY_ONLINE_MODE:
+        anomaly_detector = anomaly_detection.OnlineAnomalyDetector(anomaly_detector)
+    return anomaly_detector
+
+def create_aggregator():
+    if INFLUXDB_WRITE_MODE == "records":
+        return None
+    # The InfluxDB writer is loaded first, so that it is still open when the last window is written out at exit
+    influxdb = components.get("influxdb")
+    windowed_aggregation = components.get("windowed_aggregation")
+    return windowed_aggregation.create_windowed_aggregator(
+        functools.partial(influxdb.write_aggregates_to_influxdb, worker=windowed_aggregation.AGGREGATION_WORKER)
+    )
+
+components.register("sentry", create_sentry)
+components.register("redis", create_redis_client)
+components.register("dedup_prefilter", create_dedup_prefilter)
+components.register("anomaly_detector", create_anomaly_detector)
+components.register("aggregator", create_aggregator)
 
-# Initialize Sentry for error monitoring
-init_sentry()
-# Create a Redis client for deduplication
-redis_client = create_redis_client()
+# Sentry is always initialized right away, on a background thread, along with the components named in PIPELINE_WARM_UP
+warm_up = parse_warm_up()
+components.warm_up(["sentry", *(components.components if warm_up is None else warm_up)])
 
-# Generate historical data for anomaly detection
-history_data = generate_history_data(1000)
-anomaly_detector = init_anomaly_detector(history_data)
+# Field of the CDC envelope of a replayed record, with the stages it still has to go through
+REPLAY_STAGES = "replay_stages"
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 
-def transform(records: RecordList) -> RecordList:
-    logging.info(f"processing {len(records)} record(s)")
+def handle_record_error(record, e):
+    rate_limited_print("parse_error", lambda: "Error occurred while parsing records: " + str(e))
+    logging.info("output: %s", record)
+    # Keep the record to be replayed later
+    if dead_letter_listener is not None:
+        dead_letter_listener.record_error(record, "parse", e)
+    # Capture the exception using Sentry
+    components.get("sentry").capture_exception(e)
 
-    for record in records:
-        logging.info(f"input: {record}")
-        try:
-            payload = record.value["payload"]["after"]
 
-            # Validate payload schema
-            if not validate_payload(payload):
-                print(f"Invalid schema for record: {record}")
-                continue
+def validate_schemas(payloads):
+    valid, _ = components.get("schema_validation").validate_payloads(payloads)
+    return valid
+
+
+def deduplicate(payloads):
+    dedup_keys = [f"{payload['customer_id']}_{payload['order_id']}" for payload in payloads]
+    redis_client = components.get("redis")
+    dedup_prefilter = components.get("dedup_prefilter")
+    if dedup_prefilter is not None:
+        duplicates = dedup_prefilter.find_duplicates(redis_client, dedup_keys)
+    else:
+        duplicates = components.get("redis_deduplication").find_duplicates(redis_client, dedup_keys)
+    return [not duplicate for duplicate in duplicates]
+
+
+def remove_extra_fields(payload):
+    remove_unnecessary_fields(payload, ["extra_id"])
 
-            # Data deduplication
-            dedup_key = f"{payload['customer_id']}_{payload['order_id']}"
-            if is_duplicate(redis_client, dedup_key):
-                print(f"Duplicate record found: {record.key}")
-                continue
 
-            # Enrich with geolocation
-            enrich_with_geolocation(payload)
+def detect_batch_anomalies(payloads):
+    components.get("anomaly_detection").detect_anomalies(components.get("anomaly_detector"), payloads)
 
-            # Enrich with tax rate
-            enrich_with_tax_rate(payload)
 
-            # Hash customer email
-            enrich_with_hashed_email(payload)
+def enrich_columns(payloads):
+    # Tax rates and amounts and anomaly labels computed on whole columns, written back to the payloads once
+    batch = components.get("columnar").ColumnarBatch(payloads)
+    batch["tax_rate"], batch["tax_amount"] = components.get("tax").compute_tax(
+        batch["state"], batch["order_date"], batch["price"], batch["quantity"]
+    )
+    batch["is_anomaly"], _ = components.get("anomaly_detection").label_anomalies(
+        components.get("anomaly_detector"), batch["price"] * batch["quantity"]
+    )
+    batch.write_back()
 
-            # Remove unnecessary fields
-            remove_unnecessary_fields(payload, ["extra_id"])
 
-            # Write data to InfluxDB for Analytics
-            write_data_to_influxdb(payload)
+def aggregate_sales(items):
+    # Called with the items, the aggregator only counts the records that create an order
+    return components.get("aggregator").add_many(
+        [item.payload for item in items], [item.record.value["payload"].get("op") for item in items]
+    )
 
-            # Detect anomalies
-            transaction_amount = calculate_transaction_amount(payload)
-            is_anomaly = anomaly_detector.predict(transaction_amount) == -1
-            payload["is_anomaly"] = "true" if is_anomaly else "false"
 
-            # Enrich with sentiment analysis
-            enrich_with_sentiment_score(payload)
+def cache_stats(component, cache):
+    # The stats of a cache, once the module that holds it is loaded
+    def stats():
+        module = components.peek(component)
+        return None if module is None else getattr(module, cache).stats()
+    return stats
 
-            logging.info(f"output: {record}")
+
+def anomaly_detector_metrics():
+    # Reservoir memory and refit latency, once the online anomaly detector is loaded
+    anomaly_detector = components.peek("anomaly_detector")
+    metrics = getattr(anomaly_detector, "metrics", None)
+    return None if metrics is None else metrics()
+
+
+class SalesPipelineListener(PipelineListener):
+    def record_dropped(self, item, stage):
+        if stage.drop_reason == "invalid_schema":
+            rate_limited_print("invalid_schema", lambda: f"Invalid schema for record: {item.record.key}")
+        elif stage.drop_reason == "duplicate":
+            rate_limited_print("duplicate", lambda: f"Duplicate record found: {item.record.key}")
+
+    def record_failed(self, item, stage, error):
+        rate_limited_print(
+            f"error:{stage.name}", lambda: f"Error occurred while parsing records in stage {stage.name}: " + str(error)
+        )
+        # Capture the exception using Sentry
+        components.get("sentry").capture_exception(error)
+
+
+# Input and output records, logged in full or sampled depending on PIPELINE_LOG_MODE
+log_listener = create_log_listener()
+
+# Failed, invalid and duplicate records, kept to be replayed by scripts/replay_dead_letters.py if DEAD_LETTER_PATH is set
+dead_letter_listener = create_dead_letter_listener()
+
+# Per-stage latency, throughput, drop reasons and cache hit rates
+pipeline_metrics, metrics_listeners = create_metrics_listeners()
+pipeline_metrics.register_cache("geocoding", cache_stats("geolocation", "geocoding_cache"))
+pipeline_metrics.register_cache("sentiment", cache_stats("sentiment", "sentiment_engine"))
+pipeline_metrics.register_cache("email", email_pseudonymizer.stats)
+pipeline_metrics.register_gauges("anomaly_detector", anomaly_detector_metrics)
+
+if os.getenv("PIPELINE_COLUMNAR") == "true":
+    anomaly_stage = "columnar"
+    # Enrich with tax rate and amount and detect anomalies on a columnar view of the batch
+    tax_and_anomaly_stages = [
+        Stage(
+            "columnar",
+            enrich_columns,
+            kind=BATCH,
+            depends_on=["deduplicate"],
+            inputs=["state", "order_date", "price", "quantity"],
+            outputs=["tax_rate", "tax_amount", "is_anomaly"],
+            # The online detector counts every transaction amount it labels
+            retry_per_record=not ANOMALY_ONLINE_MODE,
+        ),
+    ]
+else:
+    anomaly_stage = "anomaly_detection"
+    tax_and_anomaly_stages = [
+        # Enrich with the tax rate in effect on the order date and the tax amount
+        Stage(
+            "tax_rate",
+            components.function("tax", "enrich_records_with_tax"),
+            kind=BATCH,
+            depends_on=["deduplicate"],
+            inputs=["state", "order_date", "price", "quantity"],
+            outputs=["tax_rate", "tax_amount"],
+            retry_per_record=True,
+        ),
+        # Detect anomalies for the whole batch with one vectorized call
+        Stage(
+            "anomaly_detection",
+            detect_batch_anomalies,
+            kind=BATCH,
+            depends_on=["deduplicate"],
+            inputs=["price", "quantity"],
+            outputs=["is_anomaly"],
+            # The online detector counts every transaction amount it labels
+            retry_per_record=not ANOMALY_ONLINE_MODE,
+        ),
+    ]
+
+analytics_stages = []
+if INFLUXDB_WRITE_MODE in ("records", "both"):
+    # Write data to InfluxDB for Analytics, never before the email is hashed
+    analytics_stages.append(
+        Stage(
+            "influxdb",
+            components.function("influxdb", "write_data_to_influxdb"),
+            kind=IO,
+            depends_on=["hash_email"],
+            inputs=[
+                "customer_id", "customer_email", "product_id", "quantity", "price",
+                "order_date", "postal_code", "state", "customer_review",
+            ],
+        )
+    )
+if INFLUXDB_WRITE_MODE in ("aggregates", "both"):
+    # Aggregate the new orders per state and product in time windows, written to InfluxDB when each window closes
+    analytics_stages.append(
+        Stage(
+            "aggregate",
+            aggregate_sales,
+            kind=BATCH,
+            depends_on=[anomaly_stage],
+            inputs=["state", "product_id", "quantity", "price", "is_anomaly"],
+            pass_items=True,
+        )
+    )
+
+# Stages run across the whole batch, stages that don't depend on each other run concurrently.
+# The inputs and outputs of a stage are the payload fields it reads and writes, for the incremental mode.
+sales_pipeline = Pipeline(
+    [
+        # Validate payload schema, for every record
+        Stage("validate", validate_schemas, kind=BATCH, drop_reason="invalid_schema", retry_per_record=True),
+        # Data deduplication, with one pipelined Redis round trip for the whole batch. Never retried per record, as
+        # the keys of the batch may already be registered
+        Stage(
+            "deduplicate",
+            deduplicate,
+            kind=BATCH,
+            depends_on=["validate"],
+            drop_reason="duplicate",
+        ),
+        # Enrich with geolocation, resolving each distinct postal code once and concurrently
+        Stage(
+            "geolocation",
+            components.function("geolocation", "enrich_records_with_geolocation"),
+            kind=BATCH,
+            depends_on=["deduplicate"],
+            inputs=["postal_code"],
+            outputs=["latitude", "longitude"],
+            retry_per_record=True,
+        ),
+        *tax_and_anomaly_stages,
+        # Hash customer email, each distinct email once
+        Stage(
+            "hash_email",
+            enrich_records_with_hashed_email,
+            kind=BATCH,
+            depends_on=["deduplicate"],
+            inputs=["customer_email"],
+            outputs=["customer_email", "customer_email_key_id"],
+            retry_per_record=True,
+        ),
+        # Remove unnecessary fields, for every record
+        Stage("remove_fields", remove_extra_fields, kind=CPU, depends_on=["deduplicate"]),
+        *analytics_stages,
+        # Enrich with sentiment analysis, scoring each distinct review once
+        Stage(
+            "sentiment",
+            components.function("sentiment", "enrich_records_with_sentiment_score"),
+            kind=BATCH,
+            depends_on=["deduplicate"],
+            inputs=["customer_review"],
+            outputs=["sentiment_score"],
+            retry_per_record=True,
+        ),
+    ],
+    listeners=[SalesPipelineListener(), log_listener, *metrics_listeners, *filter(None, [dead_letter_listener])],
+)
+
+# Only re-run the stages whose inputs an update changed, if PIPELINE_INCREMENTAL is set
+incremental_processor = None
+if PIPELINE_INCREMENTAL:
+    incremental_processor = IncrementalProcessor(sales_pipeline, cache_size=PIPELINE_INCREMENTAL_CACHE_SIZE)
+    sales_pipeline.add_listener(incremental_processor)
+    pipeline_metrics.register_cache("incremental", incremental_processor.stats)
+
+def transform(records: RecordList) -> RecordList:
+    logging.info("processing %d record(s)", len(records))
+
+    # Records replayed from the dead-letter store only go through the stages they still need (see
+    # scripts/replay_dead_letters.py), the other records through every stage
+    groups = {None: []}
+    for record in records:
+        try:
+            if incremental_processor is not None and record.value["payload"].get("op") == DELETE:
+                # Deleted rows have nothing to enrich
+                incremental_processor.delete(record)
+                continue
+            item = PipelineItem(record, record.value["payload"]["after"])
+            # Removed, so that it isn't written to the destination
+            stages = record.value["payload"].pop(REPLAY_STAGES, None)
+            if stages is not None:
+                stages = frozenset(stages).intersection(sales_pipeline.stages)
+            groups.setdefault(stages, []).append(item)
         except Exception as e:
-            print("Error occurred while parsing records: " + str(e))
-            logging.info(f"output: {record}")
-            # Capture the exception using Sentry
-            sentry_sdk.capture_exception(e)
+            handle_record_error(record, e)
+
+    for stages, items in groups.items():
+        if items:
+            sales_pipeline.run(items, stages=stages)
     return records
 
 
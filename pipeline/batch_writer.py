@@ -0,0 +1,72 @@
+"""
+This module provides the background batch writer shared by the sinks that shouldn't make the pipeline wait for a write per record, such as the InfluxDB writer (simple_examples/influxdb_analytics.py) and the dead-letter store (pipeline/dead_letter.py).
+
+No additional setup is required for this file.
+
+This module includes the following components:
+
+BatchWriter: Queues items in a bounded queue and hands them to a write_batch function from a background thread, in batches of up to batch_size items or every flush_interval seconds, whichever comes first. Items can be added blocking while the queue is full (backpressure) or not (put raises queue.Full). flush waits until every queued item is written, and close writes what is still queued and stops the thread. write_batch is responsible for its own errors.
+"""
+
+import queue
+import threading
+import time
+
+class BatchWriter:
+    def __init__(self, write_batch, name, batch_size=500, flush_interval=1.0, max_queue_size=10000):
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self.closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def put(self, item, block=True, timeout=None):
+        self._queue.put(item, block=block, timeout=timeout)
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def flush(self):
+        self._queue.join()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            if item is None:
+                self._queue.task_done()
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Write what we have, then stop
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self.write_batch(batch)
+            for _ in batch:
+                self._queue.task_done()
@@ -0,0 +1,63 @@
+"""
+This module provides a columnar view of a batch of sales payloads. The pipeline stages normally read and write the payload dictionaries one key at a time, which allocates a lot and can't be vectorized. A ColumnarBatch instead extracts each field the stages need into one typed NumPy array for the whole batch, so that lookups and arithmetic (tax rates, transaction amounts, anomaly scores) run on whole columns. The columns the stages produce are written back to the payload dictionaries once, at the end.
+
+No additional setup is required for this file. The columns and their types come from the fields of SalesRecordSchema, so the view must only be built for payloads that passed schema validation. Set PIPELINE_COLUMNAR=true to run the tax rate and anomaly detection stages of main.transform on a columnar view of the batch. scripts/benchmark_columnar.py compares the time and peak memory of both paths.
+
+This module includes the following components:
+
+column_dtypes: Maps the fields of a Pydantic model to NumPy dtypes (int64, float64, or object for strings).
+ColumnarBatch: The columnar view of a list of payloads. Input columns are extracted lazily, the first time a stage reads them, and output columns are assigned like dictionary items and written back to the payloads by write_back.
+"""
+
+import numpy as np
+
+from advanced_examples.schema_validation import SalesRecordSchema
+
+FIELD_DTYPES = {
+    int: np.int64,
+    float: np.float64,
+    str: object,
+}
+
+def column_dtypes(model):
+    return {name: FIELD_DTYPES.get(field.outer_type_, object) for name, field in model.__fields__.items()}
+
+SALES_RECORD_DTYPES = column_dtypes(SalesRecordSchema)
+
+class ColumnarBatch:
+    def __init__(self, payloads, dtypes=SALES_RECORD_DTYPES):
+        self.payloads = payloads
+        self.dtypes = dtypes
+        self._columns = {}
+        self._outputs = {}
+
+    def __len__(self):
+        return len(self.payloads)
+
+    def __getitem__(self, name):
+        if name in self._outputs:
+            return self._outputs[name]
+        column = self._columns.get(name)
+        if column is None:
+            dtype = self.dtypes[name]
+            values = (payload[name] for payload in self.payloads)
+            if dtype is object:
+                column = np.array(list(values), dtype=object)
+            else:
+                column = np.fromiter(values, dtype=dtype, count=len(self.payloads))
+            self._columns[name] = column
+        return column
+
+    def __setitem__(self, name, values):
+        values = np.asarray(values)
+        if values.shape != (len(self.payloads),):
+            raise ValueError(f"Column {name!r} has shape {values.shape}, expected ({len(self.payloads)},)")
+        self._outputs[name] = values
+
+    def write_back(self):
+        payloads = self.payloads
+        for name, values in self._outputs.items():
+            # tolist converts to Python ints, floats and strings, which serialize like the rest of the payload
+            for payload, value in zip(payloads, values.tolist()):
+                payload[name] = value
+        self._outputs = {}
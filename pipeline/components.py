@@ -0,0 +1,115 @@
+"""
+This module provides a lazy component registry for the heavy parts of the app: the modules of the enrichments (and the libraries they import, such as scikit-learn, TextBlob, pydantic or influxdb_client), their clients (Redis, InfluxDB) and their models (the anomaly detector). Instead of building all of them when main is imported, each component is registered with a factory and built the first time a stage uses it, so the app starts quickly and the stages that never run never load their dependencies. Components can also be warmed up on a background thread, so that the first batch doesn't pay for them.
+
+No additional setup is required for this file. Set the PIPELINE_WARM_UP environment variable to a comma-separated list of component names (or all) to build them in the background when the app starts.
+
+This module includes the following components:
+
+Component: A named component with its factory. It is built once, on the first call to get, from whichever thread asks first; other threads asking at the same time wait for it. The time spent building it (importing its module, connecting its client, loading or training its model) is recorded and logged. Components are built one at a time.
+ComponentRegistry: Registers components by name, builds them on demand and warms them up. module registers a module imported on first use, function returns a stage function that loads its component on the first call, override replaces a component with an already built value (a fake client in a benchmark, for example) and report returns the build time of every component.
+parse_warm_up: Parses the list of components to warm up from PIPELINE_WARM_UP.
+"""
+
+import importlib
+import logging
+import os
+import threading
+import time
+
+PIPELINE_WARM_UP = os.getenv("PIPELINE_WARM_UP", "")
+
+class Component:
+    def __init__(self, name, factory, lock):
+        self.name = name
+        self.factory = factory
+        self.loaded = False
+        self.value = None
+        self.seconds = None
+        self.thread = None
+        self._lock = lock
+
+    def get(self):
+        if self.loaded:
+            return self.value
+        with self._lock:
+            if not self.loaded:
+                start = time.perf_counter()
+                self.value = self.factory()
+                # Includes the components the factory gets, if they weren't built yet
+                self.seconds = time.perf_counter() - start
+                self.thread = threading.current_thread().name
+                self.loaded = True
+                logging.info("component %s loaded in %.3fs on %s", self.name, self.seconds, self.thread)
+        return self.value
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+            self.seconds = 0.0
+            self.thread = threading.current_thread().name
+            self.loaded = True
+
+class ComponentRegistry:
+    def __init__(self):
+        self.components = {}
+        # Components are built one at a time: importing modules that import each other from several threads can deadlock
+        self._build_lock = threading.RLock()
+
+    def register(self, name, factory):
+        if name in self.components:
+            raise ValueError(f"Component {name!r} is already registered")
+        self.components[name] = Component(name, factory, self._build_lock)
+
+    def module(self, name, module_name):
+        self.register(name, lambda: importlib.import_module(module_name))
+
+    def get(self, name):
+        return self.components[name].get()
+
+    def peek(self, name):
+        # The component if it was already built, without building it
+        component = self.components[name]
+        return component.value if component.loaded else None
+
+    def override(self, name, value):
+        self.components[name].set(value)
+
+    def function(self, name, attribute):
+        component = self.components[name]
+
+        def call(*args, **kwargs):
+            return getattr(component.get(), attribute)(*args, **kwargs)
+        call.__name__ = attribute
+        return call
+
+    def warm_up(self, names=None, background=True):
+        names = list(self.components) if names is None else [name for name in names if name]
+        for name in names:
+            if name not in self.components:
+                raise ValueError(f"Unknown component {name!r}")
+
+        def build():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception as e:
+                    # Left unbuilt, the stage that needs it retries and reports the error
+                    logging.warning("Warming up component %s failed: %s", name, e)
+
+        if not background:
+            build()
+            return None
+        thread = threading.Thread(target=build, name="component-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def report(self):
+        return {
+            name: {"loaded": component.loaded, "seconds": component.seconds, "thread": component.thread}
+            for name, component in self.components.items()
+        }
+
+def parse_warm_up(value=PIPELINE_WARM_UP):
+    if value.strip() == "all":
+        return None
+    return [name.strip() for name in value.split(",") if name.strip()]
@@ -0,0 +1,236 @@
+"""
+This module provides a dead-letter store for the records the pipeline couldn't process. A record that fails in a stage passes through transform half-enriched, and invalid or duplicate records are skipped, so without it none of them could be re-driven later without rereading the whole source. The dead-letter store keeps each of these records in a local SQLite file, with the stages that failed or dropped it and the error, so that scripts/replay_dead_letters.py can reprocess them in bulk through only those stages (and the stages that depend on them).
+
+No additional setup is required for this file. Set the DEAD_LETTER_PATH environment variable to the path of the SQLite file to enable the store (it is disabled when unset). DEAD_LETTER_REASONS selects what is kept, as a comma-separated list of failed (records a stage raised for) and drop reasons (invalid_schema, duplicate); all of them by default. The store keeps at most DEAD_LETTER_MAX_ENTRIES records and evicts the oldest ones beyond that. Entries are written in batches of up to DEAD_LETTER_BATCH_SIZE records, or every DEAD_LETTER_FLUSH_INTERVAL seconds, from a background thread.
+
+This module includes the following components:
+
+DeadLetterEntry: One record of the store, with the record key and value (the CDC envelope, with the payload as it was when the batch finished), the stages that failed or dropped it, the reason, and the class and message of the errors.
+DeadLetterStore: The SQLite store. Records are added to a bounded queue without blocking and appended to the file by a writer thread (see pipeline/batch_writer.py), one transaction per batch, so an error storm doesn't slow the pipeline down with a disk write per record. When the queue is full, new entries are counted and discarded, unless the store is set to block, as it is while records are replayed. Entries can be read back in order, filtered by stage and reason, and deleted once replayed.
+DeadLetterListener: A pipeline listener that adds the failed and dropped records of every batch to the store. record_error adds a record that failed before entering the pipeline, and keeps tells whether a record that failed or was dropped is added.
+create_dead_letter_listener: Builds the store and its listener from the environment, or returns None if DEAD_LETTER_PATH isn't set.
+"""
+
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from pipeline.batch_writer import BatchWriter
+from pipeline.engine import PipelineListener
+
+DEAD_LETTER_PATH = os.getenv("DEAD_LETTER_PATH")
+DEAD_LETTER_REASONS = os.getenv("DEAD_LETTER_REASONS", "failed,invalid_schema,duplicate")
+DEAD_LETTER_MAX_ENTRIES = int(os.getenv("DEAD_LETTER_MAX_ENTRIES", "100000"))
+DEAD_LETTER_BATCH_SIZE = int(os.getenv("DEAD_LETTER_BATCH_SIZE", "500"))
+DEAD_LETTER_FLUSH_INTERVAL = float(os.getenv("DEAD_LETTER_FLUSH_INTERVAL", "1.0"))
+DEAD_LETTER_MAX_QUEUE_SIZE = int(os.getenv("DEAD_LETTER_MAX_QUEUE_SIZE", "10000"))
+
+FAILED = "failed"
+
+class DeadLetterEntry:
+    __slots__ = ("id", "created_at", "record_key", "value", "stages", "reason", "error_class", "error")
+
+    def __init__(self, id, created_at, record_key, value, stages, reason, error_class, error):
+        self.id = id
+        self.created_at = created_at
+        self.record_key = record_key
+        self.value = value
+        self.stages = stages
+        self.reason = reason
+        self.error_class = error_class
+        self.error = error
+
+class DeadLetterStore:
+    def __init__(self, path, max_entries=100000, batch_size=500, flush_interval=1.0, max_queue_size=10000, block=False):
+        self.path = path
+        # Whether add waits for room in the queue rather than discarding the entry
+        self.block = block
+        self.max_entries = max_entries
+
+        self.entries_written = 0
+        self.entries_discarded = 0
+        self.entries_evicted = 0
+        self.batches_written = 0
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS dead_letters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at REAL NOT NULL,
+                record_key TEXT,
+                stages TEXT NOT NULL,
+                reason TEXT NOT NULL,
+                error_class TEXT,
+                error TEXT,
+                value TEXT NOT NULL
+            )"""
+        )
+        self._db.commit()
+        self._db_lock = threading.Lock()
+
+        self._writer = BatchWriter(
+            self._write_batch, "dead-letter-writer", batch_size=batch_size, flush_interval=flush_interval, max_queue_size=max_queue_size
+        )
+
+    def add(self, record_key, value, stages, reason, errors=None):
+        # errors: stage name -> exception, for failed records
+        errors = errors or {}
+        error_class = ",".join(sorted({type(error).__name__ for error in errors.values()})) or None
+        error = "\n".join(f"{stage}: {type(e).__name__}: {e}" for stage, e in errors.items()) or None
+        row = (
+            time.time(),
+            json.dumps(record_key, default=str),
+            ",".join(stages),
+            reason,
+            error_class,
+            error,
+            # Serialized now, the payload may still change once transform returns
+            json.dumps(value, default=str),
+        )
+        try:
+            self._writer.put(row, block=self.block)
+        except queue.Full:
+            # Never block the pipeline, even in an error storm
+            self.entries_discarded += 1
+
+    def flush(self):
+        self._writer.flush()
+
+    def close(self):
+        if self._writer.closed:
+            return
+        self._writer.close()
+        with self._db_lock:
+            self._db.close()
+
+    def count(self):
+        with self._db_lock:
+            return self._db.execute("SELECT count(*) FROM dead_letters").fetchone()[0]
+
+    def summary(self):
+        # (stages, reason, error class) -> number of entries
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT stages, reason, error_class, count(*) FROM dead_letters GROUP BY stages, reason, error_class ORDER BY count(*) DESC"
+            ).fetchall()
+        return {(stages, reason, error_class): count for stages, reason, error_class, count in rows}
+
+    def entries(self, stage=None, reason=None, limit=None, batch_size=1000):
+        # Yields the entries in the order they were added, reading batch_size rows at a time. Entries added in the
+        # meantime are left out, so that records failing again while they are replayed aren't replayed twice.
+        conditions = ["id > ?", "id <= ?"]
+        parameters = []
+        if stage is not None:
+            conditions.append("(',' || stages || ',') LIKE ?")
+            parameters.append(f"%,{stage},%")
+        if reason is not None:
+            conditions.append("reason = ?")
+            parameters.append(reason)
+        query = (
+            "SELECT id, created_at, record_key, value, stages, reason, error_class, error FROM dead_letters "
+            f"WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?"
+        )
+
+        with self._db_lock:
+            max_id = self._db.execute("SELECT coalesce(max(id), 0) FROM dead_letters").fetchone()[0]
+        last_id = 0
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            with self._db_lock:
+                rows = self._db.execute(query, (last_id, max_id, *parameters, size)).fetchall()
+            if not rows:
+                return
+            for id, created_at, record_key, value, stages, reason, error_class, error in rows:
+                yield DeadLetterEntry(
+                    id, created_at, json.loads(record_key), json.loads(value), stages.split(","), reason, error_class, error
+                )
+            last_id = rows[-1][0]
+            if remaining is not None:
+                remaining -= len(rows)
+
+    def delete(self, ids):
+        with self._db_lock:
+            self._db.executemany("DELETE FROM dead_letters WHERE id = ?", ((id,) for id in ids))
+            self._db.commit()
+
+    def stats(self):
+        return {
+            "queued": self._writer.qsize(),
+            "entries_written": self.entries_written,
+            "entries_discarded": self.entries_discarded,
+            "entries_evicted": self.entries_evicted,
+            "batches_written": self.batches_written,
+        }
+
+    def _write_batch(self, batch):
+        try:
+            with self._db_lock:
+                self._db.executemany(
+                    "INSERT INTO dead_letters (created_at, record_key, stages, reason, error_class, error, value) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    batch,
+                )
+                # Append-only, bounded by evicting the oldest entries
+                cursor = self._db.execute(
+                    "DELETE FROM dead_letters WHERE id <= (SELECT max(id) FROM dead_letters) - ?", (self.max_entries,)
+                )
+                self._db.commit()
+            self.entries_written += len(batch)
+            self.entries_evicted += cursor.rowcount
+            self.batches_written += 1
+        except sqlite3.Error as e:
+            self.entries_discarded += len(batch)
+            print(f"Error writing {len(batch)} dead letter(s): {e}")
+
+class DeadLetterListener(PipelineListener):
+    def __init__(self, store, reasons=(FAILED, "invalid_schema", "duplicate")):
+        self.store = store
+        self.reasons = set(reasons)
+        # stage name -> drop reason, for the filter stages
+        self._drop_reasons = {}
+
+    def keeps(self, item):
+        if item.errors:
+            return FAILED in self.reasons
+        return item.dropped_by is not None and self._drop_reasons.get(item.dropped_by) in self.reasons
+
+    def record_error(self, record, stage, error):
+        # For records that failed before entering the pipeline, when their CDC event couldn't be parsed for example
+        if FAILED in self.reasons:
+            self.store.add(record.key, record.value, [stage], FAILED, {stage: error})
+
+    def record_dropped(self, item, stage):
+        self._drop_reasons[stage.name] = stage.drop_reason
+
+    def batch_finished(self, items, seconds):
+        # Added once the batch is finished, with the payload enriched by every stage that succeeded
+        for item in items:
+            if not self.keeps(item):
+                continue
+            if item.errors:
+                self.store.add(item.record.key, item.record.value, list(item.errors), FAILED, item.errors)
+            else:
+                self.store.add(item.record.key, item.record.value, [item.dropped_by], self._drop_reasons[item.dropped_by])
+
+def create_dead_letter_listener(
+    path=DEAD_LETTER_PATH,
+    reasons=DEAD_LETTER_REASONS,
+    max_entries=DEAD_LETTER_MAX_ENTRIES,
+    batch_size=DEAD_LETTER_BATCH_SIZE,
+    flush_interval=DEAD_LETTER_FLUSH_INTERVAL,
+    max_queue_size=DEAD_LETTER_MAX_QUEUE_SIZE,
+):
+    if not path:
+        return None
+    store = DeadLetterStore(
+        path, max_entries=max_entries, batch_size=batch_size, flush_interval=flush_interval, max_queue_size=max_queue_size
+    )
+    # Write out whatever is still queued when the app shuts down
+    atexit.register(store.close)
+    return DeadLetterListener(store, reasons=[reason.strip() for reason in reasons.split(",") if reason.strip()])
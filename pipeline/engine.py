@@ -0,0 +1,250 @@
+"""
+This module provides a small, staged execution engine for the transformation pipeline. Instead of running every enrichment one record at a time in a fixed order, the pipeline is declared as a list of stages, each with its kind and the stages it depends on. The engine runs every stage across the whole batch of records, and runs independent stages concurrently, so that for example geocoding (blocking I/O) overlaps with sentiment scoring (CPU).
+
+No additional setup is required for this file.
+
+This module includes the following components:
+
+PipelineItem: One record flowing through the pipeline, with its payload, the stage that dropped it (if any), the errors raised for it by each stage and the stages it skips.
+
+Stage: A named step of the pipeline. The kind of a stage tells the engine how to run it:
+- CPU: a pure CPU function called with one payload at a time on the calling thread.
+- IO: a blocking I/O function called with one payload at a time on a thread pool, so the calls overlap.
+- BATCH: a function called once with the payloads of the whole batch. It may return a list with one result per payload (an exception for a payload that failed), or None if every payload succeeded. If it raises, every record of the batch fails, unless the stage is safe to call again for the same records (retry_per_record): it is then retried one record at a time to find the records that fail. Stages with side effects, such as registering keys in Redis or feeding a model, must not be retried this way, as the records that went through would be counted twice.
+A stage with a drop_reason is a filter: its function returns whether to keep each record, and records it doesn't keep skip all later stages. A stage can also declare the payload fields it reads (inputs) and writes (outputs), which lets the incremental mode skip it for records whose inputs didn't change (see pipeline/incremental.py). A stage that needs more than the payload, such as the CDC operation of the record, can ask to be called with the PipelineItems instead (pass_items).
+
+PipelineListener: Receives notifications about started and finished batches, finished stages, and dropped and failed records. Logging, error reporting and metrics are plugged in as listeners.
+
+Pipeline: Orders the stages by their dependencies and runs a batch of items through them. Records keep their order and errors stay isolated per record: a record that fails in one stage skips only the stages that depend on it, and a batch stage that raises fails its whole batch, or is retried one record at a time if it allows it. A batch can also be run through a subset of the stages only, for example the stages that failed for its records and the stages that depend on them (see dependents), when records are replayed from the dead-letter store.
+
+The main purpose of this module is to let the I/O-bound stages of the pipeline run concurrently and every stage run in batches, without losing per-record error handling.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+CPU = "cpu"
+IO = "io"
+BATCH = "batch"
+
+NO_STAGES = frozenset()
+
+class PipelineItem:
+    __slots__ = ("record", "payload", "dropped_by", "errors", "skipped")
+
+    def __init__(self, record, payload):
+        self.record = record
+        self.payload = payload
+        self.dropped_by = None
+        # stage name -> exception raised by that stage for this record
+        self.errors = {}
+        # Names of the stages that don't need to run for this record
+        self.skipped = NO_STAGES
+
+    @property
+    def succeeded(self):
+        return self.dropped_by is None and not self.errors
+
+class Stage:
+    def __init__(
+        self,
+        name,
+        func,
+        kind=CPU,
+        depends_on=(),
+        drop_reason=None,
+        inputs=None,
+        outputs=(),
+        pass_items=False,
+        retry_per_record=False,
+    ):
+        if kind not in (CPU, IO, BATCH):
+            raise ValueError(f"Unknown stage kind {kind!r} for stage {name!r}")
+        self.name = name
+        self.func = func
+        self.kind = kind
+        self.depends_on = tuple(depends_on)
+        self.drop_reason = drop_reason
+        # The payload fields the stage reads (None if unknown) and writes
+        self.inputs = None if inputs is None else frozenset(inputs)
+        self.outputs = tuple(outputs)
+        # Whether func is called with the items rather than their payloads
+        self.pass_items = pass_items
+        # Whether a batch that raises is run again one record at a time
+        self.retry_per_record = retry_per_record
+
+    @property
+    def is_filter(self):
+        return self.drop_reason is not None
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, kind={self.kind!r}, depends_on={self.depends_on!r})"
+
+class PipelineListener:
+    def batch_started(self, items):
+        pass
+
+    def stage_finished(self, stage, items_in, items_out, seconds):
+        pass
+
+    def record_dropped(self, item, stage):
+        pass
+
+    def record_failed(self, item, stage, error):
+        pass
+
+    def batch_finished(self, items, seconds):
+        pass
+
+class Pipeline:
+    def __init__(self, stages, listeners=(), io_workers=16):
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicate stage {stage.name!r}")
+            self.stages[stage.name] = stage
+        for stage in stages:
+            for dependency in stage.depends_on:
+                if dependency not in self.stages:
+                    raise ValueError(f"Stage {stage.name!r} depends on unknown stage {dependency!r}")
+
+        self.levels = self._order_stages()
+        self.ancestors = {name: self._ancestors(name) for name in self.stages}
+        self.listeners = list(listeners)
+
+        self._io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="pipeline-io")
+        max_concurrent_stages = max(len(level) for level in self.levels) if self.levels else 1
+        self._stage_executor = ThreadPoolExecutor(max_workers=max_concurrent_stages, thread_name_prefix="pipeline-stage")
+        self._listener_lock = threading.Lock()
+
+    def run(self, items, stages=None):
+        # stages: the names of the stages to run, all of them by default
+        if stages is not None:
+            unknown = set(stages) - set(self.stages)
+            if unknown:
+                raise ValueError(f"Unknown stages {sorted(unknown)}")
+        self._notify("batch_started", items)
+        start = time.perf_counter()
+        for level in self.levels:
+            if stages is not None:
+                level = [stage for stage in level if stage.name in stages]
+            if not level:
+                continue
+            if len(level) == 1:
+                self._run_stage(level[0], items)
+            else:
+                # Stages of the same level don't depend on each other
+                futures = [self._stage_executor.submit(self._run_stage, stage, items) for stage in level]
+                for future in futures:
+                    future.result()
+        self._notify("batch_finished", items, time.perf_counter() - start)
+        return items
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def dependents(self, names):
+        # The given stages and every stage that depends on them, directly or not
+        names = set(names)
+        return names | {name for name, ancestors in self.ancestors.items() if not ancestors.isdisjoint(names)}
+
+    def close(self):
+        self._io_executor.shutdown()
+        self._stage_executor.shutdown()
+
+    def _order_stages(self):
+        # Group the stages in levels, each level only depends on the previous ones
+        remaining = dict(self.stages)
+        done = set()
+        levels = []
+        while remaining:
+            level = [stage for stage in remaining.values() if set(stage.depends_on) <= done]
+            if not level:
+                raise ValueError(f"Stages {sorted(remaining)} have circular dependencies")
+            for stage in level:
+                del remaining[stage.name]
+            done.update(stage.name for stage in level)
+            levels.append(level)
+        return levels
+
+    def _ancestors(self, name):
+        ancestors = set()
+        pending = list(self.stages[name].depends_on)
+        while pending:
+            dependency = pending.pop()
+            if dependency not in ancestors:
+                ancestors.add(dependency)
+                pending.extend(self.stages[dependency].depends_on)
+        return ancestors
+
+    def _run_stage(self, stage, items):
+        ancestors = self.ancestors[stage.name]
+        eligible = [
+            item
+            for item in items
+            if item.dropped_by is None and ancestors.isdisjoint(item.errors) and stage.name not in item.skipped
+        ]
+
+        start = time.perf_counter()
+        if not eligible:
+            results = []
+        elif stage.kind == BATCH:
+            results = self._run_batch(stage, eligible)
+        elif stage.kind == IO:
+            results = list(self._io_executor.map(lambda item: _call(stage.func, _argument(stage, item)), eligible))
+        else:
+            results = [_call(stage.func, _argument(stage, item)) for item in eligible]
+        seconds = time.perf_counter() - start
+
+        items_out = 0
+        for item, result in zip(eligible, results):
+            if isinstance(result, Exception):
+                item.errors[stage.name] = result
+                self._notify("record_failed", item, stage, result)
+            elif stage.is_filter and not result:
+                item.dropped_by = stage.name
+                self._notify("record_dropped", item, stage)
+            else:
+                items_out += 1
+        self._notify("stage_finished", stage, len(eligible), items_out, seconds)
+
+    def _run_batch(self, stage, items):
+        try:
+            results = stage.func([_argument(stage, item) for item in items])
+        except Exception as e:
+            if not stage.retry_per_record:
+                return [e] * len(items)
+            # Run the records one at a time to find the ones that fail
+            results = []
+            for item in items:
+                try:
+                    result = stage.func([_argument(stage, item)])
+                    results.append(None if result is None else _single(stage, result))
+                except Exception as e:
+                    results.append(e)
+        if results is None:
+            results = [None] * len(items)
+        elif len(results) != len(items):
+            # Results can't be matched with the records, none of them is trusted
+            return [ValueError(f"Stage {stage.name!r} returned {len(results)} result(s) for {len(items)} record(s)")] * len(items)
+        return results
+
+    def _notify(self, event, *args):
+        with self._listener_lock:
+            for listener in self.listeners:
+                getattr(listener, event)(*args)
+
+def _argument(stage, item):
+    return item if stage.pass_items else item.payload
+
+def _single(stage, results):
+    if len(results) != 1:
+        raise ValueError(f"Stage {stage.name!r} returned {len(results)} result(s) for 1 record")
+    return results[0]
+
+def _call(func, payload):
+    try:
+        return func(payload)
+    except Exception as e:
+        return e
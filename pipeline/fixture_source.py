@@ -0,0 +1,154 @@
+"""
+This module provides a streaming source of fixture records for local runs and load tests. The Turbine local runtime loads the whole fixture file named in app.json as one JSON document, which doesn't scale to realistic volumes. FixtureSource instead reads the records one at a time and yields them in batches, ready to be passed to transform, so memory use stays flat however large the file is.
+
+No additional setup is required for this file. Two fixture formats are supported:
+- JSON Lines (files ending in .jsonl): one record per line, as written by scripts/generate_fixtures.py --format jsonl. The file is memory-mapped by default, so lines are parsed straight from the page cache, and the pages already read are released as the file is consumed.
+- JSON (any other file): the format of fixtures/demo-cdc.json, with the records in a list under the table name. The list is decoded incrementally, one record at a time, from fixed-size chunks of the file.
+
+Batches can be replayed at a target rate (in records per second), either evenly spaced or with Poisson arrivals, to simulate production arrival patterns.
+
+This module includes the following components:
+
+read_fixture_records: Yields the fixture records (dictionaries with a key and a value) of a JSON or JSON Lines file, one at a time.
+FixtureSource: Yields the records of a fixture file as Turbine RecordLists of a given batch size, optionally paced at a target rate.
+"""
+
+import json
+import mmap
+import random
+import time
+
+from turbine.runtime import Record, RecordList
+
+CHUNK_SIZE = 1 << 16
+RELEASE_SIZE = 1 << 24
+
+def read_fixture_records(path, table="sales", use_mmap=True):
+    if path.endswith(".jsonl"):
+        yield from _read_json_lines(path, use_mmap)
+    else:
+        yield from _read_json_table(path, table)
+
+def _read_json_lines(path, use_mmap):
+    with open(path, "rb") as f:
+        if not use_mmap:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be memory-mapped
+            return
+        try:
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            released = 0
+            for line in iter(mapped.readline, b""):
+                if line.strip():
+                    yield json.loads(line)
+                # Drop the pages already read from the process, so that its memory use doesn't grow with the file
+                position = mapped.tell() // mmap.PAGESIZE * mmap.PAGESIZE
+                if position - released >= RELEASE_SIZE and hasattr(mapped, "madvise"):
+                    mapped.madvise(mmap.MADV_DONTNEED, released, position - released)
+                    released = position
+        finally:
+            mapped.close()
+
+def _read_json_table(path, table):
+    decoder = json.JSONDecoder()
+    with open(path, "r") as f:
+        buffer = ""
+        eof = False
+
+        def read_more():
+            nonlocal buffer, eof
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                eof = True
+            buffer += chunk
+
+        # Find the start of the list of records of the table
+        table_key = json.dumps(table)
+        while True:
+            start = buffer.find(table_key)
+            if start >= 0:
+                bracket = buffer.find("[", start + len(table_key))
+                if bracket >= 0:
+                    break
+            if eof:
+                return
+            read_more()
+        position = bracket + 1
+
+        while True:
+            # Skip whitespace and the comma between records
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position == len(buffer):
+                if eof:
+                    raise ValueError(f"{path}: unexpected end of file in the {table} list")
+                buffer = ""
+                position = 0
+                read_more()
+                continue
+            if buffer[position] == "]":
+                return
+
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # The record is cut at the end of the buffer, read the rest of it
+                buffer = buffer[position:]
+                position = 0
+                read_more()
+                continue
+            yield record
+            position = end
+
+class FixtureSource:
+    def __init__(self, path, table="sales", batch_size=1000, rate=None, arrival="uniform", limit=None, use_mmap=True):
+        if arrival not in ("uniform", "poisson"):
+            raise ValueError(f"Unknown arrival pattern {arrival!r}")
+        self.path = path
+        self.table = table
+        self.batch_size = batch_size
+        self.rate = rate
+        self.arrival = arrival
+        self.limit = limit
+        self.use_mmap = use_mmap
+        self.records_read = 0
+
+    def __iter__(self):
+        batch = RecordList()
+        next_batch_at = time.monotonic()
+        for fixture in read_fixture_records(self.path, self.table, self.use_mmap):
+            if self.limit is not None and self.records_read >= self.limit:
+                break
+            batch.append(Record(key=fixture["key"], value=fixture["value"], timestamp=time.time()))
+            self.records_read += 1
+            if len(batch) == self.batch_size:
+                next_batch_at = self._wait(next_batch_at, len(batch))
+                yield batch
+                batch = RecordList()
+        if batch:
+            self._wait(next_batch_at, len(batch))
+            yield batch
+
+    def _wait(self, next_batch_at, records):
+        # Hold the batch back until its records would have arrived at the target rate
+        if not self.rate:
+            return next_batch_at
+        if self.arrival == "poisson":
+            # The sum of the exponential gaps between the records of the batch
+            next_batch_at += random.gammavariate(records, 1 / self.rate)
+        else:
+            next_batch_at += records / self.rate
+        delay = next_batch_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return next_batch_at
@@ -0,0 +1,143 @@
+"""
+This module provides the incremental mode of the pipeline for CDC events. By default every event goes through every enrichment, even an update that only changed a column no stage reads. In incremental mode, the values of the fields each stage read are cached with the fields it wrote, per record key, and a stage isn't run again for an update whose inputs are still the values its cached outputs were computed from: the cached fields are copied into the payload instead. For example, geocoding is skipped when the postal code is the one the cached coordinates were resolved for, and sentiment analysis when the review is the one that was scored.
+
+No additional setup is required for this file. Set PIPELINE_INCREMENTAL=true to enable the incremental mode in main.transform. The inputs and outputs of each stage are kept for the PIPELINE_INCREMENTAL_CACHE_SIZE most recently seen record keys. Only updates (op "u") can skip stages, and only stages that declare their inputs and whose outputs are cached for the record key, so inserts, snapshot reads and keys evicted from the cache go through every stage. When a stage runs again, the stages reading the fields it writes run again too. An update whose key already appeared earlier in the same batch goes through every stage, since the earlier event's outputs aren't cached yet. Stages that don't declare their inputs, such as schema validation, always run, and so do filter stages, such as deduplication: whether a record is dropped never depends on what this worker happens to have cached. Delete events (op "d") have no after image to enrich: they don't go through the pipeline at all, and their key is evicted from the cache.
+
+This module includes the following components:
+
+StageOutputCache: A bounded LRU cache of, per record key and stage, the values of the inputs the stage read and the fields it wrote.
+IncrementalProcessor: A pipeline listener that, when a batch starts, marks the stages each update can skip and copies their cached outputs into its payload, and when the batch finishes, caches the inputs and outputs of the stages that succeeded. It counts the stage runs skipped per stage.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from pipeline.engine import PipelineListener
+
+PIPELINE_INCREMENTAL = os.getenv("PIPELINE_INCREMENTAL") == "true"
+PIPELINE_INCREMENTAL_CACHE_SIZE = int(os.getenv("PIPELINE_INCREMENTAL_CACHE_SIZE", "100000"))
+
+UPDATE = "u"
+DELETE = "d"
+
+class StageOutputCache:
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # record key -> stage name -> (values of the stage inputs, field -> value of the stage outputs)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def update(self, key, stages):
+        # Merged with what is cached for the key, the stages that failed keep their previous outputs
+        with self._lock:
+            entry = self._entries.get(key)
+            self._entries[key] = {**entry, **stages} if entry is not None else stages
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+class IncrementalProcessor(PipelineListener):
+    def __init__(self, pipeline, cache_size=100000):
+        self.pipeline = pipeline
+        self.cache = StageOutputCache(cache_size)
+        # The stages that can be skipped, in the order they run. Filters always run, so that the records they drop don't
+        # depend on the cache
+        self.stages = [
+            stage for level in pipeline.levels for stage in level if stage.inputs is not None and not stage.is_filter
+        ]
+        self.updates = 0
+        self.deletes = 0
+        self.skipped = {stage.name: 0 for stage in self.stages}
+        self._stages_run = set()
+        self._inputs = {}
+
+    def delete(self, record):
+        # Nothing to enrich, forget what was cached for the key
+        self.deletes += 1
+        self.cache.delete(record.key)
+
+    def batch_started(self, items):
+        self._stages_run = set()
+        # id(item) -> stage name -> values of the stage inputs, before any stage changes the payload
+        self._inputs = {}
+        keys = set()
+        for item in items:
+            if item.payload is None:
+                continue
+            inputs = {stage.name: tuple(item.payload.get(field) for field in stage.inputs) for stage in self.stages}
+            self._inputs[id(item)] = inputs
+            repeated = item.record.key in keys
+            keys.add(item.record.key)
+            if item.record.value["payload"].get("op") != UPDATE or repeated:
+                continue
+            self.updates += 1
+            cached = self.cache.get(item.record.key)
+            if cached is None:
+                continue
+
+            # The outputs of the stages that run again
+            changed = set()
+            skipped = set()
+            for stage in self.stages:
+                entry = cached.get(stage.name)
+                if entry is not None and entry[0] == inputs[stage.name] and changed.isdisjoint(stage.inputs):
+                    skipped.add(stage.name)
+                    item.payload.update(entry[1])
+                else:
+                    # The stage runs again, so the stages reading what it writes have to as well
+                    changed.update(stage.outputs)
+            if skipped:
+                item.skipped = frozenset(skipped)
+                for name in skipped:
+                    self.skipped[name] += 1
+
+    def stage_finished(self, stage, items_in, items_out, seconds):
+        self._stages_run.add(stage.name)
+
+    def batch_finished(self, items, seconds):
+        # In order, so that the last event for a key is the one cached
+        for item in items:
+            inputs = self._inputs.get(id(item))
+            if inputs is None or item.dropped_by is not None:
+                continue
+            succeeded = {}
+            for stage in self.stages:
+                ran = stage.name in self._stages_run or stage.name in item.skipped
+                if ran and self.pipeline.ancestors[stage.name].isdisjoint(item.errors) and stage.name not in item.errors:
+                    outputs = {field: item.payload[field] for field in stage.outputs if field in item.payload}
+                    succeeded[stage.name] = (inputs[stage.name], outputs)
+            if succeeded:
+                self.cache.update(item.record.key, succeeded)
+        self._inputs = {}
+
+    def stats(self):
+        return {**self.cache.stats(), "updates": self.updates, "deletes": self.deletes, "skipped": dict(self.skipped)}
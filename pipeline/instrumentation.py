@@ -0,0 +1,314 @@
+"""
+This module provides built-in instrumentation for the transformation pipeline, so that we can tell which enrichment is slow and why records are dropped. It plugs into the pipeline engine as a listener and only updates counters and fixed-size histograms, which keeps its overhead low enough to leave on in production.
+
+No additional setup is required for this file. Set the PIPELINE_METRICS_SINKS environment variable to a comma-separated list of sinks to export the metrics through: log (the default), prometheus and sentry. PIPELINE_METRICS_INTERVAL sets how often the metrics are exported (in seconds) and PIPELINE_METRICS_PORT the port of the Prometheus endpoint.
+
+This module includes the following components:
+
+LatencyHistogram: A histogram with fixed, logarithmically spaced buckets, used to estimate latency quantiles (p50, p95, p99) in constant memory.
+PipelineMetrics: A pipeline listener that tracks, per stage, the latency histogram, records in and out and errors, as well as the drop reasons (invalid schema, duplicate, error), the hit rates of the registered caches and the gauges reported by registered components, such as the memory and refit latency of the online anomaly detector. It exports a snapshot of these metrics through its sinks at a fixed interval.
+LogSink: Exports the metrics as one log line per stage.
+PrometheusSink: Renders the metrics in the Prometheus text exposition format and serves them over HTTP on /metrics.
+SentryTracingListener: Reports every batch as a Sentry performance transaction with one span per stage, using the tracing configured by init_sentry.
+create_metrics_listeners: Builds the PipelineMetrics listener with the sinks named in PIPELINE_METRICS_SINKS, plus the Sentry tracing listener if it is enabled.
+"""
+
+import bisect
+import logging
+import math
+import os
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pipeline.engine import PipelineListener
+
+PIPELINE_METRICS_SINKS = os.getenv("PIPELINE_METRICS_SINKS", "log")
+PIPELINE_METRICS_INTERVAL = float(os.getenv("PIPELINE_METRICS_INTERVAL", "60"))
+PIPELINE_METRICS_PORT = int(os.getenv("PIPELINE_METRICS_PORT", "9102"))
+
+# Bucket upper bounds from 10us to about 100s, each sqrt(2) times the previous one
+LATENCY_BUCKETS = tuple(1e-5 * math.sqrt(2) ** i for i in range(47))
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # The last count is for values above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for position, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                # Interpolate linearly within the bucket
+                lower = self.buckets[position - 1] if position > 0 else 0.0
+                upper = self.buckets[position] if position < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+class StageMetrics:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.batches = 0
+        self.records_in = 0
+        self.records_out = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+class PipelineMetrics(PipelineListener):
+    def __init__(self, sinks=(), export_interval=60.0):
+        self.sinks = list(sinks)
+        self.export_interval = export_interval
+        self.stages = {}
+        self.batch_latency = LatencyHistogram()
+        self.batches = 0
+        self.records = 0
+        self.drops = {}
+        self.caches = {}
+        self.gauges = {}
+        self._last_export = time.monotonic()
+
+    def register_cache(self, name, stats):
+        # stats is a callable returning a dict with at least hits and misses, or None while the cache isn't loaded
+        self.caches[name] = stats
+
+    def register_gauges(self, name, stats):
+        # stats is a callable returning a dict of numeric values, or None while the component isn't loaded
+        self.gauges[name] = stats
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def stage_finished(self, stage, items_in, items_out, seconds):
+        metrics = self.stages.get(stage.name)
+        if metrics is None:
+            metrics = self.stages[stage.name] = StageMetrics()
+        metrics.latency.observe(seconds)
+        metrics.batches += 1
+        metrics.records_in += items_in
+        metrics.records_out += items_out
+        metrics.seconds += seconds
+
+    def record_dropped(self, item, stage):
+        self.drops[stage.drop_reason] = self.drops.get(stage.drop_reason, 0) + 1
+
+    def record_failed(self, item, stage, error):
+        self.stages.setdefault(stage.name, StageMetrics()).errors += 1
+        self.drops["error"] = self.drops.get("error", 0) + 1
+
+    def batch_finished(self, items, seconds):
+        self.batch_latency.observe(seconds)
+        self.batches += 1
+        self.records += len(items)
+        if self.sinks and time.monotonic() - self._last_export >= self.export_interval:
+            self.export()
+
+    def export(self):
+        self._last_export = time.monotonic()
+        snapshot = self.snapshot()
+        for sink in self.sinks:
+            try:
+                sink.export(snapshot)
+            except Exception as e:
+                print(f"Error exporting pipeline metrics: {e}")
+
+    def snapshot(self):
+        stages = {}
+        for name, metrics in self.stages.items():
+            stages[name] = {
+                "batches": metrics.batches,
+                "records_in": metrics.records_in,
+                "records_out": metrics.records_out,
+                "errors": metrics.errors,
+                "seconds": metrics.seconds,
+                "records_per_second": metrics.records_in / metrics.seconds if metrics.seconds else None,
+                "p50": metrics.latency.quantile(0.5),
+                "p95": metrics.latency.quantile(0.95),
+                "p99": metrics.latency.quantile(0.99),
+                "histogram": (metrics.latency.buckets, list(metrics.latency.counts), metrics.latency.sum),
+            }
+
+        caches = {}
+        for name, stats in self.caches.items():
+            cache_stats = stats()
+            if cache_stats is None:
+                continue
+            lookups = cache_stats.get("hits", 0) + cache_stats.get("misses", 0)
+            caches[name] = {
+                "hits": cache_stats.get("hits", 0),
+                "misses": cache_stats.get("misses", 0),
+                "hit_rate": cache_stats["hits"] / lookups if lookups else 0.0,
+            }
+
+        gauges = {}
+        for name, stats in self.gauges.items():
+            values = stats()
+            if values is None:
+                continue
+            gauges[name] = {
+                metric: value for metric, value in values.items()
+                if isinstance(value, (int, float)) and not isinstance(value, bool)
+            }
+
+        return {
+            "batches": self.batches,
+            "records": self.records,
+            "batch_p50": self.batch_latency.quantile(0.5),
+            "batch_p95": self.batch_latency.quantile(0.95),
+            "batch_p99": self.batch_latency.quantile(0.99),
+            "stages": stages,
+            "drops": dict(self.drops),
+            "caches": caches,
+            "gauges": gauges,
+        }
+
+def _milliseconds(seconds):
+    return "n/a" if seconds is None else f"{seconds * 1000:.2f}ms"
+
+class LogSink:
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger("pipeline.metrics")
+
+    def export(self, snapshot):
+        self.logger.info(
+            "pipeline: %d batch(es), %d record(s), batch p50=%s p95=%s p99=%s, drops=%s, caches=%s, gauges=%s",
+            snapshot["batches"],
+            snapshot["records"],
+            _milliseconds(snapshot["batch_p50"]),
+            _milliseconds(snapshot["batch_p95"]),
+            _milliseconds(snapshot["batch_p99"]),
+            snapshot["drops"],
+            {name: round(cache["hit_rate"], 3) for name, cache in snapshot["caches"].items()},
+            snapshot["gauges"],
+        )
+        for name, stage in snapshot["stages"].items():
+            self.logger.info(
+                "stage %s: in=%d out=%d errors=%d p50=%s p95=%s p99=%s",
+                name,
+                stage["records_in"],
+                stage["records_out"],
+                stage["errors"],
+                _milliseconds(stage["p50"]),
+                _milliseconds(stage["p95"]),
+                _milliseconds(stage["p99"]),
+            )
+
+class PrometheusSink:
+    def __init__(self, port=None):
+        self.text = ""
+        self._server = None
+        if port is not None:
+            self.serve(port)
+
+    def export(self, snapshot):
+        self.text = render_prometheus(snapshot)
+
+    def serve(self, port):
+        sink = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = sink.text.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("", port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, name="pipeline-metrics", daemon=True).start()
+
+def render_prometheus(snapshot):
+    lines = [
+        "# TYPE pipeline_records_total counter",
+        f"pipeline_records_total {snapshot['records']}",
+        "# TYPE pipeline_records_dropped_total counter",
+    ]
+    for reason, count in sorted(snapshot["drops"].items()):
+        lines.append(f'pipeline_records_dropped_total{{reason="{reason}"}} {count}')
+
+    lines.append("# TYPE pipeline_stage_latency_seconds histogram")
+    for name, stage in snapshot["stages"].items():
+        buckets, counts, total = stage["histogram"]
+        cumulative = 0
+        for bound, count in zip(buckets, counts):
+            cumulative += count
+            lines.append(f'pipeline_stage_latency_seconds_bucket{{stage="{name}",le="{bound:.6g}"}} {cumulative}')
+        lines.append(f'pipeline_stage_latency_seconds_bucket{{stage="{name}",le="+Inf"}} {stage["batches"]}')
+        lines.append(f'pipeline_stage_latency_seconds_sum{{stage="{name}"}} {total}')
+        lines.append(f'pipeline_stage_latency_seconds_count{{stage="{name}"}} {stage["batches"]}')
+
+    for metric, key in (("records_in", "records_in"), ("records_out", "records_out"), ("errors", "errors")):
+        lines.append(f"# TYPE pipeline_stage_{metric}_total counter")
+        for name, stage in snapshot["stages"].items():
+            lines.append(f'pipeline_stage_{metric}_total{{stage="{name}"}} {stage[key]}')
+
+    lines.append("# TYPE pipeline_cache_hit_ratio gauge")
+    for name, cache in snapshot["caches"].items():
+        lines.append(f'pipeline_cache_hit_ratio{{cache="{name}"}} {cache["hit_rate"]}')
+
+    metrics = sorted({metric for values in snapshot["gauges"].values() for metric in values})
+    for metric in metrics:
+        lines.append(f"# TYPE pipeline_component_{metric} gauge")
+        for name, values in snapshot["gauges"].items():
+            if metric in values:
+                lines.append(f'pipeline_component_{metric}{{component="{name}"}} {values[metric]}')
+    return "\n".join(lines) + "\n"
+
+class SentryTracingListener(PipelineListener):
+    def __init__(self):
+        # Imported here, so that the SDK is only loaded when Sentry tracing is enabled
+        import sentry_sdk
+        self.sentry_sdk = sentry_sdk
+        self._transaction = None
+
+    def batch_started(self, items):
+        self._transaction = self.sentry_sdk.start_transaction(op="pipeline", name="transform")
+        self._transaction.set_data("records", len(items))
+
+    def stage_finished(self, stage, items_in, items_out, seconds):
+        if self._transaction is None:
+            return
+        span = self._transaction.start_child(op=f"pipeline.stage.{stage.kind}", description=stage.name)
+        # The stage already ran, backdate the span to when it started
+        span.start_timestamp -= timedelta(seconds=seconds)
+        span.set_data("records_in", items_in)
+        span.set_data("records_out", items_out)
+        span.finish()
+
+    def batch_finished(self, items, seconds):
+        if self._transaction is not None:
+            self._transaction.finish()
+            self._transaction = None
+
+def create_metrics_listeners(sinks=PIPELINE_METRICS_SINKS, export_interval=PIPELINE_METRICS_INTERVAL, port=PIPELINE_METRICS_PORT):
+    names = {name.strip() for name in sinks.split(",") if name.strip()}
+    metrics = PipelineMetrics(export_interval=export_interval)
+    if "log" in names:
+        metrics.add_sink(LogSink())
+    if "prometheus" in names:
+        metrics.add_sink(PrometheusSink(port))
+
+    listeners = [metrics]
+    if "sentry" in names:
+        listeners.append(SentryTracingListener())
+    return metrics, listeners
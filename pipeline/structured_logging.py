@@ -0,0 +1,169 @@
+"""
+This module provides the logging used by the transformation pipeline. Formatting a full record (including the Debezium schema block of the CDC envelope) for every input and output is expensive, even when nobody reads the logs, so all messages here are formatted lazily, only when a handler actually emits them.
+
+No additional setup is required for this file. The PIPELINE_LOG_MODE environment variable selects how records are logged:
+- records (the default): every input and output record is logged, as the app has always done, but formatted lazily.
+- structured: records are logged as one-line JSON events (record key and payload only), sampled per stage and outcome, with a one-line summary per batch.
+
+In structured mode, PIPELINE_LOG_SAMPLING sets the sampling rates as a comma-separated list of outcome=rate or stage:outcome=rate pairs, where the outcomes are input, output, dropped and failed. For example "output=0.01,failed=1,geolocation:failed=0.1". Error messages printed by the pipeline are rate limited per kind of message: LOG_ERROR_RATE messages per second with bursts of up to LOG_ERROR_BURST, and the number of suppressed messages is reported once printing resumes.
+
+This module includes the following components:
+
+RateLimiter: A token bucket rate limiter that counts the calls it rejects.
+rate_limited_print: Prints an error message unless too many messages of the same kind were printed recently.
+parse_sample_rates: Parses a PIPELINE_LOG_SAMPLING value into a dictionary of sampling rates.
+RecordLogListener: A pipeline listener that logs every input and output record lazily.
+StructuredLogListener: A pipeline listener that logs sampled JSON events per record and a summary line per batch.
+create_log_listener: Builds the listener selected by PIPELINE_LOG_MODE.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from pipeline.engine import PipelineListener
+
+PIPELINE_LOG_MODE = os.getenv("PIPELINE_LOG_MODE", "records")
+PIPELINE_LOG_SAMPLING = os.getenv("PIPELINE_LOG_SAMPLING", "input=0,output=0.01,dropped=0.1,failed=1")
+LOG_ERROR_RATE = float(os.getenv("LOG_ERROR_RATE", "10"))
+LOG_ERROR_BURST = float(os.getenv("LOG_ERROR_BURST", "20"))
+
+class RateLimiter:
+    def __init__(self, rate=10.0, burst=20.0):
+        self.rate = rate
+        self.burst = burst
+        self.suppressed = 0
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            self.suppressed += 1
+            return False
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def rate_limited_print(kind, message):
+    # message may be a callable, so it is only formatted when it is printed
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(kind)
+        if limiter is None:
+            limiter = _rate_limiters[kind] = RateLimiter(LOG_ERROR_RATE, LOG_ERROR_BURST)
+
+    if not limiter.allow():
+        return
+    if limiter.suppressed:
+        print(f"({limiter.suppressed} similar message(s) suppressed: {kind})")
+        limiter.suppressed = 0
+    print(message() if callable(message) else message)
+
+def parse_sample_rates(value):
+    rates = {}
+    for pair in value.split(","):
+        if not pair.strip():
+            continue
+        key, rate = pair.split("=")
+        rates[key.strip()] = float(rate)
+    return rates
+
+class _LazyJson:
+    __slots__ = ("fields",)
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return json.dumps(self.fields, default=str)
+
+class RecordLogListener(PipelineListener):
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger()
+
+    def batch_started(self, items):
+        if self.logger.isEnabledFor(logging.INFO):
+            for item in items:
+                self.logger.info("input: %s", item.record)
+
+    def batch_finished(self, items, seconds):
+        if self.logger.isEnabledFor(logging.INFO):
+            for item in items:
+                if item.dropped_by is None:
+                    self.logger.info("output: %s", item.record)
+
+class StructuredLogListener(PipelineListener):
+    def __init__(self, logger=None, sample_rates=None, summary=True):
+        self.logger = logger or logging.getLogger("pipeline")
+        self.sample_rates = sample_rates or {}
+        self.summary = summary
+        self._drops = {}
+
+    def batch_started(self, items):
+        self._drops = {}
+        if self._sampled("pipeline", "input"):
+            for item in items:
+                if self._sample("pipeline", "input"):
+                    self._log_record("input", item)
+
+    def record_dropped(self, item, stage):
+        self._drops[stage.drop_reason] = self._drops.get(stage.drop_reason, 0) + 1
+        if self._sample(stage.name, "dropped"):
+            self._log_record("dropped", item, stage=stage.name, reason=stage.drop_reason)
+
+    def record_failed(self, item, stage, error):
+        if self._sample(stage.name, "failed"):
+            self._log_record("failed", item, stage=stage.name, error=type(error).__name__, message=str(error))
+
+    def batch_finished(self, items, seconds):
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+
+        if self._sampled("pipeline", "output"):
+            for item in items:
+                if item.dropped_by is None and self._sample("pipeline", "output"):
+                    self._log_record("output", item)
+
+        if self.summary:
+            failed = sum(1 for item in items if item.dropped_by is None and item.errors)
+            self.logger.info("%s", _LazyJson({
+                "event": "batch",
+                "records": len(items),
+                "succeeded": len(items) - failed - sum(self._drops.values()),
+                "dropped": self._drops,
+                "failed": failed,
+                "ms": round(seconds * 1000, 3),
+            }))
+
+    def _rate(self, stage, outcome):
+        rate = self.sample_rates.get(f"{stage}:{outcome}")
+        if rate is None:
+            rate = self.sample_rates.get(outcome, 0.0)
+        return rate
+
+    def _sampled(self, stage, outcome):
+        # Whether anything at all may be logged for this outcome
+        return self._rate(stage, outcome) > 0 and self.logger.isEnabledFor(logging.INFO)
+
+    def _sample(self, stage, outcome):
+        rate = self._rate(stage, outcome)
+        if rate <= 0 or not self.logger.isEnabledFor(logging.INFO):
+            return False
+        return rate >= 1 or random.random() < rate
+
+    def _log_record(self, event, item, **fields):
+        self.logger.info("%s", _LazyJson({"event": event, "key": item.record.key, **fields, "payload": item.payload}))
+
+def create_log_listener(mode=PIPELINE_LOG_MODE, sampling=PIPELINE_LOG_SAMPLING):
+    if mode == "structured":
+        return StructuredLogListener(sample_rates=parse_sample_rates(sampling))
+    return RecordLogListener()
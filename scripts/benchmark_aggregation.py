@@ -0,0 +1,162 @@
+"""
+This script compares the two ways of writing the sales to InfluxDB: one point per record (INFLUXDB_WRITE_MODE=records) and aggregate points per state, product and time window (INFLUXDB_WRITE_MODE=aggregates, see advanced_examples/windowed_aggregation.py). It runs the same fixture file through main.transform in each mode, each time in a fresh process, and reports:
+- the write volume: the points, the bytes of line protocol and the distinct series sent to InfluxDB,
+- the time spent in the stage that writes or aggregates the records, and the overall throughput.
+Windows are closed on a simulated clock that advances with the records, as if they arrived at --rate records per second, so that a run of a few seconds covers many windows.
+It then measures the memory of the aggregator under high key cardinality, by aggregating --cardinality distinct products in a single window with and without the AGGREGATION_MAX_KEYS bound.
+
+The services are replaced with the local fakes of scripts/benchmark_pipeline.py, and the InfluxDB write API serializes the points it receives to count their bytes. No special setup is required. Run it from the root of the app directory, passing a fixture file (see scripts/generate_fixtures.py) and optionally the batch size, the window length and the simulated rate.
+"""
+
+import argparse
+import contextlib
+import functools
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from advanced_examples.windowed_aggregation import AGGREGATION_MAX_KEYS, AGGREGATION_WORKER, WindowedAggregator
+
+class LineProtocolWriteApi:
+    def __init__(self):
+        self.points = 0
+        self.bytes = 0
+        self.series = set()
+
+    def write(self, bucket, org, record):
+        for point in record if isinstance(record, list) else [record]:
+            line = point.to_line_protocol()
+            self.points += 1
+            self.bytes += len(line) + 1
+            # The measurement and tags, up to the first unescaped space
+            self.series.add(re.split(r"(?<!\\) ", line, maxsplit=1)[0])
+
+class SimulatedClock:
+    def __init__(self, rate):
+        self.rate = rate
+        self.seconds = 0.0
+
+    def advance(self, records):
+        self.seconds += records / self.rate
+
+    def __call__(self):
+        return self.seconds
+
+def run_child(args):
+    # INFLUXDB_WRITE_MODE is set by the parent process, before main is imported
+    import main as app
+    import simple_examples.geolocation_enrichment as geolocation_enrichment
+    import simple_examples.influxdb_analytics as influxdb_analytics
+    from benchmark_pipeline import FakeRedis, fake_geocoding_get
+    from pipeline.fixture_source import FixtureSource
+
+    app.components.override("redis", FakeRedis())
+    write_api = LineProtocolWriteApi()
+    influxdb_analytics.influxdb_writer.write_api = write_api
+    geolocation_enrichment.session.get = fake_geocoding_get(args.geocoding_latency)
+    clock = SimulatedClock(args.rate)
+    aggregator = None
+    if app.INFLUXDB_WRITE_MODE != "records":
+        aggregator = WindowedAggregator(
+            functools.partial(influxdb_analytics.write_aggregates_to_influxdb, worker=AGGREGATION_WORKER),
+            window_seconds=args.window, clock=clock, tick_interval=None,
+        )
+        app.components.override("aggregator", aggregator)
+    app.components.warm_up(background=False)
+
+    records = 0
+    seconds = 0.0
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        for batch in FixtureSource(args.fixtures, batch_size=args.batch_size):
+            start = time.perf_counter()
+            app.transform(batch)
+            seconds += time.perf_counter() - start
+            records += len(batch)
+            clock.advance(len(batch))
+    if aggregator is not None:
+        aggregator.flush()
+    influxdb_analytics.influxdb_writer.flush()
+
+    stages = app.pipeline_metrics.snapshot()["stages"]
+    stage = stages["influxdb" if aggregator is None else "aggregate"]
+    print(json.dumps({
+        "records": records,
+        "seconds": seconds,
+        "stage_records": stage["records_in"],
+        "stage_seconds": stage["seconds"],
+        "points": write_api.points,
+        "bytes": write_api.bytes,
+        "series": len(write_api.series),
+        "aggregator": aggregator.stats() if aggregator is not None else None,
+    }))
+
+def run_mode(args, mode):
+    env = dict(os.environ, INFLUXDB_WRITE_MODE=mode, PIPELINE_METRICS_SINKS="")
+    command = [
+        sys.executable, os.path.abspath(__file__), args.fixtures, "--child",
+        "--batch-size", str(args.batch_size), "--geocoding-latency", str(args.geocoding_latency),
+        "--window", str(args.window), "--rate", str(args.rate),
+    ]
+    result = subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def measure_cardinality(cardinality, max_keys):
+    aggregator = WindowedAggregator(lambda window_start, aggregates: None, max_keys=max_keys, tick_interval=None)
+    random.seed(0)
+    payloads = [
+        {"state": "CA", "product_id": product_id, "quantity": random.randint(1, 100), "price": random.uniform(1, 100), "is_anomaly": "false"}
+        for product_id in range(cardinality)
+    ]
+    tracemalloc.start()
+    start = time.perf_counter()
+    for position in range(0, len(payloads), 1000):
+        aggregator.add_many(payloads[position:position + 1000])
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return aggregator.stats(), peak, seconds
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark windowed aggregates against per-record InfluxDB points")
+    parser.add_argument("fixtures", help="fixture file, JSON or JSON Lines")
+    parser.add_argument("--batch-size", type=int, default=1000, help="records per call to transform")
+    parser.add_argument("--geocoding-latency", type=float, default=0.0, help="simulated Geocoding API latency, in seconds")
+    parser.add_argument("--window", type=float, default=60.0, help="window length, in seconds")
+    parser.add_argument("--rate", type=float, default=100.0, help="simulated records per second, to close the windows")
+    parser.add_argument("--cardinality", type=int, default=200000, help="distinct keys for the memory measurement")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    print(f"{'mode':<12} {'points':>10} {'bytes':>12} {'series':>8} {'stage time':>11} {'per record':>11} {'records/sec':>12}")
+    for mode in ("records", "aggregates"):
+        run = run_mode(args, mode)
+        per_record = run["stage_seconds"] / run["stage_records"] if run["stage_records"] else 0.0
+        print(
+            f"{mode:<12} {run['points']:>10} {run['bytes']:>12,} {run['series']:>8} {run['stage_seconds']:>10.3f}s "
+            f"{per_record * 1e6:>9.1f}us {run['records'] / run['seconds']:>12,.0f}"
+        )
+        if run["aggregator"] is not None:
+            stats = run["aggregator"]
+            print(f"{'':<12} {stats['windows_closed']} window(s) of {args.window:g}s at {args.rate:g} records/sec, {stats['overflow_records']} overflow record(s)")
+
+    print(f"{args.cardinality} distinct keys in one window:")
+    for label, max_keys in (("unbounded", args.cardinality + 1), (f"max {AGGREGATION_MAX_KEYS} keys", AGGREGATION_MAX_KEYS)):
+        stats, peak, seconds = measure_cardinality(args.cardinality, max_keys)
+        print(
+            f"  {label:<18} {stats['open_keys']:>8} aggregate(s), {stats['overflow_records']:>8} overflow record(s), "
+            f"peak {peak / 2 ** 20:>7.1f} MiB, {args.cardinality / seconds:,.0f} records/sec"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+This script measures the cold start of the data app: how long a fresh Python process takes to import main, and then to run App.run on its first batch of records, as the Turbine runtime would on startup. App.run is called with a small stand-in for the Turbine runtime that reads the records of a fixture file and discards the output. Every run is a new process, so nothing is cached between runs (except by the operating system).
+The services are pointed at closed local ports (Redis, InfluxDB and the Geocoding API), so that no request leaves the machine and failures come back at once; the stages still run and load their modules, clients and models. When the app has a component registry, the time spent building each component during the first run is reported too. A module imported by an earlier component (numpy, for example) only counts for the first one.
+
+To compare with the app before the lazy component registry, check the previous version out into a separate directory, for example with git worktree add /tmp/before HEAD~1, and pass it with --app-dir. Set --warm-up to all to build every component in the background as soon as main is imported.
+
+No special setup is required. Run it from the root of the app directory, optionally passing the number of runs and the fixture file.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Runs in the child process, from the app directory
+CHILD = """
+import asyncio, json, os, sys, time
+start = time.perf_counter()
+sys.path.insert(0, ".")
+import main
+imported = time.perf_counter()
+
+from pipeline.fixture_source import FixtureSource
+
+class Resource:
+    async def records(self, collection, config):
+        return next(iter(FixtureSource(sys.argv[1], batch_size=int(sys.argv[2]))))
+
+    async def write(self, records, collection, config):
+        pass
+
+class Runtime:
+    async def resources(self, name):
+        return Resource()
+
+    def register_secrets(self, name):
+        pass
+
+    async def process(self, records, fn):
+        return fn(records)
+
+asyncio.run(main.App.run(Runtime()))
+finished = time.perf_counter()
+
+components = main.components.report() if hasattr(main, "components") else {}
+print("cold start: " + json.dumps({"import": imported - start, "first_batch": finished - imported, "components": components}), flush=True)
+# Skip the exit handlers, which would retry the InfluxDB writes
+os._exit(0)
+"""
+
+def run_once(app_dir, fixtures, batch_size, warm_up):
+    env = dict(
+        os.environ,
+        REDIS_HOST="127.0.0.1",
+        REDIS_PORT="1",
+        INFLUXDB_URL="http://127.0.0.1:1",
+        GEOCODING_API_URL="http://127.0.0.1:1",
+        PIPELINE_METRICS_SINKS="",
+        PIPELINE_WARM_UP=warm_up,
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD, fixtures, str(batch_size)],
+        cwd=app_dir,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # The app prints to stdout too
+    line = next(line for line in result.stdout.splitlines() if line.startswith("cold start: "))
+    return json.loads(line[len("cold start: "):])
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cold start of the app")
+    parser.add_argument("--app-dir", default=APP_DIR, help="directory of the app to measure")
+    parser.add_argument("--fixtures", default=os.path.join(APP_DIR, "fixtures", "demo-cdc.json"), help="fixture file, JSON or JSON Lines")
+    parser.add_argument("--batch-size", type=int, default=100, help="records in the first batch")
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh processes")
+    parser.add_argument("--warm-up", default="", help="value of PIPELINE_WARM_UP")
+    args = parser.parse_args()
+
+    runs = [run_once(args.app_dir, os.path.abspath(args.fixtures), args.batch_size, args.warm_up) for _ in range(args.runs)]
+
+    imports = [run["import"] for run in runs]
+    first_batches = [run["first_batch"] for run in runs]
+    totals = [run["import"] + run["first_batch"] for run in runs]
+    print(f"{args.runs} run(s) of {os.path.abspath(args.app_dir)}, median (min-max)")
+    for label, values in (("import main", imports), ("first App.run", first_batches), ("total", totals)):
+        print(f"{label:<16} {statistics.median(values):>8.3f}s ({min(values):.3f}-{max(values):.3f})")
+
+    if runs[0]["components"]:
+        print(f"{'component':<20} {'seconds':>8}  thread")
+        for name, component in runs[0]["components"].items():
+            seconds = f"{component['seconds']:.3f}" if component["loaded"] else "unused"
+            print(f"{name:<20} {seconds:>8}  {component['thread'] or ''}")
+
+if __name__ == "__main__":
+    main()
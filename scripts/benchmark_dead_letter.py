@@ -0,0 +1,105 @@
+"""
+This script measures what the dead-letter store costs the pipeline during an error storm. It runs generated sales records through a small pipeline whose enrichment stage fails for a given share of the records, and compares the throughput of the pipeline:
+- without a dead-letter store,
+- with the DeadLetterListener, which queues the failed records and writes them to SQLite in batches from a background thread,
+- with a naive listener that inserts and commits every failed record into SQLite (with its default journal and synchronous settings) as soon as it fails, on the pipeline thread.
+It reports the records per second of each and the number of entries written to the store.
+
+No special setup is required. Run it from the root of the app directory, optionally passing the number of records, the batch size and the share of records that fail.
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from turbine.runtime import Record
+
+from generate_fixtures import SCHEMA, generate_records
+from pipeline.dead_letter import DeadLetterListener, DeadLetterStore
+from pipeline.engine import BATCH, CPU, Pipeline, PipelineItem, PipelineListener, Stage
+
+class PerRecordListener(PipelineListener):
+    def __init__(self, path):
+        # SQLite defaults, so every commit waits for the disk
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE dead_letters (id INTEGER PRIMARY KEY, record_key TEXT, stage TEXT, error_class TEXT, value TEXT)")
+        self.written = 0
+
+    def record_failed(self, item, stage, error):
+        self.db.execute(
+            "INSERT INTO dead_letters (record_key, stage, error_class, value) VALUES (?, ?, ?, ?)",
+            (json.dumps(item.record.key), stage.name, type(error).__name__, json.dumps(item.record.value)),
+        )
+        self.db.commit()
+        self.written += 1
+
+def failing_enrichment(error_ratio):
+    def enrich(payloads):
+        errors = []
+        for payload in payloads:
+            if random.random() < error_ratio:
+                errors.append(ConnectionError("upstream unavailable"))
+            else:
+                payload["enriched"] = True
+                errors.append(None)
+        return errors
+    return enrich
+
+def run(fixtures, batch_size, error_ratio, listeners):
+    pipeline = Pipeline(
+        [
+            Stage("enrich", failing_enrichment(error_ratio), kind=BATCH),
+            Stage("remove_fields", lambda payload: payload.pop("extra_id", None), kind=CPU, depends_on=["enrich"]),
+        ],
+        listeners=listeners,
+    )
+    random.seed(0)
+    seconds = 0.0
+    for position in range(0, len(fixtures), batch_size):
+        records = [
+            Record(key=fixture["key"], value=json.loads(fixture["value"]), timestamp=0)
+            for fixture in fixtures[position:position + batch_size]
+        ]
+        items = [PipelineItem(record, record.value["payload"]["after"]) for record in records]
+        start = time.perf_counter()
+        pipeline.run(items)
+        seconds += time.perf_counter() - start
+    pipeline.close()
+    return len(fixtures) / seconds
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dead-letter store during an error storm")
+    parser.add_argument("--records", type=int, default=20000, help="number of records")
+    parser.add_argument("--batch-size", type=int, default=1000, help="records per batch")
+    parser.add_argument("--error-ratio", type=float, default=0.5, help="share of records that fail")
+    args = parser.parse_args()
+
+    # Values are kept serialized, so every run starts from unmodified records
+    fixtures = [
+        {"key": record["key"], "value": json.dumps(record["value"])}
+        for record in generate_records(args.records, "sales", SCHEMA)
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        baseline = run(fixtures, args.batch_size, args.error_ratio, [])
+        print(f"{'no dead-letter store':<32} {baseline:>10,.0f} records/sec")
+
+        store = DeadLetterStore(os.path.join(directory, "batched.db"), max_entries=args.records)
+        rate = run(fixtures, args.batch_size, args.error_ratio, [DeadLetterListener(store)])
+        store.flush()
+        print(f"{'batched dead-letter store':<32} {rate:>10,.0f} records/sec, {store.count()} entries, {store.stats()['batches_written']} batch(es)")
+        store.close()
+
+        per_record = PerRecordListener(os.path.join(directory, "per_record.db"))
+        rate = run(fixtures, args.batch_size, args.error_ratio, [per_record])
+        print(f"{'insert and commit per record':<32} {rate:>10,.0f} records/sec, {per_record.written} entries")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+This script measures how many upstream Geocoding API calls the geolocation enrichment makes on fixture data, and how long it takes.
+It starts a local stub of the Google Geocoding API, points the geolocation_enrichment module at it and enriches the fixture records three ways: one uncached call per record, the cached per-record path, and the concurrent batch path with a cold cache.
+
+Passing an index built with scripts/build_postal_code_index.py (--index) also benchmarks the offline postal code index against the HTTP path: the startup time and memory of loading the index, and the per-lookup latency of both.
+
+No API key or network access is needed. Run it from the root of the app directory, optionally passing another fixture file, how often to replay it and the simulated latency of the API.
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+class StubGeocodingHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    calls = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with StubGeocodingHandler.lock:
+            StubGeocodingHandler.calls += 1
+        time.sleep(self.latency)
+
+        postal_code = parse_qs(urlparse(self.path).query).get("address", [""])[0]
+        digest = hashlib.sha256(postal_code.encode("utf-8")).digest()
+        body = json.dumps({
+            "status": "OK",
+            "results": [{"geometry": {"location": {
+                "lat": 25 + digest[0] / 255 * 24,
+                "lng": -124 + digest[1] / 255 * 57,
+            }}}],
+        }).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_server(latency):
+    StubGeocodingHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGeocodingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def load_payloads(path, repeat):
+    with open(path) as infile:
+        fixtures = json.load(infile)
+    payloads = [record["value"]["payload"]["after"] for records in fixtures.values() for record in records]
+    return [copy.deepcopy(payload) for _ in range(repeat) for payload in payloads]
+
+def run(label, enrich, payloads):
+    StubGeocodingHandler.calls = 0
+    start = time.perf_counter()
+    enrich(payloads)
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {len(payloads)} records, {StubGeocodingHandler.calls} upstream calls, {elapsed * 1000:.1f} ms")
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def benchmark_index(path, payloads, geolocation_enrichment):
+    from simple_examples.postal_code_index import PostalCodeIndex
+
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    index = PostalCodeIndex.load(path)
+    load_seconds = time.perf_counter() - start
+    print(f"index: {len(index)} postal codes, {os.path.getsize(path)} bytes on disk, "
+          f"loaded in {load_seconds * 1000:.2f} ms, peak RSS +{peak_rss_mb() - rss_before:.1f} MB")
+
+    postal_codes = [payload["postal_code"] for payload in payloads]
+    start = time.perf_counter()
+    found = sum(1 for postal_code in postal_codes if index.lookup(postal_code) is not None)
+    index_seconds = time.perf_counter() - start
+
+    StubGeocodingHandler.calls = 0
+    start = time.perf_counter()
+    for postal_code in postal_codes:
+        geolocation_enrichment.get_geolocation(postal_code)
+    http_seconds = time.perf_counter() - start
+
+    print(f"index lookup: {index_seconds / len(postal_codes) * 1e6:.1f} us per lookup ({found}/{len(postal_codes)} found)")
+    print(f"HTTP lookup: {http_seconds / len(postal_codes) * 1e6:.1f} us per lookup")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark geolocation enrichment against a local stub Geocoding API")
+    parser.add_argument("--fixture", default="fixtures/demo-cdc.json", help="fixture file to read records from")
+    parser.add_argument("--repeat", type=int, default=100, help="how many times to replay the fixture records")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="simulated latency of the Geocoding API")
+    parser.add_argument("--index", help="offline postal code index to benchmark against the HTTP path")
+    args = parser.parse_args()
+
+    server = start_stub_server(args.latency_ms / 1000)
+    os.environ["GEOCODING_API_URL"] = f"http://127.0.0.1:{server.server_port}/maps/api/geocode/json"
+
+    from simple_examples import geolocation_enrichment
+
+    payloads = load_payloads(args.fixture, args.repeat)
+
+    def uncached(payloads):
+        for payload in payloads:
+            geolocation_enrichment.get_geolocation(payload["postal_code"])
+
+    def cached(payloads):
+        for payload in payloads:
+            geolocation_enrichment.enrich_with_geolocation(payload)
+
+    def batched(payloads):
+        geolocation_enrichment.enrich_records_with_geolocation(payloads, cache=geolocation_enrichment.GeocodingCache())
+
+    run("uncached", uncached, payloads)
+    run("cached", cached, payloads)
+    print(f"cache stats: {geolocation_enrichment.geocoding_cache.stats()}")
+    run("batched", batched, payloads)
+
+    if args.index:
+        benchmark_index(args.index, payloads, geolocation_enrichment)
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
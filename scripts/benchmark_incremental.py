@@ -0,0 +1,113 @@
+"""
+This script measures what the incremental mode of the pipeline (PIPELINE_INCREMENTAL=true) saves on an update-heavy CDC workload. It runs the same fixture file through main.transform twice, each time in a fresh process: once re-enriching every event, and once in incremental mode, where the stages whose inputs an update didn't change are skipped and their previous outputs reused. It reports, per stage, the records the stage ran for and the time it took in each mode, along with the overall throughput and the InfluxDB points written.
+
+The services are replaced with the local fakes of scripts/benchmark_pipeline.py. The fake Redis never reports a duplicate in this comparison: by default every update of an order is dropped as a duplicate of the order, and the point is to compare what each update costs when it is processed.
+
+No special setup is required. Generate an update-heavy fixture file first, for example:
+
+python scripts/generate_fixtures.py --records 50000 --output fixtures/updates.jsonl --update-ratio 0.7 --delete-ratio 0.05 --postal-codes 2000
+
+then run this script from the root of the app directory, passing the fixture file and optionally the batch size.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+class NoDuplicatesRedis:
+    class Pipeline:
+        def __init__(self):
+            self.commands = 0
+
+        def set(self, *args, **kwargs):
+            self.commands += 1
+            return self
+
+        def execute(self):
+            return [True] * self.commands
+
+    def set(self, key, value, ex=None, nx=False):
+        return True
+
+    def pipeline(self, transaction=True):
+        return self.Pipeline()
+
+def run_child(fixtures, batch_size, geocoding_latency):
+    # PIPELINE_INCREMENTAL is set by the parent process, before main is imported
+    import main as app
+    import simple_examples.geolocation_enrichment as geolocation_enrichment
+    import simple_examples.influxdb_analytics as influxdb_analytics
+    from benchmark_pipeline import FakeWriteApi, fake_geocoding_get
+    from pipeline.fixture_source import FixtureSource
+
+    app.components.override("redis", NoDuplicatesRedis())
+    write_api = FakeWriteApi()
+    influxdb_analytics.influxdb_writer.write_api = write_api
+    geolocation_enrichment.session.get = fake_geocoding_get(geocoding_latency)
+    app.components.warm_up(background=False)
+
+    records = 0
+    seconds = 0.0
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        for batch in FixtureSource(fixtures, batch_size=batch_size):
+            start = time.perf_counter()
+            app.transform(batch)
+            seconds += time.perf_counter() - start
+            records += len(batch)
+    influxdb_analytics.influxdb_writer.flush()
+
+    snapshot = app.pipeline_metrics.snapshot()
+    print(json.dumps({
+        "records": records,
+        "seconds": seconds,
+        "points": write_api.points,
+        "stages": {name: {"records_in": stage["records_in"], "seconds": stage["seconds"]} for name, stage in snapshot["stages"].items()},
+        "incremental": app.incremental_processor.stats() if app.incremental_processor is not None else None,
+    }))
+
+def run_mode(args, incremental):
+    env = dict(os.environ, PIPELINE_INCREMENTAL="true" if incremental else "false", PIPELINE_METRICS_SINKS="")
+    command = [
+        sys.executable, os.path.abspath(__file__), args.fixtures, "--child",
+        "--batch-size", str(args.batch_size), "--geocoding-latency", str(args.geocoding_latency),
+    ]
+    result = subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the incremental mode on CDC updates")
+    parser.add_argument("fixtures", help="fixture file, JSON or JSON Lines")
+    parser.add_argument("--batch-size", type=int, default=1000, help="records per call to transform")
+    parser.add_argument("--geocoding-latency", type=float, default=0.005, help="simulated Geocoding API latency, in seconds")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.fixtures, args.batch_size, args.geocoding_latency)
+        return
+
+    full = run_mode(args, incremental=False)
+    incremental = run_mode(args, incremental=True)
+
+    print(f"{full['records']} records")
+    print(f"{'stage':<20} {'full runs':>10} {'incr. runs':>10} {'full time':>10} {'incr. time':>10} {'saved':>7}")
+    for name, stage in full["stages"].items():
+        other = incremental["stages"].get(name, {"records_in": 0, "seconds": 0.0})
+        saved = 1 - other["seconds"] / stage["seconds"] if stage["seconds"] else 0.0
+        print(
+            f"{name:<20} {stage['records_in']:>10} {other['records_in']:>10} "
+            f"{stage['seconds']:>9.2f}s {other['seconds']:>9.2f}s {saved:>6.0%}"
+        )
+    for label, run in (("full", full), ("incremental", incremental)):
+        print(f"{label}: {run['records'] / run['seconds']:,.0f} records/sec, {run['points']} InfluxDB point(s)")
+    stats = incremental["incremental"]
+    print(f"incremental: {stats['updates']} update(s), {stats['deletes']} delete(s), cache hit rate {stats['hit_rate']:.1%}")
+
+if __name__ == "__main__":
+    main()
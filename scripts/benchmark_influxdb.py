@@ -0,0 +1,100 @@
+"""
+This script measures the per-record cost of writing sales records to InfluxDB, with one synchronous write per record and with the buffered writer.
+It starts a local stub of the InfluxDB write endpoint (/api/v2/write), points the influxdb_analytics module at it and writes generated sales records both ways.
+
+No InfluxDB account or network access is needed. Run it from the root of the app directory, optionally passing the number of records and the simulated latency of the write endpoint.
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+class StubInfluxDBHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    requests = 0
+    lines = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with StubInfluxDBHandler.lock:
+            StubInfluxDBHandler.requests += 1
+            StubInfluxDBHandler.lines += body.count(b"\n") + 1
+        time.sleep(self.latency)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_server(latency):
+    StubInfluxDBHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubInfluxDBHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def generate_payloads(num_records):
+    return [
+        {
+            "customer_id": i % 500,
+            "customer_email": f"{i % 500:064x}",
+            "product_id": i % 50,
+            "quantity": i % 10 + 1,
+            "price": 9.99 + i % 40,
+            "order_date": "2023-04-27",
+            "postal_code": f"{10000 + i % 900:05d}",
+            "state": "CA",
+            "customer_review": "Great product, would buy again.",
+        }
+        for i in range(num_records)
+    ]
+
+def report(label, elapsed, total, num_records):
+    print(
+        f"{label}: {elapsed / num_records * 1e6:.1f} us per record in the transform loop, "
+        f"{total:.2f} s until written, {StubInfluxDBHandler.requests} HTTP request(s), {StubInfluxDBHandler.lines} point(s)"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark InfluxDB writes against a local stub endpoint")
+    parser.add_argument("--records", type=int, default=2000, help="number of records to write")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="simulated latency of the write endpoint")
+    args = parser.parse_args()
+
+    server = start_stub_server(args.latency_ms / 1000)
+    os.environ["INFLUXDB_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ.setdefault("INFLUXDB_TOKEN", "benchmark")
+
+    from simple_examples import influxdb_analytics
+
+    payloads = generate_payloads(args.records)
+
+    write_api = influxdb_analytics.create_write_api()
+    StubInfluxDBHandler.requests = StubInfluxDBHandler.lines = 0
+    start = time.perf_counter()
+    for payload in payloads:
+        write_api.write(
+            bucket=influxdb_analytics.bucket, org=influxdb_analytics.org, record=influxdb_analytics.build_point(payload)
+        )
+    elapsed = time.perf_counter() - start
+    report("synchronous", elapsed, elapsed, args.records)
+
+    StubInfluxDBHandler.requests = StubInfluxDBHandler.lines = 0
+    start = time.perf_counter()
+    for payload in payloads:
+        influxdb_analytics.write_data_to_influxdb(payload)
+    elapsed = time.perf_counter() - start
+    influxdb_analytics.influxdb_writer.flush()
+    report("buffered", elapsed, time.perf_counter() - start, args.records)
+    print(f"writer stats: {influxdb_analytics.influxdb_writer.stats()}")
+
+    influxdb_analytics.influxdb_writer.close()
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+This script measures the CPU cost of logging the records going through the pipeline, on copies of the fixture records. It compares the per-record f-string logging the app used to do with the lazily formatted record logs (PIPELINE_LOG_MODE=records) and the sampled structured logs (PIPELINE_LOG_MODE=structured), both with INFO logging disabled and enabled, as well as printing every error message against the rate-limited error prints.
+Log output goes to os.devnull, so the numbers are the cost of formatting and handling the messages, not of the terminal.
+
+No special setup is required. Run it from the root of the app directory, optionally passing the number of records, the fixture file and the structured log sampling rates.
+"""
+
+import argparse
+import contextlib
+import copy
+import io
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from turbine.runtime import Record
+
+from pipeline.engine import PipelineItem
+from pipeline.structured_logging import (
+    PIPELINE_LOG_SAMPLING,
+    RecordLogListener,
+    StructuredLogListener,
+    parse_sample_rates,
+    rate_limited_print,
+)
+
+def load_items(path, count):
+    with open(path) as f:
+        fixtures = json.load(f)["sales"]
+    items = []
+    for i in range(count):
+        fixture = fixtures[i % len(fixtures)]
+        record = Record(key=f"{fixture['key']}-{i}", value=copy.deepcopy(fixture["value"]), timestamp=0)
+        items.append(PipelineItem(record, record.value["payload"]["after"]))
+    return items
+
+def log_with_fstrings(items):
+    for item in items:
+        logging.info(f"input: {item.record}")
+    for item in items:
+        logging.info(f"output: {item.record}")
+
+def log_with_listener(listener):
+    def run(items):
+        listener.batch_started(items)
+        listener.batch_finished(items, 0.0)
+    return run
+
+def cpu_seconds(func, *args):
+    start = time.process_time()
+    func(*args)
+    return time.process_time() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark record logging")
+    parser.add_argument("--records", type=int, default=20000, help="number of records to log")
+    parser.add_argument("--fixtures", default="fixtures/demo-cdc.json", help="fixture file with the records to copy")
+    parser.add_argument("--sampling", default=PIPELINE_LOG_SAMPLING, help="sampling rates of the structured logs")
+    args = parser.parse_args()
+
+    items = load_items(args.fixtures, args.records)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    devnull = open(os.devnull, "w")
+    root.addHandler(logging.StreamHandler(devnull))
+
+    modes = [
+        ("f-strings (before)", log_with_fstrings),
+        ("records, lazy", log_with_listener(RecordLogListener())),
+        ("structured, sampled", log_with_listener(StructuredLogListener(sample_rates=parse_sample_rates(args.sampling)))),
+    ]
+
+    print(f"{args.records} records, CPU seconds per batch")
+    for level in (logging.WARNING, logging.INFO):
+        root.setLevel(level)
+        for name, run in modes:
+            seconds = cpu_seconds(run, items)
+            print(f"{logging.getLevelName(level):<8} {name:<20} {seconds:8.3f}s  {seconds / args.records * 1e6:8.1f}us/record")
+
+    def print_errors(printer, output):
+        with contextlib.redirect_stdout(output):
+            for item in items:
+                printer(lambda: f"Duplicate record found: {item.record.key}")
+
+    for name, printer in (
+        ("all", lambda message: print(message())),
+        ("rate limited", lambda message: rate_limited_print("duplicate", message)),
+    ):
+        output = io.StringIO()
+        seconds = cpu_seconds(print_errors, printer, output)
+        print(f"error prints, {name:<14} {seconds:8.3f}s  {output.getvalue().count(chr(10))} line(s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+This script measures the throughput of the whole transformation pipeline by running main.transform over a fixture file, batch by batch, as the Turbine runtime would. Redis, InfluxDB and the Geocoding API are replaced with local fakes (an in-memory Redis with SET NX and pipelines, an InfluxDB write API that only counts points, and a Geocoding API answering every postal code after an optional simulated latency), so no service needs to be running.
+It reports the records per second, the latency percentiles and throughput of every stage (from the pipeline metrics), the drop reasons, the cache hit rates and the peak resident memory of the process.
+
+No special setup is required. Generate a large fixture file first, for example:
+
+python scripts/generate_fixtures.py --records 100000 --output fixtures/load.jsonl --duplicate-ratio 0.05 --invalid-ratio 0.02 --postal-codes 2000
+
+then run this script from the root of the app directory, passing the fixture file (JSON or JSON Lines) and optionally the batch size.
+"""
+
+import argparse
+import contextlib
+import fnmatch
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main as app
+import simple_examples.geolocation_enrichment as geolocation_enrichment
+import simple_examples.influxdb_analytics as influxdb_analytics
+
+from pipeline.fixture_source import FixtureSource
+
+class FakeRedisPipeline:
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.commands = []
+
+    def set(self, *args, **kwargs):
+        self.commands.append((args, kwargs))
+        return self
+
+    def execute(self):
+        return [self.redis_client.set(*args, **kwargs) for args, kwargs in self.commands]
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def pipeline(self, transaction=True):
+        return FakeRedisPipeline(self)
+
+    def scan_iter(self, match=None, count=None):
+        return [key for key in list(self.data) if match is None or fnmatch.fnmatchcase(key, match)]
+
+class FakeWriteApi:
+    def __init__(self):
+        self.points = 0
+
+    def write(self, bucket, org, record):
+        self.points += len(record) if isinstance(record, list) else 1
+
+class FakeGeocodingResponse:
+    status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"status": "OK", "results": [{"geometry": {"location": {"lat": 37.77, "lng": -122.42}}}]}
+
+def fake_geocoding_get(latency):
+    def get(url, params=None, **kwargs):
+        if latency:
+            time.sleep(latency)
+        return FakeGeocodingResponse()
+    return get
+
+def _milliseconds(seconds):
+    return "n/a" if seconds is None else f"{seconds * 1000:.2f}ms"
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the transformation pipeline")
+    parser.add_argument("fixtures", help="fixture file, JSON or JSON Lines")
+    parser.add_argument("--table", default="sales", help="table name in a JSON fixture file")
+    parser.add_argument("--batch-size", type=int, default=1000, help="records per call to transform")
+    parser.add_argument("--geocoding-latency", type=float, default=0.02, help="simulated Geocoding API latency, in seconds")
+    parser.add_argument("--verbose", action="store_true", help="show the messages printed by the pipeline")
+    args = parser.parse_args()
+
+    app.components.override("redis", FakeRedis())
+    write_api = FakeWriteApi()
+    influxdb_analytics.influxdb_writer.write_api = write_api
+    geolocation_enrichment.session.get = fake_geocoding_get(args.geocoding_latency)
+    # Load every module and model before timing, scripts/benchmark_cold_start.py measures the startup
+    app.components.warm_up(background=False)
+
+    records = 0
+    transform_seconds = 0.0
+    output = sys.stdout if args.verbose else open(os.devnull, "w")
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        for batch in FixtureSource(args.fixtures, table=args.table, batch_size=args.batch_size):
+            batch_start = time.perf_counter()
+            app.transform(batch)
+            transform_seconds += time.perf_counter() - batch_start
+            records += len(batch)
+    # Write out the open window first, with INFLUXDB_WRITE_MODE=aggregates or both
+    aggregator = app.components.get("aggregator")
+    if aggregator is not None:
+        aggregator.flush()
+    influxdb_analytics.influxdb_writer.flush()
+    total_seconds = time.perf_counter() - start
+
+    snapshot = app.pipeline_metrics.snapshot()
+    print(f"{records} records in {snapshot['batches']} batch(es) of up to {args.batch_size}")
+    print(f"transform: {records / transform_seconds:,.0f} records/sec, including reading fixtures: {records / total_seconds:,.0f} records/sec")
+    print(f"batch latency: p50={_milliseconds(snapshot['batch_p50'])} p95={_milliseconds(snapshot['batch_p95'])} p99={_milliseconds(snapshot['batch_p99'])}")
+    print(f"{'stage':<20} {'in':>10} {'out':>10} {'errors':>8} {'records/sec':>12} {'p50':>10} {'p95':>10} {'p99':>10}")
+    for name, stage in snapshot["stages"].items():
+        records_per_second = f"{stage['records_per_second']:,.0f}" if stage["records_per_second"] else "n/a"
+        print(
+            f"{name:<20} {stage['records_in']:>10} {stage['records_out']:>10} {stage['errors']:>8} {records_per_second:>12} "
+            f"{_milliseconds(stage['p50']):>10} {_milliseconds(stage['p95']):>10} {_milliseconds(stage['p99']):>10}"
+        )
+    print(f"drops: {snapshot['drops']}")
+    print(f"cache hit rates: { {name: round(cache['hit_rate'], 3) for name, cache in snapshot['caches'].items()} }")
+    print(f"InfluxDB points written: {write_api.points}")
+    # ru_maxrss is in kilobytes on Linux
+    print(f"peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:,.1f} MiB")
+
+if __name__ == "__main__":
+    main()
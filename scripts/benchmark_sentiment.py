@@ -0,0 +1,68 @@
+"""
+This script benchmarks sentiment scoring on generated customer reviews. It compares the current per-record TextBlob scoring with the SentimentEngine, first in-process without a cache, then with the review cache, then across a pool of worker processes.
+Part of the generated reviews are repeated, the way templated reviews are in real data. The script checks that the engine returns the same polarity values and reports records per second, and records per second per core.
+
+To set up and use this script, make sure you have the required libraries installed (TextBlob and Faker). Run it from the root of the app directory.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+from faker import Faker
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from advanced_examples.sentiment_analysis import SentimentEngine, score_review
+
+def generate_reviews(num_reviews, repeat_ratio):
+    faker = Faker()
+    templates = [faker.text(max_nb_chars=200) for _ in range(20)]
+    return [
+        random.choice(templates) if random.random() < repeat_ratio else faker.text(max_nb_chars=200)
+        for _ in range(num_reviews)
+    ]
+
+def report(label, num_reviews, elapsed, cores):
+    rate = num_reviews / elapsed
+    print(f"{label}: {rate:,.0f} records/sec, {rate / cores:,.0f} records/sec per core")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sentiment scoring")
+    parser.add_argument("--reviews", type=int, default=5000, help="number of reviews to score")
+    parser.add_argument("--repeat-ratio", type=float, default=0.3, help="share of reviews repeated from templates")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes for the pool run")
+    args = parser.parse_args()
+
+    reviews = generate_reviews(args.reviews, args.repeat_ratio)
+
+    start = time.perf_counter()
+    expected = [score_review(review) for review in reviews]
+    report("per record", args.reviews, time.perf_counter() - start, 1)
+
+    runs = [
+        ("engine, no cache", SentimentEngine(cache_size=0), 1),
+        ("engine, cache", SentimentEngine(cache_size=10000), 1),
+        (f"engine, cache, {args.workers} workers", SentimentEngine(cache_size=10000, workers=args.workers), min(args.workers, os.cpu_count())),
+    ]
+    for label, engine, cores in runs:
+        if engine.workers:
+            # Start the worker processes outside of the measurement
+            warmup = [f"warm up review {i}" for i in range(engine.min_parallel_batch)]
+            engine.score_many(warmup)
+            engine.hits = engine.misses = 0
+        start = time.perf_counter()
+        results = engine.score_many(reviews)
+        elapsed = time.perf_counter() - start
+
+        if [score for score, _ in results] != expected:
+            print(f"{label}: scores differ from TextBlob", file=sys.stderr)
+            sys.exit(1)
+        report(label, args.reviews, elapsed, cores)
+        print(f"  {engine.stats()}")
+        engine.close()
+
+if __name__ == "__main__":
+    main()
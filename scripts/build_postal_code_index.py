@@ -0,0 +1,51 @@
+"""
+This script builds the offline postal code index used by the geolocation enrichment, so that high-volume sales can be enriched with latitude and longitude without calling the Google Maps Geocoding API.
+It reads a delimited text file with a header row, such as the US Census ZCTA Gazetteer file (https://www.census.gov/geographies/reference-files/time-series/geo/gazetteer-files.html), and writes a compact, sorted index file that workers memory-map at startup.
+
+By default the script expects the Gazetteer column names (GEOID, INTPTLAT and INTPTLONG) and detects whether the file is tab- or comma-separated. Set the POSTAL_CODE_INDEX_PATH environment variable to the path of the generated file to enable the index.
+"""
+
+import argparse
+import csv
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from simple_examples.postal_code_index import PostalCodeIndex, write_postal_code_index
+
+def read_entries(path, code_column, lat_column, lng_column):
+    with open(path, newline="", encoding="utf-8") as infile:
+        first_line = infile.readline()
+        infile.seek(0)
+        delimiter = "\t" if "\t" in first_line else ","
+
+        reader = csv.reader(infile, delimiter=delimiter)
+        header = [column.strip() for column in next(reader)]
+        code_position = header.index(code_column)
+        lat_position = header.index(lat_column)
+        lng_position = header.index(lng_column)
+
+        for row in reader:
+            if not row:
+                continue
+            yield row[code_position].strip(), float(row[lat_position]), float(row[lng_position])
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline postal code geolocation index")
+    parser.add_argument("source", help="delimited text file with postal codes and coordinates")
+    parser.add_argument("--output", default="fixtures/postal_codes.idx", help="where to write the index")
+    parser.add_argument("--code-column", default="GEOID")
+    parser.add_argument("--lat-column", default="INTPTLAT")
+    parser.add_argument("--lng-column", default="INTPTLONG")
+    args = parser.parse_args()
+
+    count = write_postal_code_index(
+        read_entries(args.source, args.code_column, args.lat_column, args.lng_column),
+        args.output,
+    )
+    PostalCodeIndex.load(args.output)
+    print(f"Wrote {count} postal codes to {args.output} ({os.path.getsize(args.output)} bytes)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+This script checks the behavior of the geocoding cache (GeocodingCache in simple_examples/geolocation_enrichment.py) on a simulated clock, without a Google Maps API key or network access:
+- results expire after the time-to-live, and postal codes without a result are cached as well, for the shorter negative time-to-live,
+- the least recently used postal codes are evicted once the cache holds max_size of them,
+- results written to the SQLite store are found again by a new cache, as after a restart, until they expire,
+- concurrent lookups and writes, in memory and on disk, don't fail or lose results.
+It exits with a non-zero status and prints the failed check if the cache doesn't behave as expected.
+
+Run it from the root of the app directory.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from simple_examples.geolocation_enrichment import GeocodingCache
+
+LOCATION = {"lat": 37.77, "lng": -122.42}
+
+class SimulatedClock:
+    def __init__(self):
+        self.seconds = 1000.0
+
+    def advance(self, seconds):
+        self.seconds += seconds
+
+    def __call__(self):
+        return self.seconds
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+    print(f"ok: {message}")
+
+def check_expiration():
+    clock = SimulatedClock()
+    cache = GeocodingCache(max_size=10, ttl=100, negative_ttl=10, clock=clock)
+    cache.set("94103", LOCATION)
+    cache.set("00000", None)
+    check(cache.get("94103") == (True, LOCATION), "a result is found before it expires")
+    check(cache.get("00000") == (True, None), "a postal code without a result is cached as a miss")
+
+    clock.advance(11)
+    check(cache.get("00000") == (False, None), "a cached miss expires after the negative time-to-live")
+    check(cache.get("94103") == (True, LOCATION), "a result outlives the negative time-to-live")
+    clock.advance(90)
+    check(cache.get("94103") == (False, None), "a result expires after the time-to-live")
+    check(cache.stats()["expirations"] == 2 and cache.stats()["size"] == 0, "expired entries are removed")
+
+def check_eviction():
+    cache = GeocodingCache(max_size=2, clock=SimulatedClock())
+    cache.set("1", LOCATION)
+    cache.set("2", LOCATION)
+    cache.get("1")
+    cache.set("3", LOCATION)
+    check(cache.get("2") == (False, None), "the least recently used postal code is evicted")
+    check(cache.get("1")[0] and cache.get("3")[0], "the recently used postal codes are kept")
+    check(cache.stats()["evictions"] == 1, "evictions are counted")
+
+def check_disk(path):
+    clock = SimulatedClock()
+    cache = GeocodingCache(max_size=10, ttl=100, negative_ttl=10, path=path, clock=clock)
+    cache.set("94103", LOCATION)
+    cache.set("00000", None)
+
+    restarted = GeocodingCache(max_size=10, ttl=100, negative_ttl=10, path=path, clock=clock)
+    check(restarted.get("94103") == (True, LOCATION), "a result is found on disk after a restart")
+    check(restarted.get("00000") == (True, None), "a cached miss is found on disk after a restart")
+    check(restarted.stats()["disk_hits"] == 2, "disk hits are counted")
+
+    clock.advance(11)
+    restarted = GeocodingCache(max_size=10, ttl=100, negative_ttl=10, path=path, clock=clock)
+    check(restarted.get("00000") == (False, None), "an expired miss on disk isn't returned")
+    check(restarted.get("94103") == (True, LOCATION), "a result on disk outlives the negative time-to-live")
+
+def check_concurrency(path):
+    cache = GeocodingCache(max_size=50, path=path, clock=SimulatedClock())
+
+    def work(worker):
+        for position in range(200):
+            postal_code = str((worker * 200 + position) % 100)
+            found, location = cache.get(postal_code)
+            if not found:
+                cache.set(postal_code, {"lat": float(postal_code), "lng": 0.0})
+            elif location["lat"] != float(postal_code):
+                raise AssertionError(f"wrong location for {postal_code}: {location}")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for future in [executor.submit(work, worker) for worker in range(8)]:
+            future.result()
+    stats = cache.stats()
+    check(stats["hits"] + stats["misses"] == 1600, "concurrent lookups are all counted")
+    check(all(cache.get(str(position))[0] for position in range(100)), "concurrent writes are all kept, in memory or on disk")
+
+def main():
+    argparse.ArgumentParser(description="Check the expiration, eviction and SQLite store of the geocoding cache").parse_args()
+
+    check_expiration()
+    check_eviction()
+    with tempfile.TemporaryDirectory() as directory:
+        check_disk(os.path.join(directory, "disk.db"))
+        check_concurrency(os.path.join(directory, "concurrency.db"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+This script checks the behavior of the buffered InfluxDB writer (BufferedInfluxWriter in simple_examples/influxdb_analytics.py) against a stub write API, without an InfluxDB account or network access:
+- points are written in batches of at most batch_size points, and flush waits until every queued point is written,
+- a batch that fails with a retryable error (a 5xx or 429 status, or a connection error) is retried and then written,
+- a batch that fails with any other status, or keeps failing past max_retries, is counted as failed without blocking the writer,
+- close writes what is still queued,
+- every sales point carries its own timestamp, so points of one batch with the same tags don't overwrite each other.
+It exits with a non-zero status and prints the failed check if the writer doesn't behave as expected.
+
+Run it from the root of the app directory.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from simple_examples.influxdb_analytics import BufferedInfluxWriter, build_point
+
+class StatusError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+class StubWriteApi:
+    def __init__(self, failures=()):
+        # Errors raised by the next writes, in order
+        self.failures = list(failures)
+        self.batches = []
+        self.attempts = 0
+
+    def write(self, bucket, org, record):
+        self.attempts += 1
+        if self.failures:
+            raise self.failures.pop(0)
+        self.batches.append(list(record))
+
+def payload(customer_id):
+    return {
+        "customer_id": customer_id,
+        "customer_email": "pseudonym",
+        "product_id": 1,
+        "quantity": 2,
+        "price": 10.0,
+        "order_date": "2023-05-01",
+        "postal_code": "94103",
+        "state": "CA",
+        "customer_review": "Great",
+    }
+
+def create_writer(write_api, batch_size=10, max_retries=2):
+    return BufferedInfluxWriter(
+        write_api, "bucket", "org", batch_size=batch_size, flush_interval=0.05, max_retries=max_retries, retry_interval=0.01
+    )
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+    print(f"ok: {message}")
+
+def main():
+    argparse.ArgumentParser(description="Check the batching, flush and retries of the buffered InfluxDB writer").parse_args()
+
+    write_api = StubWriteApi()
+    writer = create_writer(write_api)
+    for position in range(25):
+        writer.write(build_point(payload(position)))
+    writer.flush()
+    check(sum(len(batch) for batch in write_api.batches) == 25, "flush writes every queued point")
+    check(all(len(batch) <= 10 for batch in write_api.batches), "batches hold at most batch_size points")
+    writer.close()
+
+    write_api = StubWriteApi([StatusError(503), ConnectionError("reset")])
+    writer = create_writer(write_api)
+    writer.write(build_point(payload(1)))
+    writer.flush()
+    check(write_api.attempts == 3 and writer.points_written == 1 and writer.retries == 2, "retryable errors are retried")
+    writer.close()
+
+    write_api = StubWriteApi([StatusError(400)])
+    writer = create_writer(write_api)
+    writer.write(build_point(payload(1)))
+    writer.flush()
+    check(write_api.attempts == 1 and writer.points_failed == 1, "client errors are not retried")
+    writer.write(build_point(payload(2)))
+    writer.flush()
+    check(writer.points_written == 1, "the writer keeps writing after a failed batch")
+    writer.close()
+
+    write_api = StubWriteApi([StatusError(500)] * 3)
+    writer = create_writer(write_api, max_retries=2)
+    writer.write(build_point(payload(1)))
+    writer.flush()
+    check(write_api.attempts == 3 and writer.points_failed == 1, "a batch is dropped after max_retries retries")
+    writer.close()
+
+    write_api = StubWriteApi()
+    writer = create_writer(write_api)
+    for _ in range(5):
+        writer.write(build_point(payload(1)))
+    writer.close()
+    points = write_api.batches[0]
+    check(len(points) == 5, "close writes what is still queued")
+    check(len({point.to_line_protocol() for point in points}) == 5, "points with the same tags keep distinct timestamps")
+
+if __name__ == "__main__":
+    main()
@@ -1,75 +1,245 @@
 """
-This script generates a set of fixtures for a sales table in a database, simulating data that would be manipulated by a change data capture (CDC) system. 
+This script generates a set of fixtures for a sales table in a database, simulating data that would be manipulated by a change data capture (CDC) system.
 The script creates JSON-formatted test data that can be used to simulate the behavior of the CDC system, enabling developers to test and debug the system with realistic data without affecting the production database.
 
-In order to use this script, you don't need any special setup. Just make sure you have the required libraries installed (Faker) and run the script. It will generate a JSON file called "demo-cdc.json" containing the fixture data.
+In order to use this script, you don't need any special setup. Just make sure you have the required libraries installed (Faker) and run the script. By default it generates a JSON file called "demo-cdc.json" containing 3 records.
+
+For load testing, the script can generate millions of records. Records are written one at a time as they are generated, so memory use doesn't grow with the number of records. Use --format jsonl (or an output file ending in .jsonl) to write JSON Lines, with one record per line. The following options control the generated data:
+- --duplicate-ratio: share of records that repeat the payload of a recent record. Order ids are unique when this is set, so the ratio is exact.
+- --invalid-ratio: share of records with one field that fails schema validation (missing, null or of the wrong type).
+- --null-review-ratio: share of records without a customer review. Such records fail schema validation, since the review is a required field.
+- --postal-codes and --skew: draw postal codes (and their states) from a fixed set of this many codes, with Zipf-distributed popularity, so that a few postal codes account for most orders, as in real sales data.
+- --update-ratio and --delete-ratio: share of update (op "u") and delete (op "d") events of a recently inserted row, with the same key and the row as it was in the before image. An update changes one column, most often one that no enrichment reads (extra_id), otherwise the quantity, the review, the postal code or the email (UPDATED_FIELDS). Keys are unique when either is set.
+- --pool-size: above this many records, the values Faker generates (emails, reviews...) are drawn from pools of pre-generated values, since Faker is too slow to generate millions of them.
 """
 
+import argparse
+import itertools
 import json
 import random
 import sys
+from collections import deque
 from datetime import datetime
 from faker import Faker
 
-def generate_fixtures(num_fixtures, table_name, schema):
+SCHEMA = [
+    {"field": "customer_id", "optional": True, "type": "int32"},
+    {"field": "customer_email", "optional": True, "type": "string", "fake_format": "email"},
+    {"field": "product_id", "optional": True, "type": "int32"},
+    {"field": "quantity", "optional": True, "type": "int32"},
+    {"field": "price", "optional": True, "type": "float"},
+    {"field": "order_date", "optional": True, "type": "timestamp", "fake_format": "date"},
+    {"field": "postal_code", "optional": True, "type": "string", "fake_format": "postcode"},
+    {"field": "state", "optional": True, "type": "string", "fake_format": "state_abbr"},
+    {"field": "customer_review", "optional": True, "type": "string", "fake_format": "text"},
+    {"field": "extra_id", "optional": True, "type": "int32"},
+    {"field": "order_id", "optional": True, "type": "int32"}
+]
+
+# Fields that are never made invalid, since the pipeline needs them to build the deduplication key
+KEY_FIELDS = ("customer_id", "order_id")
+
+# Column changed by an update -> weight
+UPDATED_FIELDS = {
+    "extra_id": 0.5,
+    "quantity": 0.2,
+    "customer_review": 0.15,
+    "postal_code": 0.1,
+    "customer_email": 0.05,
+}
+# Rows that updates and deletes are drawn from
+RECENT_ROWS = 1000
+
+class PostalCodeSampler:
+    def __init__(self, faker, count, skew):
+        self.locations = []
+        for _ in range(count):
+            self.locations.append((faker.postcode(), faker.state_abbr()))
+        # Zipf weights: the postal code of rank r is 1/r^skew as popular as the first one
+        self.cum_weights = list(itertools.accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+    def sample(self):
+        return random.choices(self.locations, cum_weights=self.cum_weights)[0]
+
+def generate_records(
+    num_records,
+    table_name,
+    schema,
+    duplicate_ratio=None,
+    invalid_ratio=0.0,
+    null_review_ratio=0.0,
+    postal_codes=0,
+    skew=1.0,
+    pool_size=10000,
+    update_ratio=0.0,
+    delete_ratio=0.0,
+):
     faker = Faker()
-    fixtures = {table_name: []}
-
-    for _ in range(num_fixtures):
-        record = {
-            "key": random.randint(1, 1000),
-            "value": {
-                "payload": {
-                    "after": {
-                        field["field"]: faker.format(field["fake_format"]) if field.get("fake_format") else random.randint(1, 100)
-                        for field in schema
-                    },
-                    "before": None,
-                    "op": "r",
-                    "source": {},  # Add source fields if needed
-                    "transaction": None,
-                    "ts_ms": int(datetime.now().timestamp() * 1000)
-                },
-                "schema": {
-                    "fields": [
-                        {
-                            "field": field["field"],
-                            "optional": field["optional"],
-                            "type": field["type"]
-                        }
-                        for field in schema
-                    ],
-                    "name": f"resource_7109_171736.public.{table_name}.Envelope",
-                    "optional": False,
-                    "type": "struct"
-                }
+    envelope_schema = {
+        "fields": [
+            {
+                "field": field["field"],
+                "optional": field["optional"],
+                "type": field["type"]
             }
+            for field in schema
+        ],
+        "name": f"resource_7109_171736.public.{table_name}.Envelope",
+        "optional": False,
+        "type": "struct"
+    }
+
+    pools = {}
+    if pool_size and num_records > pool_size:
+        for field in schema:
+            if field.get("fake_format"):
+                pools[field["field"]] = [faker.format(field["fake_format"]) for _ in range(pool_size)]
+
+    postal_code_sampler = PostalCodeSampler(faker, postal_codes, skew) if postal_codes else None
+    order_ids = itertools.count(random.randint(1, 1000)) if duplicate_ratio is not None else None
+    recent_payloads = deque(maxlen=1000)
+    # Updates and deletes need unique keys, to change the row inserted with the same key
+    keys = itertools.count(1) if update_ratio or delete_ratio else None
+    # [key, after] of the recently inserted or updated rows
+    recent_rows = []
+    fields = {field["field"]: field for field in schema}
+
+    def generate_value(name):
+        if name in pools:
+            return random.choice(pools[name])
+        if fields[name].get("fake_format"):
+            return faker.format(fields[name]["fake_format"])
+        return random.randint(1, 100)
+
+    for _ in range(num_records):
+        if recent_rows and random.random() < update_ratio + delete_ratio:
+            position = random.randrange(len(recent_rows))
+            key, before = recent_rows[position]
+            if random.random() < update_ratio / (update_ratio + delete_ratio):
+                after = dict(before)
+                name = random.choices(list(UPDATED_FIELDS), weights=list(UPDATED_FIELDS.values()))[0]
+                if name == "postal_code" and postal_code_sampler is not None:
+                    after["postal_code"], after["state"] = postal_code_sampler.sample()
+                else:
+                    after[name] = generate_value(name)
+                recent_rows[position][1] = after
+                op = "u"
+            else:
+                # Swap with the last row, to remove it in constant time
+                recent_rows[position] = recent_rows[-1]
+                recent_rows.pop()
+                after = None
+                op = "d"
+            yield envelope(key, op, before, after, envelope_schema)
+            continue
+
+        if recent_payloads and duplicate_ratio and random.random() < duplicate_ratio:
+            after = dict(random.choice(recent_payloads))
+        else:
+            after = {name: generate_value(name) for name in fields}
+            if order_ids is not None:
+                after["order_id"] = next(order_ids)
+            if postal_code_sampler is not None:
+                after["postal_code"], after["state"] = postal_code_sampler.sample()
+            if null_review_ratio and random.random() < null_review_ratio:
+                after["customer_review"] = None
+            elif invalid_ratio and random.random() < invalid_ratio:
+                field = random.choice([name for name in after if name not in KEY_FIELDS])
+                corruption = random.choice(("missing", "null", "wrong_type"))
+                if corruption == "missing":
+                    del after[field]
+                elif corruption == "null":
+                    after[field] = None
+                else:
+                    after[field] = [after[field]]
+            recent_payloads.append(after)
+
+        key = next(keys) if keys is not None else random.randint(1, 1000)
+        if keys is not None:
+            recent_rows.append([key, after])
+            if len(recent_rows) > RECENT_ROWS:
+                recent_rows[random.randrange(len(recent_rows))] = recent_rows[-1]
+                recent_rows.pop()
+        yield envelope(key, "r", None, after, envelope_schema)
+
+def envelope(key, op, before, after, envelope_schema):
+    return {
+        "key": key,
+        "value": {
+            "payload": {
+                "after": after,
+                "before": before,
+                "op": op,
+                "source": {},  # Add source fields if needed
+                "transaction": None,
+                "ts_ms": int(datetime.now().timestamp() * 1000)
+            },
+            "schema": envelope_schema
         }
-        fixtures[table_name].append(record)
+    }
+
+def generate_fixtures(num_fixtures, table_name, schema):
+    return {table_name: list(generate_records(num_fixtures, table_name, schema))}
+
+def write_json(records, table_name, outfile):
+    # Same layout as json.dump(fixtures, outfile, indent=2), one record at a time
+    outfile.write("{\n" + f"  {json.dumps(table_name)}: [")
+    empty = True
+    for record in records:
+        outfile.write("\n" if empty else ",\n")
+        outfile.write("\n".join("    " + line for line in json.dumps(record, indent=2).splitlines()))
+        empty = False
+    outfile.write("]\n}" if empty else "\n  ]\n}")
 
-    return fixtures
+def write_jsonl(records, outfile):
+    for record in records:
+        outfile.write(json.dumps(record) + "\n")
 
 def main():
-    num_fixtures = 3  # Set the desired number of fixtures
-    table_name = "sales"
-    schema = [
-        {"field": "customer_id", "optional": True, "type": "int32"},
-        {"field": "customer_email", "optional": True, "type": "string", "fake_format": "email"},
-        {"field": "product_id", "optional": True, "type": "int32"},
-        {"field": "quantity", "optional": True, "type": "int32"},
-        {"field": "price", "optional": True, "type": "float"},
-        {"field": "order_date", "optional": True, "type": "timestamp", "fake_format": "date"},
-        {"field": "postal_code", "optional": True, "type": "string", "fake_format": "postcode"},
-        {"field": "state", "optional": True, "type": "string", "fake_format": "state_abbr"},
-        {"field": "customer_review", "optional": True, "type": "string", "fake_format": "text"},
-        {"field": "extra_id", "optional": True, "type": "int32"},
-        {"field": "order_id", "optional": True, "type": "int32"}
-    ]
-
-    fixtures = generate_fixtures(num_fixtures, table_name, schema)
-
-    with open("./fixtures/demo-cdc.json", "w") as outfile:
-        json.dump(fixtures, outfile, indent=2)
+    parser = argparse.ArgumentParser(description="Generate CDC fixtures for the sales table")
+    parser.add_argument("--records", type=int, default=3, help="number of records to generate")
+    parser.add_argument("--output", default="./fixtures/demo-cdc.json", help="output file, - for stdout")
+    parser.add_argument("--format", choices=["json", "jsonl"], help="output format (default: from the output file extension)")
+    parser.add_argument("--table", default="sales", help="table name")
+    parser.add_argument("--duplicate-ratio", type=float, help="share of records repeating a recent record")
+    parser.add_argument("--invalid-ratio", type=float, default=0.0, help="share of records failing schema validation")
+    parser.add_argument("--null-review-ratio", type=float, default=0.0, help="share of records without a customer review")
+    parser.add_argument("--postal-codes", type=int, default=0, help="number of distinct postal codes (default: random postal codes)")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of the postal code popularity")
+    parser.add_argument("--pool-size", type=int, default=10000, help="size of the pools of Faker values for large runs, 0 to disable")
+    parser.add_argument("--update-ratio", type=float, default=0.0, help="share of update events of a recent row")
+    parser.add_argument("--delete-ratio", type=float, default=0.0, help="share of delete events of a recent row")
+    parser.add_argument("--seed", type=int, help="random seed, for reproducible fixtures")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+        Faker.seed(args.seed)
+
+    output_format = args.format or ("jsonl" if args.output.endswith(".jsonl") else "json")
+    records = generate_records(
+        args.records,
+        args.table,
+        SCHEMA,
+        duplicate_ratio=args.duplicate_ratio,
+        invalid_ratio=args.invalid_ratio,
+        null_review_ratio=args.null_review_ratio,
+        postal_codes=args.postal_codes,
+        skew=args.skew,
+        pool_size=args.pool_size,
+        update_ratio=args.update_ratio,
+        delete_ratio=args.delete_ratio,
+    )
+
+    outfile = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        if output_format == "jsonl":
+            write_jsonl(records, outfile)
+        else:
+            write_json(records, args.table, outfile)
+    finally:
+        if outfile is not sys.stdout:
+            outfile.close()
 
 if __name__ == "__main__":
     main()
@@ -1,77 +1,224 @@
 """
-This script is used to generate and insert sample data into the 'sales' table in a PostgreSQL database. 
-It leverages the Faker library to create realistic data for various fields, such as customer email, product ID, quantity, price, order date, postal code, state, and customer review. 
+This script is used to generate and insert sample data into the 'sales' table in a PostgreSQL database.
+It leverages the Faker library to create realistic data for various fields, such as customer email, product ID, quantity, price, order date, postal code, state, and customer review.
 The script creates a table called 'sales' if it does not exist and inserts 20 records with randomly generated data. This helps developers work with realistic data when testing and debugging applications that interact with the sales table.
 
-To set up and use this script, make sure you have the required libraries installed (psycopg and Faker), and provide the correct PostgreSQL connection URL as an environment variable (POSTGRES_CONN_URL). 
+To set up and use this script, make sure you have the required libraries installed (psycopg 3 and Faker), and provide the correct PostgreSQL connection URL as an environment variable (POSTGRES_CONN_URL).
 After setting up the environment, you can run the script, and it will create the 'sales' table if it doesn't exist and populate it with 20 rows of sample data.
+
+To seed the table at production volume or drive realistic CDC traffic, the script has three modes:
+- insert (the default): one INSERT per row, as above.
+- copy: streams the rows through COPY FROM STDIN in chunks of --chunk-size rows, committing every chunk, optionally split across --workers processes, each with its own connection. Faker values are drawn from pools of pre-generated values (--pool-size), since Faker is much slower than COPY.
+- stream: runs INSERTs and UPDATEs of existing rows at a sustained --rate (statements per second) for --duration seconds, with --update-ratio of them being updates, to generate a steady flow of change events.
+Every mode reports the rows written per second.
 """
 
 #!/usr/bin/python
 
+import argparse
 import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import psycopg
 from faker import Faker
 
-# Connect to the PostgreSQL database
-conn = psycopg.connect(conninfo=os.getenv("POSTGRES_CONN_URL"))
-
-# Create a cursor object to execute SQL commands
-cursor = conn.cursor()
-
-# Create an instance of the Faker class
-faker = Faker()
-
-# Create the 'sales' table if it does not exist
-cursor.execute(
-    """CREATE TABLE IF NOT EXISTS sales (
-	    id SERIAL PRIMARY KEY,
-	    customer_id INTEGER NOT NULL,
-	    customer_email CHARACTER VARYING (100) NOT NULL,
-	    product_id INTEGER NOT NULL,
-	    quantity INTEGER NOT NULL,
-	    price DOUBLE PRECISION NOT NULL,
-	    order_date TIMESTAMP NOT NULL,
-	    postal_code CHARACTER VARYING (10) NOT NULL,
-	    state CHARACTER VARYING (2) NOT NULL,
-	    customer_review CHARACTER VARYING (255),
-        extra_id INTEGER NOT NULL,
-        order_id INTEGER NOT NULL
-    )"""
+COLUMNS = (
+    "customer_id",
+    "customer_email",
+    "product_id",
+    "quantity",
+    "price",
+    "order_date",
+    "postal_code",
+    "state",
+    "customer_review",
+    "extra_id",
+    "order_id",
 )
 
-# Use a loop to generate multiple records for sales table
-for _ in range(20):
-    # Use the Faker class to generate data
-    customer_id = faker.random_int(min=1, max=100)
-    customer_email = faker.email()
-    product_id = faker.random_int(min=1, max=10)
-    quantity = faker.random_int(min=1, max=5)
-    price = faker.random_number(digits=2)
-    order_date = faker.date_time()
-    postal_code = faker.postcode()
-    state = faker.state_abbr()
-    customer_review = faker.text(max_nb_chars=200)
-    extra_id = faker.random_int(min=1, max=10)
-    order_id = faker.random_int(min=1, max=10)
-
-    # Execute an SQL INSERT command, passing in the generated data as values
-    cursor.execute(
-        f"INSERT INTO sales (customer_id, customer_email, product_id, quantity, price, order_date, postal_code, state, customer_review, extra_id, order_id) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
-        (
-            customer_id,
+INSERT_SQL = f"INSERT INTO sales ({', '.join(COLUMNS)}) VALUES ({', '.join(['%s'] * len(COLUMNS))})"
+UPDATE_SQL = "UPDATE sales SET quantity = %s, price = %s, customer_review = %s WHERE id = %s"
+COPY_SQL = f"COPY sales ({', '.join(COLUMNS)}) FROM STDIN"
+
+def create_sales_table(conn):
+    # Create the 'sales' table if it does not exist
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS sales (
+            id SERIAL PRIMARY KEY,
+            customer_id INTEGER NOT NULL,
+            customer_email CHARACTER VARYING (100) NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            price DOUBLE PRECISION NOT NULL,
+            order_date TIMESTAMP NOT NULL,
+            postal_code CHARACTER VARYING (10) NOT NULL,
+            state CHARACTER VARYING (2) NOT NULL,
+            customer_review CHARACTER VARYING (255),
+            extra_id INTEGER NOT NULL,
+            order_id INTEGER NOT NULL
+        )"""
+    )
+    conn.commit()
+
+class SaleGenerator:
+    def __init__(self, pool_size=0, seed=None):
+        # Create an instance of the Faker class
+        self.faker = Faker()
+        self.random = random.Random(seed)
+        if seed is not None:
+            self.faker.seed_instance(seed)
+
+        self.pools = None
+        if pool_size:
+            self.pools = {
+                "customer_email": [self.faker.email() for _ in range(pool_size)],
+                "order_date": [self.faker.date_time() for _ in range(pool_size)],
+                "location": [(self.faker.postcode(), self.faker.state_abbr()) for _ in range(pool_size)],
+                "customer_review": [self.faker.text(max_nb_chars=200) for _ in range(pool_size)],
+            }
+
+    def sale(self):
+        # Use the Faker class to generate data
+        if self.pools is None:
+            customer_email = self.faker.email()
+            order_date = self.faker.date_time()
+            postal_code = self.faker.postcode()
+            state = self.faker.state_abbr()
+            customer_review = self.faker.text(max_nb_chars=200)
+        else:
+            customer_email = self.random.choice(self.pools["customer_email"])
+            order_date = self.random.choice(self.pools["order_date"])
+            postal_code, state = self.random.choice(self.pools["location"])
+            customer_review = self.random.choice(self.pools["customer_review"])
+
+        return (
+            self.random.randint(1, 100),  # customer_id
             customer_email,
-            product_id,
-            quantity,
-            price,
+            self.random.randint(1, 10),  # product_id
+            self.random.randint(1, 5),  # quantity
+            self.random.randint(0, 99),  # price
             order_date,
             postal_code,
             state,
             customer_review,
-            extra_id,
-            order_id,
-        ),
-    )
+            self.random.randint(1, 10),  # extra_id
+            self.random.randint(1, 10),  # order_id
+        )
+
+    def update(self, row_id):
+        review = self.faker.text(max_nb_chars=200) if self.pools is None else self.random.choice(self.pools["customer_review"])
+        return (self.random.randint(1, 5), self.random.randint(0, 99), review, row_id)
+
+def insert_rows(conninfo, rows):
+    generator = SaleGenerator()
+    with psycopg.connect(conninfo=conninfo) as conn:
+        with conn.cursor() as cursor:
+            for _ in range(rows):
+                # Execute an SQL INSERT command, passing in the generated data as values
+                cursor.execute(INSERT_SQL, generator.sale())
+        # Commit the changes to the database
+        conn.commit()
+    return rows
+
+def copy_rows(conninfo, rows, chunk_size, pool_size, seed=None):
+    generator = SaleGenerator(pool_size=pool_size, seed=seed)
+    written = 0
+    with psycopg.connect(conninfo=conninfo) as conn:
+        with conn.cursor() as cursor:
+            while written < rows:
+                chunk = min(chunk_size, rows - written)
+                with cursor.copy(COPY_SQL) as copy:
+                    for _ in range(chunk):
+                        copy.write_row(generator.sale())
+                # Commit every chunk, so a long load doesn't hold one huge transaction open
+                conn.commit()
+                written += chunk
+    return written
+
+def copy_rows_in_parallel(conninfo, rows, chunk_size, pool_size, workers):
+    shares = [rows // workers + (1 if worker < rows % workers else 0) for worker in range(workers)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(copy_rows, conninfo, share, chunk_size, pool_size, random.randrange(2 ** 32))
+            for share in shares
+            if share
+        ]
+        return sum(future.result() for future in futures)
+
+def stream_changes(conninfo, rate, duration, update_ratio, pool_size, tick=0.1):
+    generator = SaleGenerator(pool_size=pool_size)
+    inserted = updated = 0
+    with psycopg.connect(conninfo=conninfo) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT min(id), max(id) FROM sales")
+            min_id, max_id = cursor.fetchone()
+
+            start = time.monotonic()
+            ticks = 0
+            due = 0.0
+            while time.monotonic() - start < duration:
+                # Send the statements that are due since the previous tick in one transaction
+                due += rate * tick
+                statements, due = int(due), due - int(due)
+                inserts = []
+                updates = []
+                for _ in range(statements):
+                    if max_id is not None and generator.random.random() < update_ratio:
+                        updates.append(generator.update(generator.random.randint(min_id, max_id)))
+                    else:
+                        inserts.append(generator.sale())
+                if inserts:
+                    cursor.executemany(INSERT_SQL, inserts)
+                if updates:
+                    cursor.executemany(UPDATE_SQL, updates)
+                conn.commit()
+                inserted += len(inserts)
+                updated += len(updates)
+
+                if inserts:
+                    cursor.execute("SELECT min(id), max(id) FROM sales")
+                    min_id, max_id = cursor.fetchone()
+
+                ticks += 1
+                time.sleep(max(0.0, start + ticks * tick - time.monotonic()))
+    return inserted, updated
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate sample data in the sales table")
+    parser.add_argument("--conninfo", default=os.getenv("POSTGRES_CONN_URL"), help="PostgreSQL connection URL (default: POSTGRES_CONN_URL)")
+    parser.add_argument("--mode", choices=["insert", "copy", "stream"], default="insert", help="how to write the rows")
+    parser.add_argument("--rows", type=int, default=20, help="number of rows to write in insert and copy modes")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="rows per COPY and transaction in copy mode")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes in copy mode")
+    parser.add_argument("--pool-size", type=int, default=10000, help="pre-generated Faker values in copy and stream modes, 0 to disable")
+    parser.add_argument("--rate", type=float, default=100.0, help="statements per second in stream mode")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to run in stream mode")
+    parser.add_argument("--update-ratio", type=float, default=0.5, help="share of updates in stream mode")
+    args = parser.parse_args()
+
+    # Connect to the PostgreSQL database
+    with psycopg.connect(conninfo=args.conninfo) as conn:
+        create_sales_table(conn)
+
+    start = time.perf_counter()
+    if args.mode == "stream":
+        inserted, updated = stream_changes(args.conninfo, args.rate, args.duration, args.update_ratio, args.pool_size)
+        rows = inserted + updated
+        summary = f"{inserted} rows inserted and {updated} updated"
+    elif args.mode == "copy" and args.workers > 1:
+        rows = copy_rows_in_parallel(args.conninfo, args.rows, args.chunk_size, args.pool_size, args.workers)
+        summary = f"{rows} rows copied by {args.workers} workers"
+    elif args.mode == "copy":
+        rows = copy_rows(args.conninfo, args.rows, args.chunk_size, args.pool_size)
+        summary = f"{rows} rows copied"
+    else:
+        rows = insert_rows(args.conninfo, args.rows)
+        summary = f"{rows} rows inserted"
+    seconds = time.perf_counter() - start
+
+    print(f"{summary} in {seconds:.2f}s, {rows / seconds:,.0f} rows/sec")
 
-# Commit the changes to the database
-conn.commit()
+if __name__ == "__main__":
+    main()
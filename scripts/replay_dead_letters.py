@@ -0,0 +1,121 @@
+"""
+This script replays the records kept in the dead-letter store (see pipeline/dead_letter.py) through the transformation pipeline. Records are replayed in batches, and each record only goes through the stages that failed or dropped it and the stages that depend on them: a record that couldn't be geocoded is only geocoded again, and a record whose email couldn't be hashed is hashed and then written to InfluxDB. Records whose CDC event couldn't be parsed go through every stage.
+The records that go through are written to a JSON Lines fixture file (--output), to be fed to the app again so that they reach its destination: each of them carries an empty list of stages still to run in its CDC envelope, so main.transform passes it through without running any stage again (deduplication would drop it, and its email would be hashed twice). Records that fail again are added back to the store by the pipeline as new entries. An entry is only removed from the store once its record is written to the output file or added back to the store, so nothing is lost if the replay stops halfway or the store can't be written to.
+
+The app runs against the services configured in the environment, exactly as with meroxa apps run, so export the same secrets first (see the README). Run it from the root of the app directory, for example:
+
+python scripts/replay_dead_letters.py dead_letters.db --summary
+python scripts/replay_dead_letters.py dead_letters.db --stage geolocation --output fixtures/replayed.jsonl
+python scripts/replay_fixtures.py fixtures/replayed.jsonl
+
+or point the source of app.json at fixtures/replayed.jsonl and run the app with meroxa apps run.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay records from the dead-letter store")
+    parser.add_argument("path", nargs="?", default=os.getenv("DEAD_LETTER_PATH"), help="dead-letter store (default: DEAD_LETTER_PATH)")
+    parser.add_argument("--stage", help="only replay records that failed or were dropped in this stage")
+    parser.add_argument("--reason", help="only replay records with this reason (failed, invalid_schema or duplicate)")
+    parser.add_argument("--limit", type=int, help="stop after this many records")
+    parser.add_argument("--batch-size", type=int, default=1000, help="records per batch")
+    parser.add_argument("--output", help="JSON Lines file to write the replayed records to (required unless --summary)")
+    parser.add_argument("--summary", action="store_true", help="only print the number of entries per stage, reason and error class")
+    args = parser.parse_args()
+    if not args.path:
+        parser.error("no dead-letter store, pass its path or set DEAD_LETTER_PATH")
+    if not args.summary and not args.output:
+        parser.error("--output is required, the replayed records are only written there")
+
+    # Imported once the store is set, so that records failing again are added back to the same store
+    os.environ["DEAD_LETTER_PATH"] = args.path
+    from turbine.runtime import Record
+
+    import main as app
+    from pipeline.dead_letter import FAILED
+    from pipeline.engine import PipelineItem
+
+    dead_letter_listener = app.dead_letter_listener
+    store = dead_letter_listener.store
+    if args.summary:
+        print(f"{'count':>8}  {'reason':<16} {'stages':<32} error class")
+        for (stages, reason, error_class), count in store.summary().items():
+            print(f"{count:>8}  {reason:<16} {stages:<32} {error_class or ''}")
+        return
+
+    # Records failing again are never discarded, their entry is deleted once they are added back
+    store.block = True
+    pipeline = app.sales_pipeline
+    output = open(args.output, "w")
+    replayed = succeeded = added_back = 0
+    start = time.perf_counter()
+    for entries in batched(store.entries(stage=args.stage, reason=args.reason, limit=args.limit), args.batch_size):
+        # Records that need the same stages are replayed together
+        groups = {}
+        for entry in entries:
+            if all(stage in pipeline.stages for stage in entry.stages):
+                stages = frozenset(pipeline.dependents(entry.stages))
+            else:
+                stages = frozenset(pipeline.stages)
+            groups.setdefault(stages, []).append(entry)
+
+        written = []
+        added = []
+        discarded = store.entries_discarded
+        for stages, group in groups.items():
+            items = []
+            for entry in group:
+                record = Record(key=entry.record_key, value=entry.value, timestamp=time.time())
+                try:
+                    items.append((entry, PipelineItem(record, record.value["payload"]["after"])))
+                except Exception as e:
+                    app.handle_record_error(record, e)
+                    if FAILED in dead_letter_listener.reasons:
+                        added.append(entry.id)
+            pipeline.run([item for _, item in items], stages=stages)
+
+            for entry, item in items:
+                if item.succeeded:
+                    # Already through every stage it needed, the app only writes it to the destination
+                    item.record.value["payload"][app.REPLAY_STAGES] = []
+                    output.write(json.dumps({"key": item.record.key, "value": item.record.value}) + "\n")
+                    written.append(entry.id)
+                elif dead_letter_listener.keeps(item):
+                    added.append(entry.id)
+
+        # Only delete the entries once their records are on disk, in the output file or back in the store
+        output.flush()
+        os.fsync(output.fileno())
+        store.flush()
+        if store.entries_discarded > discarded:
+            print(f"{store.entries_discarded - discarded} record(s) couldn't be added back to the store, their entries are kept")
+            added = []
+        store.delete(written + added)
+        replayed += len(entries)
+        succeeded += len(written)
+        added_back += len(added)
+
+    output.close()
+    print(
+        f"replayed {replayed} record(s) in {time.perf_counter() - start:.2f}s: {succeeded} written to {args.output}, "
+        f"{added_back} added back to the store, {replayed - succeeded - added_back} kept ({store.count()} entries in the store)"
+    )
+
+if __name__ == "__main__":
+    main()
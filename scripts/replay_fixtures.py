@@ -0,0 +1,73 @@
+"""
+This script replays a fixture file through the data app's transform function, streaming the records in batches instead of loading the whole file like the Turbine local runtime does. It can pace the batches at a target rate, evenly or with Poisson arrivals, to simulate production arrival patterns, and it reports the throughput, how far behind the target schedule the app fell and the peak resident memory as it goes. Records written by scripts/replay_dead_letters.py only go through the stages they still need, none once they went through the replay.
+
+The app runs against the services configured in the environment, exactly as with meroxa apps run, so export the same secrets first (see the README). By default the fixture file is the source resource named in app.json. Run it from the root of the app directory, for example:
+
+python scripts/replay_fixtures.py fixtures/load.jsonl --batch-size 500 --rate 2000 --arrival poisson
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from main import transform
+from pipeline.fixture_source import FixtureSource
+
+def default_fixtures():
+    with open("app.json") as f:
+        return json.load(f)["resources"]["source_name"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay fixture records through transform")
+    parser.add_argument("fixtures", nargs="?", help="fixture file, JSON or JSON Lines (default: the source in app.json)")
+    parser.add_argument("--table", default="sales", help="table name in a JSON fixture file")
+    parser.add_argument("--batch-size", type=int, default=1000, help="records per call to transform")
+    parser.add_argument("--rate", type=float, help="target rate in records per second (default: as fast as possible)")
+    parser.add_argument("--arrival", choices=["uniform", "poisson"], default="uniform", help="arrival pattern at the target rate")
+    parser.add_argument("--limit", type=int, help="stop after this many records")
+    parser.add_argument("--no-mmap", action="store_true", help="read JSON Lines files without memory-mapping them")
+    parser.add_argument("--report-interval", type=float, default=5.0, help="seconds between progress reports")
+    args = parser.parse_args()
+
+    source = FixtureSource(
+        args.fixtures or default_fixtures(),
+        table=args.table,
+        batch_size=args.batch_size,
+        rate=args.rate,
+        arrival=args.arrival,
+        limit=args.limit,
+        use_mmap=not args.no_mmap,
+    )
+
+    records = 0
+    transform_seconds = 0.0
+    start = last_report = time.monotonic()
+
+    def report():
+        elapsed = time.monotonic() - start
+        line = f"{records} records in {elapsed:.1f}s, {records / elapsed:,.0f} records/sec"
+        if args.rate:
+            # Positive when the app can't keep up with the target rate
+            line += f", {elapsed - records / args.rate:+.2f}s behind schedule"
+        line += f", transform busy {transform_seconds / elapsed:.0%}"
+        # ru_maxrss is in kilobytes on Linux
+        line += f", peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:,.1f} MiB"
+        print(line, file=sys.stderr)
+
+    for batch in source:
+        batch_start = time.monotonic()
+        transform(batch)
+        transform_seconds += time.monotonic() - batch_start
+        records += len(batch)
+        if time.monotonic() - last_report >= args.report_interval:
+            report()
+            last_report = time.monotonic()
+    report()
+
+if __name__ == "__main__":
+    main()
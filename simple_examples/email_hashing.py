@@ -3,16 +3,169 @@ This module provides email hashing functionality for the sales records in our da
 
 The module uses Python's built-in hashlib library to perform SHA-256 hashing. No additional setup is required for this file.
 
-This module includes the following function:
+An unsalted SHA-256 digest of an email can be reversed by hashing a list of known emails, so the module also supports keyed hashing. Set the EMAIL_HASH_KEYS environment variable to a comma-separated list of key_id:secret pairs to enable it. The first key hashes new records and the others are retired keys, kept so that pseudonyms made before a key rotation can still be matched. EMAIL_HASH_ALGORITHM selects keyed BLAKE2b (blake2b, the default) or HMAC-SHA256 (hmac-sha256). With keyed hashing, the id of the key used is added to the payload as customer_email_key_id. Without keys, emails are hashed with unsalted SHA-256 as before, and a warning is logged when the module is loaded. A malformed EMAIL_HASH_KEYS (a pair without a key id or a secret, or a key id used twice) is rejected with a ValueError rather than hashing with an empty key.
 
-enrich_with_hashed_email: Takes the payload containing customer_email and hashes the email address using the SHA-256 algorithm. The hashed email is then used to replace the original email address in the payload.
+This module includes the following components:
+
+EmailPseudonymizer: Hashes emails with the configured algorithm and current key. Repeat customers are served from a bounded LRU memo (EMAIL_HASH_CACHE_SIZE entries), and pseudonymize_many hashes each distinct email of a batch only once. rotate switches to a new key, pseudonymize_with_key_id also returns the id of the key used, and pseudonyms returns the pseudonyms of an email under every known key. Its stats method reports the cache hit rate.
+enrich_with_hashed_email: Takes the payload containing customer_email and hashes the email address. The hashed email is then used to replace the original email address in the payload.
+enrich_records_with_hashed_email: The batch version of enrich_with_hashed_email, for a list of payloads.
 
 The main purpose of this module is to improve data privacy and security in the sales data by anonymizing customer email addresses. This helps ensure that the Meroxa data streaming app complies with data protection regulations and best practices while processing and storing customer data.
 """
 
 import hashlib
+import hmac
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+EMAIL_HASH_KEYS = os.getenv("EMAIL_HASH_KEYS")
+EMAIL_HASH_ALGORITHM = os.getenv("EMAIL_HASH_ALGORITHM", "blake2b")
+EMAIL_HASH_CACHE_SIZE = int(os.getenv("EMAIL_HASH_CACHE_SIZE", "10000"))
+
+ALGORITHMS = ("blake2b", "hmac-sha256")
+
+def parse_keys(value):
+    keys = []
+    for position, pair in enumerate(value.split(","), 1):
+        if not pair.strip():
+            continue
+        key_id, separator, secret = pair.partition(":")
+        key_id, secret = key_id.strip(), secret.strip()
+        # The pair itself is left out of the messages, it holds a secret
+        if not separator or not key_id:
+            raise ValueError(f"Malformed EMAIL_HASH_KEYS entry {position}, expected key_id:secret")
+        if not secret:
+            raise ValueError(f"Empty secret for email hash key {key_id!r} in EMAIL_HASH_KEYS")
+        if key_id in (existing for existing, _ in keys):
+            raise ValueError(f"Email hash key {key_id!r} appears more than once in EMAIL_HASH_KEYS")
+        keys.append((key_id, secret.encode("utf-8")))
+    return keys
+
+def hash_email(email, algorithm="sha256", key=None):
+    data = email.encode("utf-8")
+    if algorithm == "blake2b":
+        return hashlib.blake2b(data, key=key, digest_size=32).hexdigest()
+    if algorithm == "hmac-sha256":
+        return hmac.new(key, data, hashlib.sha256).hexdigest()
+    return hashlib.sha256(data).hexdigest()
+
+class EmailPseudonymizer:
+    def __init__(self, keys=(), algorithm="blake2b", cache_size=10000):
+        # keys: (key_id, secret) pairs, the first one is the current key
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown email hash algorithm {algorithm!r}")
+        self.keyed_algorithm = algorithm
+        self.keys = list(keys)
+        for _, secret in self.keys:
+            self._check_key(secret)
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def algorithm(self):
+        # Without a key there is nothing to keep secret, fall back to plain SHA-256
+        return self.keyed_algorithm if self.keys else "sha256"
+
+    @property
+    def key_id(self):
+        return self.keys[0][0] if self.keys else None
+
+    def pseudonymize(self, email):
+        return self.pseudonymize_many([email])[0]
+
+    def pseudonymize_many(self, emails):
+        _, pseudonyms = self.pseudonymize_with_key_id(emails)
+        return pseudonyms
+
+    def pseudonymize_with_key_id(self, emails):
+        results = {}
+        to_hash = []
+        with self._lock:
+            for email in emails:
+                if email in results:
+                    # Repeated within the batch, hashed only once
+                    self.hits += 1
+                    continue
+                pseudonym = self._cache.get(email)
+                if pseudonym is not None:
+                    self._cache.move_to_end(email)
+                    results[email] = pseudonym
+                    self.hits += 1
+                else:
+                    results[email] = None
+                    to_hash.append(email)
+                    self.misses += 1
+            current_key = self.keys[0] if self.keys else (None, None)
+            algorithm = self.algorithm
+
+        # Hash outside the lock, so concurrent batches don't wait for each other
+        hashed = [hash_email(email, algorithm, current_key[1]) for email in to_hash]
+
+        with self._lock:
+            # Unless the key was rotated in the meantime
+            still_current = current_key == (self.keys[0] if self.keys else (None, None))
+            for email, pseudonym in zip(to_hash, hashed):
+                results[email] = pseudonym
+                if self.cache_size and still_current:
+                    self._cache[email] = pseudonym
+                    self._cache.move_to_end(email)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return current_key[0], [results[email] for email in emails]
+
+    def pseudonyms(self, email):
+        # The pseudonym of the email under every known key, to match records hashed before a rotation
+        if not self.keys:
+            return {None: hash_email(email)}
+        return {key_id: hash_email(email, self.algorithm, secret) for key_id, secret in self.keys}
+
+    def rotate(self, key_id, secret):
+        self._check_key(secret)
+        with self._lock:
+            self.keys.insert(0, (key_id, secret))
+            # Pseudonyms made with the previous key must not be served anymore
+            self._cache.clear()
+
+    def _check_key(self, secret):
+        if self.keyed_algorithm == "blake2b" and len(secret) > 64:
+            raise ValueError("BLAKE2b keys can't be longer than 64 bytes")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "cache_size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "algorithm": self.algorithm,
+            "key_id": self.key_id,
+        }
+
+if not EMAIL_HASH_KEYS:
+    logging.getLogger(__name__).warning(
+        "EMAIL_HASH_KEYS is not set, emails are hashed with unsalted SHA-256, which a list of known emails can reverse"
+    )
+
+email_pseudonymizer = EmailPseudonymizer(
+    keys=parse_keys(EMAIL_HASH_KEYS) if EMAIL_HASH_KEYS else (),
+    algorithm=EMAIL_HASH_ALGORITHM,
+    cache_size=EMAIL_HASH_CACHE_SIZE,
+)
 
 def enrich_with_hashed_email(payload):
-    email = payload["customer_email"]
-    hashed_email = hashlib.sha256(email.encode("utf-8")).hexdigest()
-    payload["customer_email"] = hashed_email
+    enrich_records_with_hashed_email([payload])
+
+def enrich_records_with_hashed_email(payloads, pseudonymizer=email_pseudonymizer):
+    key_id, pseudonyms = pseudonymizer.pseudonymize_with_key_id([payload["customer_email"] for payload in payloads])
+    for payload, pseudonym in zip(payloads, pseudonyms):
+        payload["customer_email"] = pseudonym
+        if key_id is not None:
+            payload["customer_email_key_id"] = key_id
@@ -7,30 +7,254 @@ This module includes the following functions:
 
 get_geolocation: Takes a postal code as input and queries the Google Maps Geocoding API to retrieve the corresponding geolocation data (latitude and longitude). Returns the geolocation data as a dictionary or None if the API call fails or the data is not available.
 
-enrich_with_geolocation: Takes the payload and enriches it with geolocation data. It retrieves the postal code from the payload, calls the get_geolocation function, and adds the latitude and longitude to the payload if the geolocation data is available.
+GeocodingCache: A tiered cache for geocoding results. Lookups go to an in-process LRU cache with a time-to-live first, and to an optional on-disk SQLite store that survives restarts second. Postal codes the API has no result for are cached as well (with a shorter time-to-live) so that misses don't refetch. Hit, miss and eviction counters are available from its stats method. The in-memory cache and the SQLite store have their own locks, so lookups answered from memory never wait for a disk read or write.
+
+get_cached_geolocation: Like get_geolocation, but answers from the offline postal code index and the GeocodingCache when it can, and only queries the API when neither has the postal code. Concurrent lookups of the same postal code are merged into a single API call.
+
+enrich_with_geolocation: Takes the payload and enriches it with geolocation data. It retrieves the postal code from the payload, calls the get_cached_geolocation function, and adds the latitude and longitude to the payload if the geolocation data is available.
+
+enrich_records_with_geolocation: The batch version of enrich_with_geolocation. It collects the distinct postal codes of a list of payloads, resolves them concurrently through a pooled HTTP session and writes the coordinates back to every payload, so the batch latency scales with the number of distinct postal codes rather than with the number of records. It returns the lookup error for each payload (None if the lookup succeeded).
+
+The cache can be configured with the following environment variables: GEOCODING_CACHE_SIZE (maximum number of postal codes kept in memory), GEOCODING_CACHE_TTL and GEOCODING_NEGATIVE_CACHE_TTL (in seconds), and GEOCODING_CACHE_PATH (path of the SQLite file, leave unset to keep the cache in memory only). GEOCODING_API_URL overrides the Geocoding API endpoint, for example to point it at a local stub server. GEOCODING_CONCURRENCY limits the number of concurrent API calls (and pooled connections) of the batch path. GEOCODING_TIMEOUT (in seconds) bounds how long an API call may wait to connect and for each read, so that a stalled connection fails the lookup instead of holding a worker thread, and the batch, forever.
+
+For high-volume US sales, set POSTAL_CODE_INDEX_PATH to an index built with scripts/build_postal_code_index.py to resolve postal codes locally, without any network call (see the postal_code_index module). The remote API is then only used as a fallback for postal codes the index doesn't have. Any object with a lookup(postal_code) method can be plugged in as postal_code_index.
 
 The main purpose of this module is to add geospatial context to our sales data by enriching it with geolocation information. This allows us to perform geospatial analysis, such as identifying regional trends, visualizing sales on a map, and optimizing delivery routes. By adding geolocation data to our sales records, we can enhance our understanding of the data and improve decision-making across various business areas.
 """
 
 import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from simple_examples.postal_code_index import PostalCodeIndex
 
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
+GEOCODING_API_URL = os.getenv("GEOCODING_API_URL", "https://maps.googleapis.com/maps/api/geocode/json")
 
-def get_geolocation(postal_code):
-    url = f"https://maps.googleapis.com/maps/api/geocode/json?address={postal_code}&key={GOOGLE_MAPS_API_KEY}"
-    response = requests.get(url)
+GEOCODING_CACHE_SIZE = int(os.getenv("GEOCODING_CACHE_SIZE", "10000"))
+GEOCODING_CACHE_TTL = float(os.getenv("GEOCODING_CACHE_TTL", "86400"))
+GEOCODING_NEGATIVE_CACHE_TTL = float(os.getenv("GEOCODING_NEGATIVE_CACHE_TTL", "3600"))
+GEOCODING_CACHE_PATH = os.getenv("GEOCODING_CACHE_PATH")
+GEOCODING_CONCURRENCY = int(os.getenv("GEOCODING_CONCURRENCY", "8"))
+GEOCODING_TIMEOUT = float(os.getenv("GEOCODING_TIMEOUT", "5"))
+POSTAL_CODE_INDEX_PATH = os.getenv("POSTAL_CODE_INDEX_PATH")
+
+# Local postal code -> geolocation backend, consulted before the cache and the API
+postal_code_index = PostalCodeIndex.load(POSTAL_CODE_INDEX_PATH) if POSTAL_CODE_INDEX_PATH else None
+
+# Reuse connections to the Geocoding API instead of opening one per call
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_maxsize=GEOCODING_CONCURRENCY))
+session.mount("http://", HTTPAdapter(pool_maxsize=GEOCODING_CONCURRENCY))
+
+_executor = None
+_executor_lock = threading.Lock()
+# postal code -> Future of the lookup that is currently in flight
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+class GeocodingCache:
+    def __init__(self, max_size=10000, ttl=86400, negative_ttl=3600, path=None, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        # postal code -> (expires_at, location), location is None for negative results
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Guards the SQLite connection, never held together with _lock
+        self._db_lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS geocoding_cache (
+                    postal_code TEXT PRIMARY KEY,
+                    latitude REAL,
+                    longitude REAL,
+                    expires_at REAL NOT NULL
+                )"""
+            )
+            self._db.commit()
+
+    def get(self, postal_code):
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(postal_code)
+            if entry is not None:
+                expires_at, location = entry
+                if expires_at > now:
+                    self._entries.move_to_end(postal_code)
+                    self.hits += 1
+                    return True, location
+                del self._entries[postal_code]
+                self.expirations += 1
+
+        if self._db is not None:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT latitude, longitude, expires_at FROM geocoding_cache WHERE postal_code = ?",
+                    (postal_code,),
+                ).fetchone()
+            if row is not None and row[2] > now:
+                location = None if row[0] is None else {"lat": row[0], "lng": row[1]}
+                with self._lock:
+                    # Unless a newer result was set in the meantime
+                    if postal_code not in self._entries:
+                        self._remember(postal_code, row[2], location)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return True, location
+
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def set(self, postal_code, location):
+        ttl = self.ttl if location is not None else self.negative_ttl
+        expires_at = self.clock() + ttl
+        with self._lock:
+            self._remember(postal_code, expires_at, location)
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO geocoding_cache (postal_code, latitude, longitude, expires_at) VALUES (?, ?, ?, ?)",
+                    (
+                        postal_code,
+                        location["lat"] if location is not None else None,
+                        location["lng"] if location is not None else None,
+                        expires_at,
+                    ),
+                )
+                self._db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _remember(self, postal_code, expires_at, location):
+        self._entries[postal_code] = (expires_at, location)
+        self._entries.move_to_end(postal_code)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+geocoding_cache = GeocodingCache(
+    max_size=GEOCODING_CACHE_SIZE,
+    ttl=GEOCODING_CACHE_TTL,
+    negative_ttl=GEOCODING_NEGATIVE_CACHE_TTL,
+    path=GEOCODING_CACHE_PATH,
+)
+
+def _fetch_geolocation(postal_code):
+    # Returns the location and whether the answer may be cached. Only a
+    # definitive "no result" is cached as a miss, not a failed request.
+    url = f"{GEOCODING_API_URL}?address={postal_code}&key={GOOGLE_MAPS_API_KEY}"
+    response = session.get(url, timeout=GEOCODING_TIMEOUT)
 
     if response.status_code == 200:
         data = response.json()
         if data["status"] == "OK":
-            return data["results"][0]["geometry"]["location"]
-    return None
+            return data["results"][0]["geometry"]["location"], True
+        return None, data["status"] == "ZERO_RESULTS"
+    return None, False
+
+def get_geolocation(postal_code):
+    location, _ = _fetch_geolocation(postal_code)
+    return location
+
+def get_cached_geolocation(postal_code, cache=geocoding_cache):
+    postal_code = str(postal_code).strip()
+    if postal_code_index is not None:
+        location = postal_code_index.lookup(postal_code)
+        if location is not None:
+            return location
+
+    found, location = cache.get(postal_code)
+    if found:
+        return location
+
+    # Only one caller fetches a given postal code at a time, the others wait for its result
+    with _inflight_lock:
+        future = _inflight.get(postal_code)
+        is_leader = future is None
+        if is_leader:
+            future = Future()
+            _inflight[postal_code] = future
+    if not is_leader:
+        return future.result()
+
+    try:
+        location, cacheable = _fetch_geolocation(postal_code)
+        if cacheable:
+            cache.set(postal_code, location)
+        future.set_result(location)
+        return location
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[postal_code]
 
 def enrich_with_geolocation(payload):
     postal_code = payload["postal_code"]
-    geolocation = get_geolocation(postal_code)
+    geolocation = get_cached_geolocation(postal_code)
 
     if geolocation:
         payload["latitude"] = geolocation["lat"]
         payload["longitude"] = geolocation["lng"]
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=GEOCODING_CONCURRENCY, thread_name_prefix="geocoding")
+        return _executor
+
+def enrich_records_with_geolocation(payloads, cache=geocoding_cache):
+    postal_codes = {str(payload["postal_code"]).strip() for payload in payloads}
+    executor = _get_executor()
+    futures = {}
+    for postal_code in postal_codes:
+        location = postal_code_index.lookup(postal_code) if postal_code_index is not None else None
+        if location is not None:
+            # Answered locally, no need to hand it to the thread pool
+            futures[postal_code] = Future()
+            futures[postal_code].set_result(location)
+        else:
+            futures[postal_code] = executor.submit(get_cached_geolocation, postal_code, cache)
+
+    errors = []
+    for payload in payloads:
+        future = futures[str(payload["postal_code"]).strip()]
+        error = future.exception()
+        errors.append(error)
+
+        geolocation = future.result() if error is None else None
+        if geolocation:
+            payload["latitude"] = geolocation["lat"]
+            payload["longitude"] = geolocation["lng"]
+    return errors
@@ -3,9 +3,21 @@ This module provides functionality to write sales records to InfluxDB, a time-se
 
 To set up this file, you need to have an InfluxDB account with a bucket and an API token. You can sign up for an account on InfluxDB's website (https://www.influxdata.com/). Set the following environment variables with the corresponding values from your InfluxDB account: INFLUXDB_TOKEN, INFLUXDB_ORG, INFLUXDB_URL, and INFLUXDB_BUCKET.
 
-This module includes the following function:
+This module includes the following components:
 
-write_data_to_influxdb: Takes a payload dictionary representing a sales record and writes it to InfluxDB as a time-series point. The function creates a Point object with the sales data, tags, and fields, and then uses the InfluxDB write API to write the point to the specified bucket and organization.
+create_write_api: Creates the InfluxDB client and its synchronous write API. The module-level writer only calls it when it writes its first batch, so importing the module doesn't connect to InfluxDB.
+
+BufferedInfluxWriter: Buffers points in a bounded queue and writes them to InfluxDB from a background thread (see pipeline/batch_writer.py), in batches of up to batch_size points or every flush_interval seconds, whichever comes first. Failed batches are retried with exponential backoff and jitter. When the queue is full, writers block until there is room again (backpressure) instead of buffering without limit. The writer is flushed and closed when the process exits.
+
+build_point: Takes a payload dictionary representing a sales record and creates the Point object with the sales data, tags, and fields, timestamped when it is created. Without a timestamp, InfluxDB would stamp every point of a batch with the time the batch is written, and points of a batch with the same tags would overwrite each other.
+
+write_data_to_influxdb: Takes a payload dictionary representing a sales record and queues it to be written to InfluxDB as a time-series point. The HTTP round trip to InfluxDB happens on the writer thread, outside of the transform loop.
+
+build_aggregate_point: Creates the Point object for the aggregated sales of one state and product in a time window (see advanced_examples/windowed_aggregation.py), timestamped with the start of the window. It is tagged with the worker that aggregated it, since each worker only aggregates its own share of the records of a window.
+
+write_aggregates_to_influxdb: Queues the aggregate points of a closed window to be written to InfluxDB, through the same writer as the per-record points.
+
+The batching can be tuned with the INFLUXDB_BATCH_SIZE, INFLUXDB_FLUSH_INTERVAL (in seconds) and INFLUXDB_MAX_QUEUE_SIZE environment variables.
 
 By storing the sales data in InfluxDB, we can take advantage of its powerful time-series analysis capabilities to perform real-time analytics and monitoring. This can help us identify trends, detect anomalies, and optimize our sales operations based on historical patterns and current conditions.
 """
@@ -14,21 +26,118 @@ By storing the sales data in InfluxDB, we can take advantage of its powerful tim
 # Go to influxdata.com in the sales-demo bucket
 # SELECT * FROM "sales_data"
 
+import atexit
 import os
+import random
+import time
 from influxdb_client import InfluxDBClient, Point, WritePrecision
 from influxdb_client.client.write_api import SYNCHRONOUS
 from typing import Dict
 
+from pipeline.batch_writer import BatchWriter
+
 token = os.getenv("INFLUXDB_TOKEN")
-org = "sales-demo"
-url = "https://us-east-1-1.aws.cloud2.influxdata.com"
-bucket = "sales-demo"
+org = os.getenv("INFLUXDB_ORG", "sales-demo")
+url = os.getenv("INFLUXDB_URL", "https://us-east-1-1.aws.cloud2.influxdata.com")
+bucket = os.getenv("INFLUXDB_BUCKET", "sales-demo")
 
-write_client = InfluxDBClient(url=url, token=token, org=org)
-write_api = write_client.write_api(write_options=SYNCHRONOUS)
+INFLUXDB_BATCH_SIZE = int(os.getenv("INFLUXDB_BATCH_SIZE", "500"))
+INFLUXDB_FLUSH_INTERVAL = float(os.getenv("INFLUXDB_FLUSH_INTERVAL", "1.0"))
+INFLUXDB_MAX_QUEUE_SIZE = int(os.getenv("INFLUXDB_MAX_QUEUE_SIZE", "10000"))
 
-def write_data_to_influxdb(payload: Dict):
-    point = (
+def create_write_api():
+    write_client = InfluxDBClient(url=url, token=token, org=org)
+    return write_client.write_api(write_options=SYNCHRONOUS)
+
+class BufferedInfluxWriter:
+    def __init__(
+        self,
+        write_api,
+        bucket,
+        org,
+        batch_size=500,
+        flush_interval=1.0,
+        max_queue_size=10000,
+        max_retries=5,
+        retry_interval=0.5,
+        max_retry_interval=10.0,
+        write_api_factory=None,
+    ):
+        # Without a write API, write_api_factory creates one on the writer thread before the first batch
+        self.write_api = write_api
+        self.write_api_factory = write_api_factory
+        self.bucket = bucket
+        self.org = org
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+
+        self.points_written = 0
+        self.points_failed = 0
+        self.batches_written = 0
+        self.retries = 0
+
+        self._writer = BatchWriter(
+            self._write_batch, "influxdb-writer", batch_size=batch_size, flush_interval=flush_interval, max_queue_size=max_queue_size
+        )
+
+    def write(self, point, timeout=None):
+        if self._writer.closed:
+            raise RuntimeError("InfluxDB writer is closed")
+        # Blocks while the queue is full, which slows the producer down to the write rate
+        self._writer.put(point, timeout=timeout)
+
+    def flush(self):
+        self._writer.flush()
+
+    def close(self):
+        self._writer.close()
+
+    def stats(self):
+        return {
+            "queued": self._writer.qsize(),
+            "points_written": self.points_written,
+            "points_failed": self.points_failed,
+            "batches_written": self.batches_written,
+            "retries": self.retries,
+        }
+
+    def _write_batch(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self.write_api is None:
+                    self.write_api = self.write_api_factory()
+                self.write_api.write(bucket=self.bucket, org=self.org, record=batch)
+                self.points_written += len(batch)
+                self.batches_written += 1
+                return
+            except Exception as e:
+                status = getattr(e, "status", None)
+                retryable = status is None or status == 429 or status >= 500
+                if not retryable or attempt == self.max_retries:
+                    self.points_failed += len(batch)
+                    print(f"Error writing {len(batch)} point(s) to InfluxDB: {e}")
+                    return
+                self.retries += 1
+                # Exponential backoff with full jitter
+                backoff = min(self.max_retry_interval, self.retry_interval * 2 ** attempt)
+                time.sleep(random.uniform(0, backoff))
+
+# The InfluxDB client is only created when the first points are written
+influxdb_writer = BufferedInfluxWriter(
+    None,
+    bucket,
+    org,
+    batch_size=INFLUXDB_BATCH_SIZE,
+    flush_interval=INFLUXDB_FLUSH_INTERVAL,
+    max_queue_size=INFLUXDB_MAX_QUEUE_SIZE,
+    write_api_factory=create_write_api,
+)
+# Write out whatever is still buffered when the app shuts down
+atexit.register(influxdb_writer.close)
+
+def build_point(payload: Dict):
+    return (
         Point("sales_data")
         .tag("customer_id", payload['customer_id'])
         .tag("customer_email", payload['customer_email'])
@@ -39,5 +148,26 @@ def write_data_to_influxdb(payload: Dict):
         .field("postal_code", payload['postal_code'])
         .field("state", payload['state'])
         .field("customer_review", payload['customer_review'])
+        # Stamped when queued, the server would stamp a whole batch with the time it is written
+        .time(time.time_ns(), WritePrecision.NS)
     )
-    write_api.write(bucket=bucket, org=org, record=point)
+
+def write_data_to_influxdb(payload: Dict):
+    influxdb_writer.write(build_point(payload))
+
+def build_aggregate_point(window_start, state, product_id, fields: Dict, worker):
+    point = (
+        Point("sales_aggregates")
+        .tag("state", state)
+        .tag("product_id", product_id)
+        # Otherwise the partial aggregates of the other workers for the window would be overwritten
+        .tag("worker", worker)
+        .time(int(window_start), WritePrecision.S)
+    )
+    for name, value in fields.items():
+        point.field(name, value)
+    return point
+
+def write_aggregates_to_influxdb(window_start, aggregates: Dict, worker):
+    for (state, product_id), fields in aggregates.items():
+        influxdb_writer.write(build_aggregate_point(window_start, state, product_id, fields, worker))
@@ -0,0 +1,84 @@
+"""
+This module provides a local, compact postal code to geolocation index that can be used to enrich sales records with latitude and longitude without calling a remote geocoder. It is meant for high-volume US sales, where depending on the Google Maps Geocoding API on the hot path is too slow and too expensive.
+
+The index is a single binary file that is memory-mapped when loaded, so starting a worker only maps the file and the operating system pages in the parts that lookups touch. It holds the 5-digit US ZIP codes as a sorted array of unsigned 32-bit integers, followed by their latitudes and longitudes as 32-bit floats (about 1 meter of precision). A lookup is a binary search over the sorted codes, so it takes O(log n) time. ZIP+4 codes (12345-6789) are looked up by their first five digits, and anything else that isn't exactly five digits, such as 123456 or 12345abc, is never found.
+
+To set up this file, build an index with scripts/build_postal_code_index.py (for example from the US Census ZCTA Gazetteer file) and set the POSTAL_CODE_INDEX_PATH environment variable to its path. The geolocation_enrichment module then answers from the index first and only calls the Geocoding API for postal codes the index doesn't have.
+
+This module includes the following components:
+
+normalize_postal_code: Converts a postal code to the integer key used by the index, or returns None if it isn't a US ZIP code.
+write_postal_code_index: Writes an index file from (postal_code, latitude, longitude) entries.
+PostalCodeIndex: Loads an index file with memory mapping and looks up the geolocation of a postal code.
+"""
+
+import numpy as np
+
+INDEX_MAGIC = b"PCIDX\x00\x00\x01"
+HEADER_SIZE = 16
+
+def _is_digits(value, length):
+    return len(value) == length and value.isascii() and value.isdigit()
+
+def normalize_postal_code(postal_code):
+    # Exactly five digits, or ZIP+4 (12345-6789)
+    zip_code, separator, plus_four = str(postal_code).strip().partition("-")
+    if not _is_digits(zip_code, 5) or (separator and not _is_digits(plus_four, 4)):
+        return None
+    return int(zip_code)
+
+def write_postal_code_index(entries, path):
+    # Later entries for the same postal code replace earlier ones
+    locations = {}
+    for postal_code, latitude, longitude in entries:
+        code = normalize_postal_code(postal_code)
+        if code is not None:
+            locations[code] = (latitude, longitude)
+
+    codes = np.array(sorted(locations), dtype="<u4")
+    coordinates = np.array([locations[code] for code in codes], dtype="<f4").reshape(-1, 2)
+
+    with open(path, "wb") as outfile:
+        outfile.write(INDEX_MAGIC)
+        outfile.write(np.array([len(codes)], dtype="<u8").tobytes())
+        outfile.write(codes.tobytes())
+        # Keep the coordinates 8-byte aligned
+        if len(codes) % 2:
+            outfile.write(b"\x00" * 4)
+        outfile.write(coordinates.tobytes())
+    return len(codes)
+
+class PostalCodeIndex:
+    def __init__(self, codes, coordinates):
+        self.codes = codes
+        self.coordinates = coordinates
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as infile:
+            header = infile.read(HEADER_SIZE)
+        if len(header) != HEADER_SIZE or header[:8] != INDEX_MAGIC:
+            raise ValueError(f"{path} is not a postal code index")
+
+        count = int(np.frombuffer(header[8:], dtype="<u8")[0])
+        if count == 0:
+            return cls(np.empty(0, dtype="<u4"), np.empty((0, 2), dtype="<f4"))
+
+        codes = np.memmap(path, dtype="<u4", mode="r", offset=HEADER_SIZE, shape=(count,))
+        coordinates_offset = HEADER_SIZE + 4 * (count + count % 2)
+        coordinates = np.memmap(path, dtype="<f4", mode="r", offset=coordinates_offset, shape=(count, 2))
+        return cls(codes, coordinates)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def lookup(self, postal_code):
+        code = normalize_postal_code(postal_code)
+        if code is None:
+            return None
+
+        position = int(np.searchsorted(self.codes, code))
+        if position < len(self.codes) and self.codes[position] == code:
+            latitude, longitude = self.coordinates[position]
+            return {"lat": float(latitude), "lng": float(longitude)}
+        return None